@@ -0,0 +1,326 @@
+"""
+    Benchmark of every stage of the pipeline over the bundled images.
+
+    Each stage (decode, segmentation, identification, text_extraction, mapping,
+    visualization, summarization) is run over the images one at a time and for
+    each one we report:
+
+        load_s          time to load the model (first use, through the registry)
+        p50_ms, p95_ms  latency per image
+        images_per_sec  throughput of the stage on its own
+        rss_delta_mb    how much the stage grew the resident memory: the highest
+                        RSS seen after any of its images (or its model load)
+                        minus the RSS right before it. ru_maxrss wouldn't do,
+                        that's the peak of the whole process so every stage would
+                        inherit the peaks of the stages before it
+
+    Summarization talks to benchmarks/mock_llm_server.py with a fixed delay, so the
+    numbers show our overhead and not the mood of a free LLM endpoint.
+
+    The results are saved as JSON. With a baseline (a results file saved earlier,
+    by default benchmarks/baseline.json) every metric is compared and anything
+    worse than the tolerance is flagged as a regression.
+
+    Usage (from the root folder):
+        python3 benchmarks/benchmark.py --limit 32
+        python3 benchmarks/benchmark.py --stages segmentation,text_extraction --limit 16
+        python3 benchmarks/benchmark.py --stages segmentation,identification --backend onnx --quantize static
+        python3 benchmarks/benchmark.py --stages segmentation,identification --seg-config mode=fast --id-config imgsz=320
+        python3 benchmarks/benchmark.py --save-baseline
+        python3 benchmarks/benchmark.py --fail-on-regression --tolerance 0.15
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+from models import model_registry, onnx_backend
+from models.segmentation_model import SegmentationModel
+from models.identification_model import IdentificationModel
+from models.text_extraction_model import TextExtractionModel
+from models.summarization_model import SummarizationModel
+from models.inference_config import InferenceConfig
+from utils.data_mapping import DataMapping
+from utils.image_input import ImageInput
+from utils.batch_pipeline import collect_image_paths
+from utils.result_cache import package_version
+from utils import metrics
+from benchmarks.mock_llm_server import MockLLMServer
+
+
+STAGES = ("decode", "segmentation", "identification", "text_extraction", "mapping", "visualization", "summarization")
+
+# Which way is better for every metric, used by compare()
+LOWER_IS_BETTER = ("load_s", "p50_ms", "p95_ms", "rss_delta_mb")
+HIGHER_IS_BETTER = ("images_per_sec",)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+class RSSTracker:
+    """
+    Highest resident memory seen since start, sampled after every image of a stage.
+    """
+    def __init__(self) -> None:
+        self.start = metrics.rss_bytes()
+        self.peak = self.start
+
+    def sample(self):
+        rss = metrics.rss_bytes()
+        if rss is not None and self.peak is not None:
+            self.peak = max(self.peak, rss)
+
+    def delta_mb(self):
+        if self.start is None:
+            return None
+        return round((self.peak - self.start) / 1024 / 1024, 1)
+
+
+def summarize_timings(timings, load_s=None):
+    timings = np.asarray(timings, dtype=np.float64)
+    return {
+        "n": int(timings.size),
+        "load_s": None if load_s is None else round(load_s, 3),
+        "p50_ms": round(float(np.percentile(timings, 50)) * 1000, 2),
+        "p95_ms": round(float(np.percentile(timings, 95)) * 1000, 2),
+        "mean_ms": round(float(timings.mean()) * 1000, 2),
+        "images_per_sec": round(timings.size / timings.sum(), 2) if timings.sum() > 0 else None,
+    }
+
+
+def load_time(name):
+    start = time.perf_counter()
+    model_registry.get(name)
+    return time.perf_counter() - start
+
+
+class Benchmark:
+    def __init__(self, img_paths, stages=STAGES, warmup=1, llm_delay=0.2, backend="torch", quantize=None,
+                 seg_config=None, id_config=None) -> None:
+        self.img_paths = img_paths
+        self.stages = stages
+        self.warmup = warmup
+        self.llm_delay = llm_delay
+
+        # Backend of the two YOLO models, see models/onnx_backend.py. load_s of
+        # an ONNX model includes the export (and quantization) the first time
+        self.backend = backend
+        self.quantize = quantize
+
+        # InferenceConfigs of the two YOLO models, the defaults when None
+        self.seg_config = seg_config or InferenceConfig()
+        self.id_config = id_config or InferenceConfig()
+
+        # Outputs of every stage, the later stages (mapping, visualization,
+        # summarization) are fed the outputs of the earlier ones
+        self.outputs = dict()
+
+    def time_stage(self, name, fn, inputs, load_s=None, rss=None):
+        # rss is started before the model load by the stages that load one
+        rss = rss or RSSTracker()
+
+        # The first few calls pay for lazy initialisation (CUDA/oneDNN kernels,
+        # allocator growth) and are not counted
+        for item in inputs[:self.warmup]:
+            fn(*item)
+            rss.sample()
+
+        timings, outputs = [], []
+        for item in inputs:
+            start = time.perf_counter()
+            outputs.append(fn(*item))
+            timings.append(time.perf_counter() - start)
+            rss.sample()
+        self.outputs[name] = outputs
+
+        result = summarize_timings(timings, load_s)
+        result["rss_delta_mb"] = rss.delta_mb()
+        print(f"[INFO] {name}: p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, "
+              f"{result['images_per_sec']} images/sec, RSS +{result['rss_delta_mb']} MB")
+        return result
+
+    def needs(self, *names):
+        # The later stages need the outputs of the models even when those
+        # aren't being benchmarked themselves
+        for name in names:
+            if name not in self.outputs:
+                self.run_stage(name)
+
+    def run_stage(self, name):
+        images = [(image,) for image in self.outputs.get("decode") or []]
+        if name == "decode":
+            return self.time_stage(name, ImageInput.from_path, [(path,) for path in self.img_paths])
+
+        if name == "segmentation":
+            self.needs("decode")
+            rss = RSSTracker()
+            load_s = load_time(onnx_backend.registry_name("segmentation", self.backend, self.quantize))
+            model = SegmentationModel(backend=self.backend, quantize=self.quantize, config=self.seg_config)
+            return self.time_stage(name, model.predict, images, load_s, rss)
+
+        if name == "identification":
+            self.needs("decode")
+            rss = RSSTracker()
+            load_s = load_time(onnx_backend.registry_name("identification", self.backend, self.quantize))
+            model = IdentificationModel(backend=self.backend, quantize=self.quantize, config=self.id_config)
+            return self.time_stage(name, model.generate_descriptions, images, load_s, rss)
+
+        if name == "text_extraction":
+            self.needs("decode")
+            rss = RSSTracker()
+            load_s = load_time("text_extraction")
+            model = TextExtractionModel()
+            return self.time_stage(name, model.extract_text, images, load_s, rss)
+
+        if name == "mapping":
+            self.needs("segmentation", "identification", "text_extraction")
+            data_mapping = DataMapping()
+            inputs = [(seg_data, id_data, text, None) for seg_data, id_data, text in
+                      zip(self.outputs["segmentation"], self.outputs["identification"], self.outputs["text_extraction"])]
+            return self.time_stage(name, data_mapping.mapping, inputs)
+
+        if name == "visualization":
+            self.needs("mapping")
+            data_mapping = DataMapping()
+
+            def visualize(final_dict, img_path):
+                if final_dict:
+                    data_mapping.visualize(final_dict, img_path)
+                plt.close("all")
+
+            inputs = list(zip(self.outputs["mapping"], self.img_paths))
+            return self.time_stage(name, visualize, inputs)
+
+        if name == "summarization":
+            self.needs("segmentation", "identification", "text_extraction")
+            inputs = [(seg_data[1], id_data[0], text) for seg_data, id_data, text in
+                      zip(self.outputs["segmentation"], self.outputs["identification"], self.outputs["text_extraction"])]
+            with MockLLMServer(delay=self.llm_delay) as server:
+                model = SummarizationModel(base_url=server.base_url)
+                # Every timed call should reach the server, not the response cache
+                model.llm.memory_entries = 0
+                try:
+                    return self.time_stage(name, model.summarize, inputs)
+                finally:
+                    model.close()
+
+        raise ValueError(f"Unknown stage {name}, should be one of {STAGES}")
+
+    def run(self):
+        results = dict()
+        for name in self.stages:
+            results[name] = self.run_stage(name)
+        return {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "environment": environment(),
+            "backend": self.backend + (f"-int8-{self.quantize}" if self.quantize else ""),
+            "inference_config": {"segmentation": self.seg_config.cache_params(),
+                                 "identification": self.id_config.cache_params()},
+            "images": len(self.img_paths),
+            "stages": results,
+        }
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch": package_version("torch"),
+        "ultralytics": package_version("ultralytics"),
+        "easyocr": package_version("easyocr"),
+        "onnxruntime": package_version("onnxruntime"),
+    }
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compares every stage metric with the baseline. Returns a list of
+    (stage, metric, baseline value, current value, change) of the ones that
+    got worse by more than tolerance (0.2 = 20%).
+    """
+    regressions = []
+    for stage, metrics in results["stages"].items():
+        base_metrics = baseline.get("stages", {}).get(stage)
+        if not base_metrics:
+            continue
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            current, base = metrics.get(metric), base_metrics.get(metric)
+            if current is None or not base:
+                continue
+            change = (current - base) / base
+            worse = change > tolerance if metric in LOWER_IS_BETTER else change < -tolerance
+            if worse:
+                regressions.append((stage, metric, base, current, round(change, 3)))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the pipeline")
+    parser.add_argument("--images", default="data/input_images", help="Directory or glob of images")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N images")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Comma separated subset of {','.join(STAGES)}")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed calls before every stage")
+    parser.add_argument("--llm-delay", type=float, default=0.2, help="Response delay of the mock LLM server")
+    parser.add_argument("--backend", choices=onnx_backend.BACKENDS, default="torch", help="Run the YOLO models with PyTorch or ONNX Runtime")
+    parser.add_argument("--quantize", choices=onnx_backend.QUANTIZE_MODES, default=None, help="INT8 quantization of the ONNX models")
+    parser.add_argument("--seg-config", type=InferenceConfig.from_string, default=None,
+                        help="Settings of the segmentation model, e.g. mode=tiled,imgsz=640,conf=0.25")
+    parser.add_argument("--id-config", type=InferenceConfig.from_string, default=None,
+                        help="Settings of the identification model, same format as --seg-config")
+    parser.add_argument("--output", default=None, help="Where to save the results (default benchmarks/results/<time>.json)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Results file to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Save these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before flagging, 0.2 = 20%%")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 if anything regressed")
+    args = parser.parse_args()
+    if args.quantize and args.backend != "onnx":
+        parser.error("--quantize needs --backend onnx")
+
+    img_paths = collect_image_paths(args.images)[:args.limit]
+    if not img_paths:
+        print(f"[INFO] No images found for {args.images}")
+        return 1
+
+    stages = tuple(stage.strip() for stage in args.stages.split(",") if stage.strip())
+    results = Benchmark(img_paths, stages, args.warmup, args.llm_delay, args.backend, args.quantize,
+                        args.seg_config, args.id_config).run()
+
+    output = args.output or os.path.join(os.path.dirname(__file__), "results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"[INFO] Results saved to {output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=4)
+        print(f"[INFO] Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"[INFO] No baseline at {args.baseline}, run with --save-baseline to make one")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    for stage, metric, base, current, change in regressions:
+        print(f"[REGRESSION] {stage} {metric}: {base} -> {current} ({change:+.0%})")
+    if not regressions:
+        print(f"[INFO] No regressions against {args.baseline}")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
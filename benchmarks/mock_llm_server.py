@@ -0,0 +1,116 @@
+"""
+    A tiny OpenAI compatible chat completion server for benchmarks and tests.
+
+    It answers every POST to /v1/chat/completions with the same canned summary
+    after a fixed delay, so the summarization stage can be measured without
+    the network or a real LLM. "stream": true is supported too (server sent events).
+
+    Usage (from the root folder):
+        python3 benchmarks/mock_llm_server.py --port 8000 --delay 0.5
+        python3 utils/batch_pipeline.py data/input_images --summarize --llm-base-url http://127.0.0.1:8000/v1
+
+    Or from Python:
+        with MockLLMServer(delay=0.2) as server:
+            SummarizationModel(base_url=server.base_url).summarize(...)
+"""
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+SUMMARY = ("- Object 1 is a person standing near the road.\n"
+           "- Object 2 is a car parked on the side.\n"
+           "- No text detected.")
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        self.server.requests += 1
+        time.sleep(self.server.delay)
+
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for word in SUMMARY.split(" "):
+                event = {"choices": [{"delta": {"content": word + " "}}]}
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+            return
+
+        response = json.dumps({
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": SUMMARY}}],
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        # Keep the benchmark output readable
+        pass
+
+
+class MockLLMServer:
+    def __init__(self, host="127.0.0.1", port=0, delay=0.2) -> None:
+        # port=0 picks a free port, see base_url for the one that was given
+        self.server = ThreadingHTTPServer((host, port), MockLLMHandler)
+        self.server.daemon_threads = True
+        self.server.delay = delay
+        self.server.requests = 0
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI compatible chat completion server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--delay", type=float, default=0.2, help="Seconds before every response")
+    args = parser.parse_args()
+
+    server = MockLLMServer(args.host, args.port, args.delay)
+    print(f"[INFO] Mock LLM server on {server.base_url}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
 import os
 import requests
-from ultralytics import YOLO
 from PIL import Image
 import tempfile
+from models import model_registry, onnx_backend, inference_config
+from models.inference_config import InferenceConfig
+from utils.image_writer import ImageWriter
+from utils.result_cache import package_version
+from utils.image_input import as_image_input
+from utils import metrics
 class IdentificationModel:
     model_folder = "model_assets/"
     model_name = "yolov8n.pt"
@@ -12,7 +17,6 @@ class IdentificationModel:
     model_url = "https://github.com/ultralytics/assets/releases/download/v8.2.0/yolov8n.pt"  # Replace with the actual URL
 
     model_path = os.path.abspath(model_folder + model_name)
-    model = None
     desc_path = "data/output/desc.json"
     
     temp_dir = tempfile.TemporaryDirectory()
@@ -26,27 +30,46 @@ class IdentificationModel:
     output_img_path = temp_dir.name + "/id_model.jpg"
 
 
-    # Whole process of model not existing
-    if not os.path.exists(model_path):
-        print(f"[INFO] Model {model_path} not found! Downloading it")
-        os.makedirs(os.path.dirname(model_path), exist_ok=True)
-        response = requests.get(model_url)
-        with open(model_path, 'wb') as f:
-            f.write(response.content)
-        print(f"[INFO] Model downloaded to {model_path}")
+    # The model used to be downloaded and loaded right here in the class body,
+    # which meant just importing this file cost seconds. Now it is loaded by
+    # load_model() below through the model registry, the first time an
+    # IdentificationModel is created, and shared by every instance after that.
+    # backend="onnx" (optionally with quantize="dynamic" or "static") runs an ONNX
+    # export of the weights through ONNX Runtime instead, see models/onnx_backend.py.
+    # config holds the confidence, input size, class filter and the full / fast /
+    # tiled mode, see models/inference_config.py. The annotated images go to
+    # temp_dir, or to image_dir when it's given
+    def __init__(self, output_mode="sync", image_format="jpg", quality=95, cache=None,
+                 backend="torch", quantize=None, config=None, image_dir=None):
+        self.backend = backend
+        self.quantize = quantize
+        self.registry_name = onnx_backend.registry_name("identification", backend, quantize)
+        self.model = model_registry.get(self.registry_name)
+        self.config = config or InferenceConfig()
+        self.results = None
 
-    print(f"[INFO] Initializing Object Identification model from {model_path}")
-    model = YOLO(model_path)
+        # The image self.results belong to, so that generate_descriptions() on
+        # another image doesn't hand back the detections of the previous one
+        self.results_image_path = None
+        self.results_master_id = None
 
-    def __init__(self):
-        self.results = None
+        # Optional utils.result_cache.ResultCache for the raw model results
+        self.cache = cache
+
+        # Annotated output images go through an ImageWriter, in "async" mode they
+        # are written in the background and in "memory" mode they are not even drawn
+        self.writer = ImageWriter(image_dir or self.temp_dir.name, output_mode, image_format, quality)
 
 
-    # Predict objects with a confidence threshold of 0.30 which means
-    # if any object has a probability of belong to a class below than 30%
-    # we will consider it as noise and ignore it.
+    # Predict objects with a confidence threshold of 0.30 (by default, see
+    # self.config) which means if any object has a probability of belong to
+    # a class below than 30% we will consider it as noise and ignore it.
+    # image_path can also be an already decoded utils.image_input.ImageInput
     def identify_objects(self, image_path):
-        self.results = self.model.predict(image_path, conf = 0.30)
+        image = as_image_input(image_path)
+        self.results = self.run_model([image])
+        self.results_image_path = image_path
+        self.results_master_id = image.master_id
         print("[INFO] Objects identified")
 
 
@@ -55,31 +78,16 @@ class IdentificationModel:
     # the bounding box of the object in the image.
     def generate_descriptions(self, image_path):
         descriptions = []
-        if self.results is None:
+        if self.results is None or self.results_image_path != image_path:
             print("[INFO] No objects identified yet! Running identification")
             self.identify_objects(image_path)
 
         for result in self.results:
-            for obj in result.boxes:
-
-                # Three variables I am going to use
-                class_id = int(obj.cls)
-                conf = float(obj.conf)
-                bbox = obj.xyxy.tolist()
-
-                # description of the object
-                # obj_id_bbox is the bounding box of the object decided by
-                # the IdentificationModel which is much more accurate than 
-                # the obj_bbox decided by the SegmentationModel
-                description = {
-                    "object_class": self.model.names[class_id],
-                    "conf": f"{conf:.2f}",
-                    "obj_id_bbox": bbox
-                }
-                descriptions.append(description)
-
-            # Save the output image of this model
-            result.save(self.output_img_path)
+            descriptions.extend(inference_config.describe_result(result))
+
+            # Save the output image of this model, named after the image so
+            # that two images (or two users of the app) never share one file
+            self.output_img_path = self.save_result(result, f"{self.results_master_id}_id_model")
             print(f"[INFO] Output image saved to {self.output_img_path}")
                 
         self.desc = descriptions
@@ -87,6 +95,104 @@ class IdentificationModel:
         # return the descripions and the output image path
         return (descriptions, self.output_img_path)
 
+
+    # Same as generate_descriptions() but for many images. The images are
+    # passed to the model `batch_size` at a time, so each batch costs a single
+    # forward pass. Every image gets its own annotated output image, named
+    # after the image, so they don't overwrite each other.
+    def generate_descriptions_batch(self, image_paths, batch_size = 8):
+        outputs = []
+        for start in range(0, len(image_paths), batch_size):
+            batch_images = [as_image_input(path) for path in image_paths[start:start + batch_size]]
+            results = self.run_model(batch_images)
+
+            for result, image in zip(results, batch_images):
+                output_img_path = self.save_result(result, f"{image.master_id}_id_model")
+
+                outputs.append((inference_config.describe_result(result), output_img_path))
+        print(f"[INFO] Objects identified in {len(image_paths)} images")
+        return outputs
+
+
+    # Runs the model over images (ImageInputs), one result per image. The decoded
+    # buffer is passed to the model so ultralytics doesn't read the file again.
+    # With a cache the stored results of images seen before are used instead
+    def run_model(self, images):
+        keys = [self.cache_key(image) for image in images]
+        results = [None] * len(images)
+
+        missing = []
+        for idx, key in enumerate(keys):
+            cached = self.cache.get(key) if key is not None else None
+            if cached is None:
+                missing.append(idx)
+            else:
+                # The image is not stored in the cache, it's only needed for plotting
+                cached.orig_img = images[idx].bgr
+                results[idx] = cached
+
+        if missing:
+            # The model instance is shared with the other threads of the process
+            with model_registry.lock(self.registry_name), metrics.stage("inference", model="identification") as span:
+                predicted = inference_config.predict(self.model, [images[idx] for idx in missing], self.config)
+                span.count(images=len(missing), objects=sum(len(result.boxes) for result in predicted))
+            metrics.record_speed(predicted, model="identification")
+            for idx, result in zip(missing, predicted):
+                results[idx] = result
+                if keys[idx] is not None:
+                    stored = result.cpu()
+                    stored.orig_img = None
+                    self.cache.put(keys[idx], stored)
+        return results
+
+
+    def cache_key(self, image):
+        if self.cache is None:
+            return None
+        params = self.config.cache_params()
+        if self.backend != "torch":
+            params["backend"] = onnx_backend.registry_name("identification", self.backend, self.quantize)
+        return self.cache.make_key(image.content_hash, "identification", self.model_name,
+                                   package_version("ultralytics"), params)
+
+
+    # Writes the annotated image of a result, returns None in memory mode
+    def save_result(self, result, name):
+        if self.writer.mode == "memory":
+            return None
+        return self.writer.write(name, result.plot())
+
+
+    # Wait until the annotated images queued in async mode are on disk
+    def flush(self):
+        self.writer.flush()
+
+
+def download_weights():
+    model_path = IdentificationModel.model_path
+
+    # Whole process of model not existing
+    if not os.path.exists(model_path):
+        print(f"[INFO] Model {model_path} not found! Downloading it")
+        os.makedirs(os.path.dirname(model_path), exist_ok=True)
+        response = requests.get(IdentificationModel.model_url)
+        with open(model_path, 'wb') as f:
+            f.write(response.content)
+        print(f"[INFO] Model downloaded to {model_path}")
+    return model_path
+
+
+def load_model():
+    from ultralytics import YOLO
+
+    model_path = download_weights()
+    print(f"[INFO] Initializing Object Identification model from {model_path}")
+    return YOLO(model_path)
+
+
+model_registry.register("identification", load_model)
+onnx_backend.register_variants("identification", download_weights)
+
 if __name__ == "__main__":
 
     # Simple test of the IdentificationModel
@@ -0,0 +1,251 @@
+import numpy as np
+
+from utils.tiling import tile_windows, merge_detections
+"""
+    Inference settings of the YOLO models, so every workload can pick its own
+    point between latency and recall instead of sharing one fixed setting.
+
+        conf            confidence threshold
+        imgsz           input size of the model, smaller is quicker
+        max_det         most detections kept per image
+        classes         only keep these classes, names ("person") or ids (0)
+        mode            "full":  the whole image at imgsz (what we always did)
+                        "fast":  the model sees the image downscaled by `scale`,
+                                 at an input size scaled the same way. The
+                                 downscaled copy is kept on the ImageInput, so
+                                 both YOLO models share it
+                        "tiled": large images are cut in overlapping tiles of
+                                 tile_size (plus one pass over the whole image,
+                                 for the objects bigger than a tile), the
+                                 detections and masks are merged back together
+        scale           downscale factor of the fast mode, 0.5 = half size
+        tile_size, tile_overlap, merge_threshold
+                        see utils/tiling.py
+
+    Whatever the mode, the results that come back are plain ultralytics results
+    in the coordinates of the full image, so cropping and mapping don't change.
+
+    Settings can be given as a string too, that's how the command line passes them:
+        InferenceConfig.from_string("mode=tiled,imgsz=640,conf=0.25,classes=person;car")
+"""
+
+INFERENCE_MODES = ("full", "fast", "tiled")
+
+
+class InferenceConfig:
+    def __init__(self, conf=0.30, imgsz=640, max_det=300, classes=None, mode="full", scale=0.5,
+                 tile_size=640, tile_overlap=0.2, merge_threshold=0.5) -> None:
+        if mode not in INFERENCE_MODES:
+            raise ValueError(f"mode must be one of {INFERENCE_MODES}, got {mode!r}")
+        if not 0 < scale <= 1:
+            raise ValueError(f"scale must be in (0, 1], got {scale}")
+        self.conf = float(conf)
+        self.imgsz = int(imgsz)
+        self.max_det = int(max_det)
+        self.classes = list(classes) if classes is not None else None
+        self.mode = mode
+        self.scale = float(scale)
+        self.tile_size = int(tile_size)
+        self.tile_overlap = float(tile_overlap)
+        self.merge_threshold = float(merge_threshold)
+
+    @classmethod
+    def from_string(cls, text):
+        """
+        "key=value,key=value", classes separated by ";". An empty string gives
+        the default settings.
+        """
+        kwargs = dict()
+        for item in filter(None, (part.strip() for part in (text or "").split(","))):
+            key, sep, value = item.partition("=")
+            key, value = key.strip(), value.strip()
+            if not sep or key not in DEFAULTS:
+                raise ValueError(f"Unknown inference setting {item!r}, should be one of {', '.join(DEFAULTS)}")
+            if key == "classes":
+                kwargs[key] = [int(name) if name.isdigit() else name for name in value.split(";") if name]
+            elif key == "mode":
+                kwargs[key] = value
+            else:
+                kwargs[key] = type(DEFAULTS[key])(value)
+        return cls(**kwargs)
+
+    def class_ids(self, names):
+        """
+        The class filter as the ids ultralytics wants, names is the model's
+        {id: name} dict. None means every class.
+        """
+        if self.classes is None:
+            return None
+        ids_by_name = {name: class_id for class_id, name in names.items()}
+        ids = []
+        for cls in self.classes:
+            if isinstance(cls, str):
+                if cls not in ids_by_name:
+                    raise ValueError(f"The model has no class named {cls!r}")
+                cls = ids_by_name[cls]
+            ids.append(int(cls))
+        return ids
+
+    def predict_kwargs(self, names):
+        return {"conf": self.conf, "imgsz": self.imgsz, "max_det": self.max_det,
+                "classes": self.class_ids(names)}
+
+    def cache_params(self):
+        """
+        The settings that change the results, for the result cache keys. Only
+        the ones that differ from the defaults, so the keys of a default config
+        stay the same as before these settings existed.
+        """
+        params = {"conf": self.conf}
+        for key, default in DEFAULTS.items():
+            value = getattr(self, key)
+            if key == "conf" or value == default:
+                continue
+            if key == "scale" and self.mode != "fast":
+                continue
+            if key.startswith("tile_") or key == "merge_threshold":
+                if self.mode != "tiled":
+                    continue
+            params[key] = value
+        return params
+
+    def __repr__(self):
+        return f"InferenceConfig({', '.join(f'{key}={value!r}' for key, value in self.cache_params().items())})"
+
+
+DEFAULTS = {key: getattr(InferenceConfig(), key) for key in
+            ("conf", "imgsz", "max_det", "classes", "mode", "scale", "tile_size", "tile_overlap", "merge_threshold")}
+
+
+def make_result(template, orig_img, boxes, masks, speed):
+    """
+    A new ultralytics result for orig_img, with the names and path of template.
+    boxes is an (N, 6) array of x1, y1, x2, y2, conf, cls and masks an (N, H, W)
+    boolean array at the size of orig_img (or None for a detection model).
+    """
+    import torch
+    from ultralytics.engine.results import Results
+
+    boxes = torch.from_numpy(np.asarray(boxes, dtype=np.float32).reshape(-1, 6))
+    if masks is not None:
+        masks = torch.from_numpy(np.asarray(masks, dtype=np.float32).reshape(-1, *orig_img.shape[:2]))
+    return Results(orig_img, path=template.path, names=template.names, boxes=boxes, masks=masks, speed=speed)
+
+
+def result_arrays(result):
+    boxes = result.boxes.data.cpu().numpy()
+    masks = None
+    if result.masks is not None:
+        masks = result.masks.data.cpu().numpy() > 0.5
+    return boxes, masks
+
+
+def describe_result(result):
+    """
+    Descriptions of one ultralytics result, one per detected box in the order of
+    the boxes (so for a segmentation result they line up with the masks).
+    obj_id_bbox is the [[x1, y1, x2, y2]] box the model decided on.
+    """
+    descriptions = []
+    for obj in result.boxes:
+        class_id = int(obj.cls)
+        conf = float(obj.conf)
+        descriptions.append({
+            "object_class": result.names[class_id],
+            "conf": round(conf, 2),
+            "obj_id_bbox": obj.xyxy.tolist()
+        })
+    return descriptions
+
+
+def scaled_size(imgsz, scale):
+    # Input sizes have to be multiples of the model's stride (32)
+    return max(32, int(round(imgsz * scale / 32)) * 32)
+
+
+def predict(model, images, config, **kwargs):
+    """
+    Runs the ultralytics model over images (ImageInputs) with the given
+    InferenceConfig, one result per image. kwargs go to model.predict()
+    as they are (e.g. retina_masks=True).
+    """
+    kwargs.update(config.predict_kwargs(model.names))
+    if config.mode == "fast":
+        return predict_fast(model, images, config, kwargs)
+    if config.mode == "tiled":
+        return [predict_tiled(model, image, config, kwargs) for image in images]
+    return model.predict([image.bgr for image in images], **kwargs)
+
+
+def predict_fast(model, images, config, kwargs):
+    kwargs["imgsz"] = scaled_size(config.imgsz, config.scale)
+    small = [image.reduced(config.scale) for image in images]
+    results = model.predict(small, **kwargs)
+
+    outputs = []
+    for result, image, small_img in zip(results, images, small):
+        boxes, masks = result_arrays(result)
+        height, width = image.shape[:2]
+
+        # Back to the coordinates of the full image
+        boxes[:, [0, 2]] *= width / small_img.shape[1]
+        boxes[:, [1, 3]] *= height / small_img.shape[0]
+        if masks is not None:
+            masks = upscale_masks(masks, height, width)
+        outputs.append(make_result(result, image.bgr, boxes, masks, result.speed))
+    return outputs
+
+
+def upscale_masks(masks, height, width):
+    import cv2
+
+    full = np.zeros((len(masks), height, width), dtype=bool)
+    for idx, mask in enumerate(masks):
+        full[idx] = cv2.resize(mask.astype(np.uint8), (width, height), interpolation=cv2.INTER_NEAREST) > 0
+    return full
+
+
+def predict_tiled(model, image, config, kwargs):
+    height, width = image.shape[:2]
+    windows = tile_windows(height, width, config.tile_size, config.tile_overlap)
+    if len(windows) == 1:
+        # Small enough to go through in one piece
+        return model.predict([image.bgr], **kwargs)[0]
+
+    # Every tile of the image goes through the model as one batch, plus the
+    # whole image for the objects that are bigger than a tile
+    tiles = [image.bgr[y1:y2, x1:x2] for x1, y1, x2, y2 in windows]
+    results = model.predict(tiles + [image.bgr], **kwargs)
+    windows = windows + [[0, 0, width, height]]
+
+    boxes, sources = [], []
+    for tile_idx, (result, (x1, y1, _, _)) in enumerate(zip(results, windows)):
+        tile_boxes, _ = result_arrays(result)
+        tile_boxes[:, [0, 2]] += x1
+        tile_boxes[:, [1, 3]] += y1
+        boxes.append(tile_boxes)
+        sources.extend((tile_idx, idx) for idx in range(len(tile_boxes)))
+    boxes = np.concatenate(boxes) if boxes else np.zeros((0, 6), dtype=np.float32)
+
+    clusters = merge_detections(boxes[:, :4], boxes[:, 4], boxes[:, 5], config.merge_threshold)[:config.max_det]
+
+    # A cluster becomes one detection with the class and confidence of its
+    # best box, the union of the boxes and the union of the masks, so an
+    # object split over two tiles comes back whole
+    merged_boxes = np.zeros((len(clusters), 6), dtype=np.float32)
+    has_masks = any(result.masks is not None for result in results)
+    merged_masks = np.zeros((len(clusters), height, width), dtype=bool) if has_masks else None
+    tile_masks = [result_arrays(result)[1] for result in results] if has_masks else None
+
+    for out_idx, (keep, members) in enumerate(clusters):
+        merged_boxes[out_idx, :2] = boxes[members, :2].min(axis=0)
+        merged_boxes[out_idx, 2:4] = boxes[members, 2:4].max(axis=0)
+        merged_boxes[out_idx, 4:] = boxes[keep, 4:]
+        if has_masks:
+            for member in members:
+                tile_idx, idx = sources[member]
+                x1, y1, x2, y2 = windows[tile_idx]
+                merged_masks[out_idx, y1:y2, x1:x2] |= tile_masks[tile_idx][idx]
+
+    speed = {key: sum(result.speed.get(key) or 0 for result in results) for key in results[0].speed}
+    return make_result(results[-1], image.bgr, merged_boxes, merged_masks, speed)
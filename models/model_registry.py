@@ -0,0 +1,93 @@
+"""
+    Process wide model registry.
+
+    Every model file registers a loader function here under a short name, e.g.
+    "segmentation". Nothing is loaded at import time, the loader only runs the
+    first time someone asks for the model with get(), and from then on every
+    caller in the process gets that same instance. So importing a model file is
+    cheap and creating SegmentationModel() ten times only loads the weights once.
+
+    warmup() can be called explicitly (say at app start) to pay the loading cost
+    up front instead of on the first request.
+
+    The instances are shared between threads too, so whoever calls one holds
+    lock(name) meanwhile: an ultralytics model keeps the state of the current
+    predict() call on itself, two threads predicting with it at once mix up
+    each other's images and results.
+"""
+import threading
+from utils import metrics
+
+
+_loaders = dict()
+_models = dict()
+
+# Names loaded by warmup() when it isn't told which ones, see register()
+_defaults = []
+
+# Two threads asking for the same model at the same time should not load it twice
+_lock = threading.Lock()
+
+# name -> lock held while the shared instance is running, see lock()
+_model_locks = dict()
+_model_locks_lock = threading.Lock()
+
+
+def register(name, loader, default=True):
+    """
+    Register a zero argument function which loads and returns the model `name`.
+    default=False keeps it out of a bare warmup(), for alternatives (like the
+    ONNX variants) that are only loaded when asked for by name.
+    """
+    _loaders[name] = loader
+    if default and name not in _defaults:
+        _defaults.append(name)
+    elif not default and name in _defaults:
+        _defaults.remove(name)
+
+
+def get(name):
+    """
+    Returns the shared instance of the model `name`, loading it on first use.
+    """
+    if name in _models:
+        return _models[name]
+
+    if name not in _loaders:
+        raise KeyError(f"No model registered under the name {name}")
+
+    with _lock:
+        if name not in _models:
+            with metrics.stage("model_load", model=name):
+                _models[name] = _loaders[name]()
+    return _models[name]
+
+
+def lock(name):
+    """
+    The lock to hold while calling the shared instance of the model `name`.
+    """
+    with _model_locks_lock:
+        if name not in _model_locks:
+            _model_locks[name] = threading.Lock()
+        return _model_locks[name]
+
+
+def warmup(names=None):
+    """
+    Load the given models (by default all the ones registered with default=True) right away.
+    """
+    for name in (names if names is not None else list(_defaults)):
+        get(name)
+
+
+def is_loaded(name):
+    return name in _models
+
+
+def clear():
+    """
+    Drop every loaded instance, the next get() will load them again.
+    """
+    with _lock:
+        _models.clear()
@@ -0,0 +1,345 @@
+"""
+    ONNX Runtime backend for the two YOLO models.
+
+    On CPU (which is where we deploy) ONNX Runtime is usually quicker than running
+    the .pt weights through PyTorch, and with INT8 quantization it gets quicker still.
+    The .pt weights from model_assets/ are exported to ONNX once and the artifact is
+    cached in model_assets/onnx/, named after a hash of the weights so a new .pt file
+    gets a new export. Quantization:
+
+        dynamic:    weights are stored as INT8, activations are quantized on the fly.
+                    Needs nothing but the model, the gain on convolutions is small.
+        static:     weights and activations in INT8 (QDQ format), the activation
+                    ranges are calibrated on images from data/input_images. The box
+                    decoding at the end of the head stays in float, quantizing the
+                    pixel coordinates costs far more accuracy than it saves time.
+
+    The exported model is loaded back through ultralytics.YOLO, which runs .onnx
+    files with ONNX Runtime, so the results have exactly the same shape as the
+    PyTorch ones and nothing after run_model() has to know which backend ran.
+
+    Every variant is registered in the model registry as "<model>-onnx",
+    "<model>-onnx-dynamic" and "<model>-onnx-static", e.g.
+    SegmentationModel(backend="onnx", quantize="static") uses "segmentation-onnx-static".
+
+    check_parity() runs both backends over the same images and reports how many of
+    the PyTorch detections the ONNX model finds again. From the root folder:
+        python3 -m models.onnx_backend segmentation --quantize static --limit 32
+"""
+import os
+import sys
+import glob
+import shutil
+import hashlib
+import argparse
+
+import numpy as np
+
+from models import model_registry
+from utils.result_cache import package_version
+from utils.image_input import ImageInput
+
+BACKENDS = ("torch", "onnx")
+QUANTIZE_MODES = ("dynamic", "static")
+
+onnx_dir = os.path.abspath("model_assets/onnx")
+calibration_images = "data/input_images"
+calibration_size = 32
+imgsz = 640
+
+# ultralytics task of every model, the exported file is loaded back with it
+TASKS = {"segmentation": "segment", "identification": "detect"}
+
+
+def registry_name(name, backend="torch", quantize=None):
+    """
+    Name of the registered model, "segmentation" for PyTorch and for example
+    "segmentation-onnx-static" for a statically quantized ONNX model.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {BACKENDS}, got {backend!r}")
+    if quantize is not None and quantize not in QUANTIZE_MODES:
+        raise ValueError(f"quantize must be one of {QUANTIZE_MODES} or None, got {quantize!r}")
+    if backend == "torch":
+        if quantize is not None:
+            raise ValueError("Quantization is only available with backend='onnx'")
+        return name
+    return f"{name}-onnx" + (f"-{quantize}" if quantize else "")
+
+
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()[:12]
+
+
+def artifact_path(pt_path):
+    # A different exporter or image size gives a different model too, so they
+    # are part of the name along with the weights
+    stem = os.path.splitext(os.path.basename(pt_path))[0]
+    key = f"{file_hash(pt_path)}-ultralytics{package_version('ultralytics')}-{imgsz}"
+    return os.path.join(onnx_dir, f"{stem}-{hashlib.sha256(key.encode()).hexdigest()[:12]}.onnx")
+
+
+def export_onnx(pt_path):
+    """
+    Exports the .pt weights to ONNX, or returns the cached export.
+    """
+    onnx_path = artifact_path(pt_path)
+    if os.path.exists(onnx_path):
+        return onnx_path
+
+    from ultralytics import YOLO
+
+    print(f"[INFO] Exporting {pt_path} to ONNX")
+    os.makedirs(onnx_dir, exist_ok=True)
+
+    # ultralytics writes the export next to the weights, so export a copy in
+    # the cache folder instead of littering model_assets/
+    work_path = onnx_path[:-len(".onnx")] + ".pt"
+    shutil.copyfile(pt_path, work_path)
+    try:
+        # dynamic=True so that predict_batch() can still send a whole batch at
+        # once and images keep their aspect ratio (no padding to a square)
+        exported = YOLO(work_path).export(format="onnx", dynamic=True, imgsz=imgsz)
+        os.replace(exported, onnx_path)
+    finally:
+        os.remove(work_path)
+    print(f"[INFO] Saved ONNX model to {onnx_path}")
+    return onnx_path
+
+
+def letterbox(bgr, size=None):
+    """
+    The image as the (1, 3, size, size) float32 RGB tensor the exported model
+    takes, resized and padded the same way ultralytics does it.
+    """
+    from ultralytics.data.augment import LetterBox
+
+    size = size or imgsz
+    padded = LetterBox(new_shape=(size, size), auto=False)(image=bgr)
+    return np.ascontiguousarray(padded[..., ::-1].transpose(2, 0, 1)[None], dtype=np.float32) / 255.0
+
+
+def calibration_paths(source=None, limit=None):
+    source = source or calibration_images
+    paths = sorted(glob.glob(os.path.join(source, "*")) if os.path.isdir(source) else glob.glob(source))
+    paths = [path for path in paths if os.path.splitext(path)[1].lower() in (".jpg", ".jpeg", ".png", ".bmp", ".webp")]
+    return paths[:limit or calibration_size]
+
+
+def make_calibration_reader(input_name, paths):
+    # onnxruntime is only imported when a model is actually quantized
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class ImageCalibrationReader(CalibrationDataReader):
+        def __init__(self) -> None:
+            self.paths = iter(paths)
+
+        def get_next(self):
+            path = next(self.paths, None)
+            if path is None:
+                return None
+            return {input_name: letterbox(ImageInput.from_path(path).bgr)}
+
+    return ImageCalibrationReader()
+
+
+def head_postprocess_nodes(model):
+    """
+    Nodes of the last module (the Detect / Segment head) that decode the boxes,
+    i.e. everything in it except the convolutions. These stay in float.
+    """
+    def module_index(node):
+        parts = node.name.split("/")
+        if len(parts) > 1 and parts[1].startswith("model."):
+            index = parts[1].split(".")[1]
+            return int(index) if index.isdigit() else None
+        return None
+
+    indices = [index for index in map(module_index, model.graph.node) if index is not None]
+    if not indices:
+        return []
+    head = max(indices)
+    return [node.name for node in model.graph.node if module_index(node) == head and node.op_type != "Conv"]
+
+
+def quantize_onnx(onnx_path, quantize, calibration_source=None):
+    """
+    INT8 version of an exported model, or the cached one.
+    """
+    import onnx
+    from onnxruntime.quantization import quantize_dynamic, quantize_static, QuantFormat, QuantType
+
+    quantized_path = onnx_path[:-len(".onnx")] + f".int8-{quantize}-ort{package_version('onnxruntime')}.onnx"
+    if os.path.exists(quantized_path):
+        return quantized_path
+
+    print(f"[INFO] Quantizing {onnx_path} ({quantize})")
+    model = onnx.load(onnx_path)
+    exclude = head_postprocess_nodes(model)
+
+    if quantize == "dynamic":
+        quantize_dynamic(onnx_path, quantized_path, weight_type=QuantType.QUInt8, nodes_to_exclude=exclude)
+    else:
+        paths = calibration_paths(calibration_source)
+        if not paths:
+            raise ValueError(f"No calibration images found in {calibration_source or calibration_images}")
+        print(f"[INFO] Calibrating on {len(paths)} images")
+        reader = make_calibration_reader(model.graph.input[0].name, paths)
+        quantize_static(onnx_path, quantized_path, reader, quant_format=QuantFormat.QDQ,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                        per_channel=True, nodes_to_exclude=exclude)
+
+    # ultralytics reads the class names, stride and task from the metadata,
+    # make sure the quantized model still carries it
+    quantized = onnx.load(quantized_path)
+    if not quantized.metadata_props:
+        onnx.helper.set_model_props(quantized, {prop.key: prop.value for prop in model.metadata_props})
+        onnx.save(quantized, quantized_path)
+    print(f"[INFO] Saved quantized model to {quantized_path}")
+    return quantized_path
+
+
+def onnx_model_path(pt_path, quantize=None, calibration_source=None):
+    onnx_path = export_onnx(pt_path)
+    if quantize:
+        return quantize_onnx(onnx_path, quantize, calibration_source)
+    return onnx_path
+
+
+def load_onnx_model(pt_path, task, quantize=None):
+    from ultralytics import YOLO
+
+    path = onnx_model_path(pt_path, quantize)
+    print(f"[INFO] Initializing ONNX Runtime model from {path}")
+    return YOLO(path, task=task)
+
+
+def register_variants(name, weights):
+    """
+    Registers the ONNX variants of the model `name`. weights is a zero argument
+    function returning the path of the .pt file (downloading it if need be).
+
+    They stay out of a bare model_registry.warmup(), loading one means exporting
+    (and maybe quantizing) the model first, which only makes sense for the
+    variant that is actually used.
+    """
+    for quantize in (None,) + QUANTIZE_MODES:
+        model_registry.register(registry_name(name, "onnx", quantize),
+                                lambda quantize=quantize: load_onnx_model(weights(), TASKS[name], quantize),
+                                default=False)
+
+
+def match_detections(ref_boxes, ref_classes, boxes, classes, min_iou=0.5):
+    """
+    (ref_idx, idx, iou) of the detections of the same class that overlap by
+    at least min_iou, every detection used once.
+    """
+    # Imported here, data_mapping imports the model files which import this one
+    from utils.data_mapping import iou_matrix, assign_boxes
+
+    iou = iou_matrix(np.asarray(ref_boxes, dtype=np.float32).reshape(-1, 4),
+                     np.asarray(boxes, dtype=np.float32).reshape(-1, 4))
+    iou[np.asarray(ref_classes)[:, None] != np.asarray(classes)[None, :]] = 0
+    return [(ref_idx, idx, float(iou[ref_idx, idx])) for ref_idx, idx in assign_boxes(iou, min_iou)]
+
+
+def compare_results(ref, result, min_iou=0.5):
+    ref_classes = ref.boxes.cls.cpu().numpy().astype(int)
+    classes = result.boxes.cls.cpu().numpy().astype(int)
+    matches = match_detections(ref.boxes.xyxy.cpu().numpy(), ref_classes,
+                               result.boxes.xyxy.cpu().numpy(), classes, min_iou)
+
+    ref_conf = ref.boxes.conf.cpu().numpy()
+    conf = result.boxes.conf.cpu().numpy()
+    comparison = {
+        "reference": len(ref_classes),
+        "detections": len(classes),
+        "matched": len(matches),
+        "box_ious": [iou for _, _, iou in matches],
+        "conf_diffs": [abs(float(ref_conf[ref_idx]) - float(conf[idx])) for ref_idx, idx, _ in matches],
+        "mask_ious": [],
+    }
+    if ref.masks is not None and result.masks is not None:
+        ref_masks = ref.masks.data.cpu().numpy() > 0.5
+        masks = result.masks.data.cpu().numpy() > 0.5
+        for ref_idx, idx, _ in matches:
+            union = np.logical_or(ref_masks[ref_idx], masks[idx]).sum()
+            if union:
+                comparison["mask_ious"].append(float(np.logical_and(ref_masks[ref_idx], masks[idx]).sum() / union))
+    return comparison
+
+
+def summarize_parity(comparisons):
+    def mean(values):
+        return round(float(np.mean(values)), 4) if values else None
+
+    reference = sum(c["reference"] for c in comparisons)
+    detections = sum(c["detections"] for c in comparisons)
+    matched = sum(c["matched"] for c in comparisons)
+    box_ious = [iou for c in comparisons for iou in c["box_ious"]]
+    conf_diffs = [diff for c in comparisons for diff in c["conf_diffs"]]
+    mask_ious = [iou for c in comparisons for iou in c["mask_ious"]]
+    return {
+        "images": len(comparisons),
+        "reference_detections": reference,
+        "detections": detections,
+        # Share of the PyTorch detections the ONNX model found again, and the
+        # share of the ONNX detections PyTorch also had
+        "recall": round(matched / reference, 4) if reference else 1.0,
+        "precision": round(matched / detections, 4) if detections else 1.0,
+        "mean_box_iou": mean(box_ious),
+        "mean_conf_diff": mean(conf_diffs),
+        "max_conf_diff": round(max(conf_diffs), 4) if conf_diffs else None,
+        "mean_mask_iou": mean(mask_ious),
+    }
+
+
+def check_parity(name, quantize=None, img_paths=None, conf=0.30, min_iou=0.5):
+    """
+    Runs the PyTorch model and its ONNX variant over the same images and
+    compares the detections, see summarize_parity() for what is reported.
+    """
+    reference = model_registry.get(name)
+    model = model_registry.get(registry_name(name, "onnx", quantize))
+    kwargs = {"conf": conf}
+    if TASKS[name] == "segment":
+        kwargs["retina_masks"] = True
+
+    comparisons = []
+    for path in img_paths or calibration_paths(limit=calibration_size):
+        bgr = ImageInput.from_path(path).bgr
+        ref = reference.predict([bgr], verbose=False, **kwargs)[0]
+        result = model.predict([bgr], verbose=False, **kwargs)[0]
+        comparisons.append(compare_results(ref, result, min_iou))
+    return summarize_parity(comparisons)
+
+
+def main():
+    # The model files register their loaders (and ONNX variants) on import
+    from models import segmentation_model, identification_model  # noqa: F401
+    from utils.batch_pipeline import collect_image_paths
+
+    parser = argparse.ArgumentParser(description="Export a YOLO model to ONNX and check it against PyTorch")
+    parser.add_argument("model", choices=sorted(TASKS), help="Which model to export")
+    parser.add_argument("--quantize", choices=QUANTIZE_MODES, default=None, help="INT8 quantization mode")
+    parser.add_argument("--images", default=calibration_images, help="Images to compare on (directory or glob)")
+    parser.add_argument("--limit", type=int, default=calibration_size, help="Only use the first N images")
+    parser.add_argument("--conf", type=float, default=0.30, help="Confidence threshold of both models")
+    parser.add_argument("--min-recall", type=float, default=None, help="Exit with status 1 below this recall")
+    args = parser.parse_args()
+
+    report = check_parity(args.model, args.quantize, collect_image_paths(args.images)[:args.limit], args.conf)
+    for key, value in report.items():
+        print(f"{key}: {value}")
+    if args.min_recall is not None and report["recall"] < args.min_recall:
+        print(f"[INFO] Recall {report['recall']} is below {args.min_recall}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,13 @@
-from ultralytics import YOLO
 import os
 import cv2
 import numpy as np
 import tempfile
+from models import model_registry, onnx_backend, inference_config
+from models.inference_config import InferenceConfig
+from utils.image_writer import ImageWriter
+from utils.result_cache import package_version
+from utils.image_input import as_image_input
+from utils import metrics
 """
     This is our SegmentationModel. Simply put, it applies Image Segmentation using
     ultralytics' pretrained model yolov8-s where 's' stands for small.
@@ -18,24 +23,187 @@ class SegmentationModel:
     output_dir = tempfile.TemporaryDirectory()
     model_path = os.path.abspath("model_assets/" + model_name)
 
-    def __init__(self):
-        print(f"[INFO] Initializing Segmentation model from {self.model_path}")
-        self.model = YOLO(self.model_path)
+    # True blends the area around all the objects once and cuts the shaded crops
+    # out of it (shade_objects_vectorized), instead of blending every object's
+    # crop on its own in shade_polygon(). Off, since on a 1280x720 image the
+    # per-object blend was 5-20x faster for 1 to 30 objects
+    vectorized_crops = False
+
+    def __init__(self, output_mode="sync", image_format="jpg", quality=95, cache=None,
+                 backend="torch", quantize=None, config=None, keep_objects=True, image_dir=None):
+        # The weights are shared through the model registry, so only the first
+        # SegmentationModel() of the process actually loads them.
+        # backend="onnx" runs an ONNX export of the same weights with ONNX Runtime,
+        # optionally INT8 quantized ("dynamic" or "static"), see models/onnx_backend.py
+        self.backend = backend
+        self.quantize = quantize
+        self.registry_name = onnx_backend.registry_name("segmentation", backend, quantize)
+        self.model = model_registry.get(self.registry_name)
+
+        # Confidence, input size, class filter and full / fast / tiled mode,
+        # see models/inference_config.py. The default is what we always ran with
+        self.config = config or InferenceConfig()
+
+        # Writing the shaded objects is handed to an ImageWriter, see
+        # utils/image_writer.py for the sync / async / memory modes. They go to
+        # the temporary output_dir unless image_dir says otherwise
+        self.writer = ImageWriter(image_dir or self.output_dir.name, output_mode, image_format, quality)
+
+        # keep_objects=False doesn't return the shaded objects (segmented_objects
+        # stays empty), each one is dropped as soon as it's written. Long runs
+        # that only need the metadata don't hold every crop in memory then
+        self.keep_objects = keep_objects
+
+        # Optional utils.result_cache.ResultCache, when given the raw model
+        # results of images we have already seen are read back from it
+        self.cache = cache
     
 
-    def predict(self, img_path):
-        img = None
+    def load_image(self, img_path):
+        # img_path can also be an already decoded utils.image_input.ImageInput
+        # (or a BGR array), in which case nothing is read from disk.
+        # Raises a ValueError if the image can't be loaded
+        return as_image_input(img_path)
 
-        try:
-            img = cv2.imread(os.path.abspath(img_path))
-        
-        except Exception as e:
-            # if can't load image, raise an error
-            raise ValueError(f"Unable to load image file due to error: {e}")
+
+    def predict(self, img_path):
+        image = self.load_image(img_path)
            
-        results = self.model.predict(img, conf = 0.30)
+        results = self.run_model([image])
         
-        master_id = os.path.basename(img_path).split('.')[0]
+        # return segmented_objects and object_metadata
+        # while the task hasn't excplicitly asked for shaded_figures, I still kept them
+        # say if I had to show or utilize them later
+        return self.extract_objects(results, image)
+
+
+    def predict_batch(self, img_paths, batch_size = 8):
+        """
+            Same as predict() but for many images at once. The images are fed to
+            the model `batch_size` at a time so that we do one forward pass per
+            batch instead of one per image.
+
+            Returns a list with one (segmented_objects, object_metadata) tuple
+            per image, in the same order as img_paths.
+        """
+        outputs = []
+        for start in range(0, len(img_paths), batch_size):
+            batch_images = [self.load_image(path) for path in img_paths[start:start + batch_size]]
+
+            # ultralytics returns one result per image of the batch
+            results = self.run_model(batch_images)
+
+            for result, image in zip(results, batch_images):
+                outputs.append(self.extract_objects([result], image))
+        return outputs
+
+
+    def predict_combined(self, img_path):
+        """
+            Combined mode. The segmentation model already predicts boxes, classes and
+            confidences alongside the masks, so a single forward pass gives us both
+            what predict() returns and what IdentificationModel.generate_descriptions()
+            returns, without loading or running the identification model at all.
+
+            Returns ((segmented_objects, object_metadata), (descriptions, output_img_path))
+        """
+        image = self.load_image(img_path)
+        results = self.run_model([image])
+        return self.combine_outputs(results[0], image)
+
+
+    def predict_combined_batch(self, img_paths, batch_size = 8):
+        """
+            Batched version of predict_combined(), one output per image.
+        """
+        outputs = []
+        for start in range(0, len(img_paths), batch_size):
+            batch_images = [self.load_image(path) for path in img_paths[start:start + batch_size]]
+            results = self.run_model(batch_images)
+
+            for result, image in zip(results, batch_images):
+                outputs.append(self.combine_outputs(result, image))
+        return outputs
+
+
+    def run_model(self, images):
+        """
+            Runs the model over images (ImageInputs) and returns one result per image.
+            With a cache, images seen before (same content, model and thresholds) are
+            not run again, their stored result is used instead.
+        """
+        keys = [self.cache_key(image) for image in images]
+        results = [None] * len(images)
+
+        missing = []
+        for idx, key in enumerate(keys):
+            cached = self.cache.get(key) if key is not None else None
+            if cached is None:
+                missing.append(idx)
+            else:
+                # The image itself is not stored in the cache, we already decoded it
+                cached.orig_img = images[idx].bgr
+                results[idx] = cached
+
+        if missing:
+            # The model instance is shared with the other threads of the process
+            with model_registry.lock(self.registry_name), metrics.stage("inference", model="segmentation") as span:
+                predicted = inference_config.predict(self.model, [images[idx] for idx in missing], self.config,
+                                                     retina_masks = self.retina_masks)
+                span.count(images=len(missing), objects=sum(len(result.boxes) for result in predicted))
+            metrics.record_speed(predicted, model="segmentation")
+            for idx, result in zip(missing, predicted):
+                results[idx] = result
+                if keys[idx] is not None:
+                    stored = result.cpu()
+                    stored.orig_img = None
+                    self.cache.put(keys[idx], stored)
+        return results
+
+
+    @property
+    def retina_masks(self):
+        # The full mode keeps ultralytics' own mask resolution, like we always
+        # did. Fast and tiled mode put the masks back together in the coordinates
+        # of the full image, so they need them at the size of the image
+        return self.config.mode != "full"
+
+
+    def cache_key(self, image):
+        if self.cache is None:
+            return None
+        params = {**self.config.cache_params(), "retina_masks": self.retina_masks}
+        if self.backend != "torch":
+            # The ONNX (and even more the INT8) results differ slightly from PyTorch's
+            params["backend"] = onnx_backend.registry_name("segmentation", self.backend, self.quantize)
+        return self.cache.make_key(image.content_hash, "segmentation", self.model_name,
+                                   package_version("ultralytics"), params)
+
+
+    def combine_outputs(self, result, image):
+        seg_data = self.extract_objects([result], image)
+
+        # Same annotated image the IdentificationModel would have saved,
+        # not even drawn in memory mode
+        output_img_path = None
+        if self.writer.mode != "memory":
+            output_img_path = self.writer.write(f"{image.master_id}_id_model", result.plot())
+
+        # Same format as IdentificationModel.generate_descriptions(), boxes are
+        # in the same order as the masks so descriptions line up with object_metadata
+        return (seg_data, (inference_config.describe_result(result), output_img_path))
+
+
+    def extract_objects(self, results, image):
+        with metrics.stage("crop_extraction", model="segmentation") as span:
+            seg_data = self.shade_and_save(results, image)
+            span.count(objects=len(seg_data[1]))
+        return seg_data
+
+
+    def shade_and_save(self, results, image):
+        master_id = image.master_id
+        img = image.bgr
         
 
         object_metadata = []
@@ -45,35 +213,21 @@ class SegmentationModel:
             masks = result.masks
             if masks is not None:
 
-                for idx, mask in enumerate(masks.xy):
-                    points = np.int32([mask])
-
-                    # extract these 4 variables from the points
-                    # we will be using these to extract cropped segment objects
-                    x, y, w, h = cv2.boundingRect(points)
-
-                    cropped_object = img[y:y+h, x:x+w]
-
-                    # Create a binary mask for the cropped object
-                    mask_img = np.zeros_like(cropped_object)
-                    mask_points = mask - [x, y]  # Adjust mask points to cropped object coordinates
-                    cv2.fillPoly(mask_img, [np.int32(mask_points)], (255,255 ,0 ))
-                    
-                    # Combine the original cropped object with the colored mask
-                    shaded_object = cv2.addWeighted(cropped_object, 0.7, mask_img, 0.3, 0)
-
+                for idx, (x, y, w, h), shaded_object in self.shade_objects(masks, img):
 
                     # object_id is an comibination of master_id and idx
                     # where master_id is the name of the original image without the extension
                     object_id = f"{master_id}_obj_{idx}"
-                    object_img_path = self.output_dir.name + f"/{object_id}.jpg"
 
                     # Save the shaded object to the output directory
                     # These shaded objects are those segmented objects
-                    # and if wanted can be anytime loaded and used
-                    cv2.imwrite(object_img_path, shaded_object)
-                    print(f"[INFO] Saved shaded object to {object_img_path}")
-                    segmented_objects.append(shaded_object)
+                    # and if wanted can be anytime loaded and used.
+                    # In memory mode nothing is written and the path is None
+                    object_img_path = self.writer.write(object_id, shaded_object)
+                    if object_img_path is not None:
+                        print(f"[INFO] Saved shaded object to {object_img_path}")
+                    if self.keep_objects:
+                        segmented_objects.append(shaded_object)
 
 
                     # this is very important as this variable basically carries all the metadata
@@ -82,11 +236,109 @@ class SegmentationModel:
                         "object_id": object_id,
                         "object_img_path": object_img_path,
                         "obj_seg_bbox": [x, y, w, h],
-                        "master_image": os.path.abspath(img_path),
+                        "master_image": image.path,
                         "master_id": master_id
                     })
         
-        # return segmented_objects and object_metadata
-        # while the task hasn't excplicitly asked for shaded_figures, I still kept them
-        # say if I had to show or utilize them later
         return (segmented_objects, object_metadata)
+
+
+    def encode_object(self, shaded_object):
+        """
+            Bytes of a shaded object in the configured format, this is how the
+            crops are meant to be used in memory mode.
+        """
+        return self.writer.encode(shaded_object)
+
+
+    def flush(self):
+        """
+            Wait until every shaded object queued in async mode is on disk.
+        """
+        self.writer.flush()
+
+
+    def shade_objects(self, masks, img):
+        """
+            Yields (idx, [x, y, w, h], shaded_object) for every mask of a result.
+
+            Both ways work on the polygons of masks.xy (ultralytics keeps the
+            largest contour of every mask), so they give exactly the same boxes
+            and crops, see tests/test_segmentation_crops.py.
+        """
+        polygons = [(idx, polygon) for idx, polygon in enumerate(masks.xy) if len(polygon)]
+
+        if self.vectorized_crops:
+            yield from self.shade_objects_vectorized(polygons, img)
+        else:
+            for idx, polygon in polygons:
+                yield (idx, *self.shade_polygon(polygon, img))
+
+
+    def shade_objects_vectorized(self, polygons, img):
+        """
+            Same output as shade_polygon() for every (idx, polygon), but the colour
+            blend is done once for the area covered by the objects' boxes instead
+            of once per object, so per object we are left with filling the
+            polygon and a single np.where.
+        """
+        if not polygons:
+            return
+
+        boxes = [cv2.boundingRect(np.int32([polygon])) for _, polygon in polygons]
+
+        # Only the rectangle around all the boxes is blended, the rest of the
+        # image never ends up in a crop
+        x0 = min(x for x, _, _, _ in boxes)
+        y0 = min(y for _, y, _, _ in boxes)
+        x1 = max(x + w for x, _, w, _ in boxes)
+        y1 = max(y + h for _, y, _, h in boxes)
+        area = img[y0:y1, x0:x1]
+
+        # Same addWeighted as shade_polygon(): pixels inside a mask get the
+        # (255, 255, 0) tint, everything else only gets the 0.7 weight of the original
+        tint = np.empty_like(area)
+        tint[:] = (255, 255, 0)
+        tinted = cv2.addWeighted(area, 0.7, tint, 0.3, 0)
+        dimmed = cv2.addWeighted(area, 0.7, np.zeros_like(area), 0.3, 0)
+
+        for (idx, polygon), (x, y, w, h) in zip(polygons, boxes):
+            # Slicing clips the box to the image, the same way shade_polygon's crop does
+            tinted_crop = tinted[y-y0:y-y0+h, x-x0:x-x0+w]
+            inside = np.zeros(tinted_crop.shape[:2], dtype=np.uint8)
+            cv2.fillPoly(inside, [np.int32(polygon - [x, y])], 1)
+
+            shaded_object = np.where(inside[:, :, None].astype(bool), tinted_crop, dimmed[y-y0:y-y0+h, x-x0:x-x0+w])
+            yield (idx, [x, y, w, h], shaded_object)
+
+
+    def shade_polygon(self, mask, img):
+        points = np.int32([mask])
+
+        # extract these 4 variables from the points
+        # we will be using these to extract cropped segment objects
+        x, y, w, h = cv2.boundingRect(points)
+
+        cropped_object = img[y:y+h, x:x+w]
+
+        # Create a binary mask for the cropped object
+        mask_img = np.zeros_like(cropped_object)
+        mask_points = mask - [x, y]  # Adjust mask points to cropped object coordinates
+        cv2.fillPoly(mask_img, [np.int32(mask_points)], (255,255 ,0 ))
+        
+        # Combine the original cropped object with the colored mask
+        shaded_object = cv2.addWeighted(cropped_object, 0.7, mask_img, 0.3, 0)
+        return ([x, y, w, h], shaded_object)
+
+
+def load_model():
+    # ultralytics is imported here and not at the top so that importing this
+    # file stays cheap until the model is really needed
+    from ultralytics import YOLO
+
+    print(f"[INFO] Initializing Segmentation model from {SegmentationModel.model_path}")
+    return YOLO(SegmentationModel.model_path)
+
+
+model_registry.register("segmentation", load_model)
+onnx_backend.register_variants("segmentation", lambda: SegmentationModel.model_path)
@@ -2,7 +2,8 @@
 from models.segmentation_model import SegmentationModel
 from models.identification_model import IdentificationModel
 from models.text_extraction_model import TextExtractionModel
-from g4f.client import Client
+from utils.llm_client import LLMClient
+from utils.prompt_serializer import serialize, count_tokens
 
 
 """
@@ -20,6 +21,16 @@ from g4f.client import Client
     This allows me to access the model for free without any API keys or any other requirements.
     Since, I can't hardcode the API key either I have used this package to access the model.
 
+    Every request goes through utils/llm_client.py: one pooled client, a limit on parallel
+    requests, timeouts with retries and a cache of the responses, for summarize() as much
+    as for the async path (summarize_async / summarize_many) of batch runs. Passing base_url
+    sends the requests to any OpenAI compatible server instead of gpt4free. summarize_stream gives the summary piece by
+    piece as the model writes it.
+
+    The data in the prompt is written by utils/prompt_serializer.py, without the paths
+    and with rounded boxes and the detections grouped by class, and it is kept under
+    max_prompt_tokens. compact_prompt=False gives back the old raw reprs.
+
 """
 class SummarizationModel:
     
@@ -41,19 +52,78 @@ class SummarizationModel:
         Here is the info:-
     """
         
-    def __init__(self) -> None:
-        pass
+    model_name = "gpt-3.5-turbo"
 
-    def summarize(self, obj_metadata, desc, txt_results):
-        content_2 = self.content_1 + f"""\nobj_metadata: {obj_metadata} \n desc: {desc} \n txt_results: {txt_results}
+    def __init__(self, cache=None, base_url=None, api_key=None, max_concurrency=4, timeout=60.0, retries=3,
+                 max_prompt_tokens=1024, compact_prompt=True) -> None:
+        # Optional utils.result_cache.ResultCache, keyed on the normalized prompt
+        self.cache = cache
+        self.base_url = base_url
+        self.llm = LLMClient(self.model_name, base_url, api_key, max_concurrency, timeout, retries, cache=cache)
+
+        self.max_prompt_tokens = max_prompt_tokens
+        self.compact_prompt = compact_prompt
+
+        # Size of the last prompt that was built, {"chars", "tokens", "data_tokens", "budget"}
+        self.last_prompt_stats = None
+
+    def build_prompt(self, obj_metadata, desc, txt_results):
+        if not self.compact_prompt:
+            prompt = self.content_1 + f"""\nobj_metadata: {obj_metadata} \n desc: {desc} \n txt_results: {txt_results}
         Summarize the nature and attribute of each object."""
+            self.report_prompt(prompt, None)
+            return prompt
+
+        # The indentation of content_1 is only there for this file, no need to pay for it
+        instructions = "\n".join(line.strip() for line in self.content_1.strip().splitlines())
+        footer = "Summarize the nature and attribute of each object."
+
+        budget = None
+        if self.max_prompt_tokens is not None:
+            budget = max(self.max_prompt_tokens - count_tokens(instructions) - count_tokens(footer) - 2, 0)
+        data, data_tokens = serialize(obj_metadata, desc, txt_results, budget)
+
+        prompt = f"{instructions}\n{data}\n{footer}"
+        self.report_prompt(prompt, data_tokens)
+        return prompt
+
+    def report_prompt(self, prompt, data_tokens):
+        self.last_prompt_stats = {
+            "chars": len(prompt),
+            "tokens": count_tokens(prompt),
+            "data_tokens": data_tokens,
+            "budget": self.max_prompt_tokens if self.compact_prompt else None,
+        }
+        print(f"[INFO] Summarization prompt: {self.last_prompt_stats['chars']} chars, "
+              f"~{self.last_prompt_stats['tokens']} tokens (budget {self.last_prompt_stats['budget']})")
 
-        client = Client()
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": content_2}],
-            )
-        return response.choices[0].message.content
+    def summarize(self, obj_metadata, desc, txt_results):
+        content_2 = self.build_prompt(obj_metadata, desc, txt_results)
+        return self.llm.complete_sync(content_2)
+
+    async def summarize_async(self, obj_metadata, desc, txt_results):
+        return await self.llm.complete(self.build_prompt(obj_metadata, desc, txt_results))
+
+    def summarize_stream(self, obj_metadata, desc, txt_results):
+        """
+        Generator over the summary as it arrives, e.g. for st.write_stream().
+        """
+        return self.llm.stream_sync(self.build_prompt(obj_metadata, desc, txt_results))
+
+    def summarize_stream_async(self, obj_metadata, desc, txt_results):
+        # Same as summarize_stream() but an async iterator, for async code
+        return self.llm.stream(self.build_prompt(obj_metadata, desc, txt_results))
+
+    def summarize_many(self, items):
+        """
+        Summarizes a list of (obj_metadata, desc, txt_results) tuples in parallel,
+        at most max_concurrency requests at a time. Returns the summaries in order.
+        """
+        prompts = [self.build_prompt(*item) for item in items]
+        return self.llm.complete_many_sync(prompts)
+
+    def close(self):
+        self.llm.close()
 
 
 
@@ -1,14 +1,27 @@
-import easyocr
 import cv2
 import numpy as np
+from models import model_registry
+from utils.result_cache import MISSING, hash_file, package_version
+from utils.image_input import as_image_input
+from utils import metrics
 
 
 class TextExtractionModel:
-    def __init__(self):
-        print("[INFO] Initializing TextExtractor model")
-        self.reader = easyocr.Reader(['en'])
+    def __init__(self, cache=None):
+        # One easyocr.Reader per process, shared through the model registry.
+        # Its calls take the registry lock of the reader, easyocr isn't thread safe
+        self.registry_name = "text_extraction"
+        self.reader = model_registry.get(self.registry_name)
+
+        # Optional utils.result_cache.ResultCache for the extracted text
+        self.cache = cache
 
     def preprocess_image(self, img_path):
+        # An already decoded ImageInput (or BGR array) reuses its cached
+        # grayscale view instead of reading the file again
+        if not isinstance(img_path, str):
+            return as_image_input(img_path).resized((800, 600), gray=True)
+
         img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
         if img is None:
             raise ValueError(f"Failed to load image at {img_path}")
@@ -17,16 +30,192 @@ class TextExtractionModel:
         return img
 
     def extract_text(self, img_path):
-        processed_image = self.preprocess_image(img_path)
-        results = self.reader.readtext(processed_image)
+        key = None
+        if self.cache is not None:
+            content_hash = hash_file(img_path) if isinstance(img_path, str) else as_image_input(img_path).content_hash
+            key = self.cache.make_key(content_hash, "text_extraction", "easyocr-en",
+                                      package_version("easyocr"), {"size": [800, 600]})
+            # None is a valid result (no text found), hence MISSING
+            cached = self.cache.get(key, MISSING)
+            if cached is not MISSING:
+                return cached
+
+        joined_results = self.read_text(img_path)
+        if key is not None:
+            self.cache.put(key, joined_results)
+        return joined_results
+
+    def read_text(self, img_path):
+        with metrics.stage("preprocess", model="text_extraction"):
+            processed_image = self.preprocess_image(img_path)
+        with model_registry.lock(self.registry_name), metrics.stage("ocr", model="text_extraction") as span:
+            results = self.reader.readtext(processed_image)
+            span.count(images=1, regions=len(results))
 
-        # usually the format of output is 
-        # [(text, (x1, y1), (x2, y2), ...]
+        # EasyOCR gives [(bbox, text, confidence), ...]
         # From this we only need the text
-        extracted_texts = [text for (text, *_) in results]
+        extracted_texts = [text for (_, text, _) in results]
         joined_results = " ".join(extracted_texts)
         return joined_results if joined_results else None
 
+    def extract_text_batch(self, images, batch_size=8, workers=0, size=(800, 600)):
+        """
+        OCR for many images at once. images can be paths, ImageInputs or BGR arrays.
+        They are all resized to the same size so that EasyOCR can run text
+        detection on the whole batch in one go (readtext_batched), recognition
+        then runs batch_size regions at a time with `workers` data loader workers.
+
+        Returns one list per image of {"text", "conf", "bbox"} dicts, bbox being
+        [x1, y1, x2, y2] in the coordinates of the original image. Use
+        join_text() to get the same kind of string extract_text() returns.
+        """
+        images = [as_image_input(image) for image in images]
+        outputs = [None] * len(images)
+
+        keys = [None] * len(images)
+        missing = []
+        for idx, image in enumerate(images):
+            if self.cache is not None:
+                keys[idx] = self.cache.make_key(image.content_hash, "text_extraction_structured", "easyocr-en",
+                                                package_version("easyocr"), {"size": list(size)})
+                outputs[idx] = self.cache.get(keys[idx])
+            if outputs[idx] is None:
+                missing.append(idx)
+
+        if missing:
+            with metrics.stage("preprocess", model="text_extraction"):
+                processed_images = [images[idx].resized(size, gray=True) for idx in missing]
+            with model_registry.lock(self.registry_name), metrics.stage("ocr", model="text_extraction") as span:
+                batch_results = self.reader.readtext_batched(processed_images, n_width=size[0], n_height=size[1],
+                                                             batch_size=batch_size, workers=workers)
+                span.count(images=len(missing), regions=sum(len(results) for results in batch_results))
+
+            for idx, results in zip(missing, batch_results):
+                # Scale the boxes back from the resized image to the original one
+                height, width = images[idx].shape[:2]
+                scale = np.array([width / size[0], height / size[1]], dtype=np.float32)
+
+                extracted = []
+                for points, text, conf in results:
+                    points = np.asarray(points, dtype=np.float32) * scale
+                    extracted.append({
+                        "text": text,
+                        "conf": float(conf),
+                        "bbox": [round(float(v), 1) for v in (*points.min(axis=0), *points.max(axis=0))],
+                    })
+                outputs[idx] = extracted
+
+                if keys[idx] is not None:
+                    self.cache.put(keys[idx], extracted)
+
+        print(f"[INFO] Extracted text from {len(images)} images")
+        return outputs
+
+    @staticmethod
+    def join_text(results):
+        """
+        The texts of structured results joined into one string, None if there is no text.
+        """
+        joined_results = " ".join(result["text"] for result in results)
+        return joined_results if joined_results else None
+
+    def preprocess_image_keep_aspect(self, img_path, max_side=1280, max_upscale=2.0):
+        """
+        Grayscale image resized so that its longer side is max_side, keeping the
+        aspect ratio. Small images are upscaled (at most max_upscale times) which
+        helps with small text, big ones are downscaled which keeps OCR fast.
+
+        Returns the resized image and the scale factor applied to it.
+        """
+        gray = as_image_input(img_path).gray
+        height, width = gray.shape[:2]
+        scale = min(max_side / max(height, width), max_upscale)
+        if scale == 1.0:
+            return gray, scale
+
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+        return cv2.resize(gray, size, interpolation=interpolation), scale
+
+    def extract_text_regions(self, img_path, regions=None, detect=True, max_side=1280, batch_size=16):
+        """
+        Region targeted OCR. The image is resized keeping its aspect ratio (see
+        preprocess_image_keep_aspect) and then:
+
+        - regions=None: EasyOCR's detector proposes the text regions of the whole image
+        - regions given as [x, y, w, h] boxes in image coordinates (e.g. the
+          obj_seg_bbox of the segmented objects):
+            detect=True  -> only the detected text regions overlapping them are kept
+            detect=False -> every region is read as one line of text
+
+        All the regions are recognized together in a single batched recognize()
+        call. Returns a list of {"text", "conf", "bbox"} dicts, bbox being
+        [x1, y1, x2, y2] in the coordinates of the original image.
+        """
+        processed_image, scale = self.preprocess_image_keep_aspect(img_path, max_side)
+        height, width = processed_image.shape[:2]
+
+        # Target regions as [x_min, x_max, y_min, y_max] in resized coordinates,
+        # which is the horizontal_list format of EasyOCR
+        targets = None
+        if regions is not None:
+            targets = []
+            for x, y, w, h in regions:
+                targets.append([
+                    max(0, int(x * scale)), min(width, int(np.ceil((x + w) * scale))),
+                    max(0, int(y * scale)), min(height, int(np.ceil((y + h) * scale))),
+                ])
+
+        if targets is not None and not detect:
+            horizontal_list, free_list = targets, []
+        else:
+            with model_registry.lock(self.registry_name):
+                horizontal_lists, free_lists = self.reader.detect(processed_image)
+            horizontal_list, free_list = horizontal_lists[0], free_lists[0]
+
+            if targets is not None:
+                horizontal_list = [box for box in horizontal_list if any(self.overlaps(box, target) for target in targets)]
+                free_list = [poly for poly in free_list if any(self.overlaps(self.poly_to_box(poly), target) for target in targets)]
+
+        if not horizontal_list and not free_list:
+            return []
+
+        with model_registry.lock(self.registry_name):
+            results = self.reader.recognize(processed_image, horizontal_list=horizontal_list, free_list=free_list,
+                                            batch_size=batch_size, detail=1)
+
+        # recognize() gives (four corner points, text, confidence) per region
+        extracted = []
+        for points, text, conf in results:
+            points = np.asarray(points, dtype=np.float32) / scale
+            extracted.append({
+                "text": text,
+                "conf": float(conf),
+                "bbox": [round(float(v), 1) for v in (*points.min(axis=0), *points.max(axis=0))],
+            })
+        return extracted
+
+    @staticmethod
+    def poly_to_box(poly):
+        points = np.asarray(poly)
+        return [points[:, 0].min(), points[:, 0].max(), points[:, 1].min(), points[:, 1].max()]
+
+    @staticmethod
+    def overlaps(box, target):
+        # both in [x_min, x_max, y_min, y_max]
+        return box[0] < target[1] and target[0] < box[1] and box[2] < target[3] and target[2] < box[3]
+
+
+def load_model():
+    # easyocr pulls in torch and its own models, only import it when the reader
+    # is actually needed, not whenever this file is imported
+    import easyocr
+    print("[INFO] Initializing TextExtractor model")
+    return easyocr.Reader(['en'])
+
+
+model_registry.register("text_extraction", load_model)
+
 
 if __name__ == "__main__":
     model = TextExtractionModel()
@@ -0,0 +1,362 @@
+"""
+    Standalone HTTP inference service. The models are loaded once when the
+    server starts and stay warm, and concurrent requests are micro-batched
+    (utils/micro_batcher.py): requests that arrive within max_wait_ms of each
+    other go through YOLO / EasyOCR together in a single call.
+
+    Endpoints (the image is the raw request body, e.g. curl --data-binary @img.jpg):
+
+        POST /segment       segmented objects: boxes and ids, no crops
+        POST /identify      detections: class, confidence and box
+        POST /ocr           extracted text and its regions
+        POST /pipeline      all three mapped together (DataMapping), plus the
+                            summary if the server runs with --summarize
+                            (?summarize=0 skips it for one request)
+        GET  /healthz       200 as long as the process is up
+        GET  /readyz        200 once the models are loaded, 503 before
+        GET  /stats         queue depths and batch counts per model
+
+    ?name=... sets the master_id of the image (default a hash of its content).
+
+    The summaries are requested from a batcher of their own too (in parallel,
+    see SummarizationModel.summarize_many), so a slow LLM holds up nothing but
+    the requests waiting for a summary, and they get a 504 after --request-timeout.
+
+    Backpressure: every model has a bounded queue (--max-queue). A request that
+    doesn't fit is answered right away with 503 and a Retry-After header instead
+    of waiting, and one that waits longer than --request-timeout gets a 504.
+
+    Usage (from the root folder):
+        python3 service/server.py --port 8080 --max-batch-size 8 --max-wait-ms 10
+        curl --data-binary @data/input_images/000000000025.jpg "http://127.0.0.1:8080/pipeline?name=000000000025"
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from models.segmentation_model import SegmentationModel
+from models.identification_model import IdentificationModel
+from models.text_extraction_model import TextExtractionModel
+from models.summarization_model import SummarizationModel
+from models.onnx_backend import BACKENDS, QUANTIZE_MODES
+from models.inference_config import InferenceConfig
+from utils.data_mapping import DataMapping
+from utils.image_input import ImageInput
+from utils.micro_batcher import MicroBatcher, QueueFull
+from utils import metrics
+
+
+class NotReady(RuntimeError):
+    pass
+
+
+class InferenceService:
+    def __init__(self, max_batch_size=8, max_wait_ms=10, max_queue=64, request_timeout=30.0, ocr_batch_size=8,
+                 summarize=False, backend="torch", quantize=None, seg_config=None, id_config=None,
+                 llm_base_url=None, llm_api_key=None) -> None:
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_queue = max_queue
+        self.request_timeout = request_timeout
+        self.ocr_batch_size = ocr_batch_size
+        self.summarize = summarize
+        self.model_kwargs = {"backend": backend, "quantize": quantize}
+        self.seg_config = seg_config
+        self.id_config = id_config
+        self.llm_kwargs = {"base_url": llm_base_url, "api_key": llm_api_key}
+
+        self.batchers = dict()
+        self.summ_model = None
+        self.data_mapping = DataMapping()
+        self.ready = threading.Event()
+        self.error = None
+
+    def load(self):
+        """
+        Loads every model, starts the batchers and runs one dummy image through
+        each of them, so the first real request doesn't pay for lazy initialisation.
+        """
+        try:
+            # Nothing is written to disk and the responses only carry the metadata,
+            # so the shaded crops aren't held on to either
+            seg_model = SegmentationModel("memory", config=self.seg_config, keep_objects=False, **self.model_kwargs)
+            id_model = IdentificationModel("memory", config=self.id_config, **self.model_kwargs)
+            txt_ext_model = TextExtractionModel()
+            if self.summarize:
+                self.summ_model = SummarizationModel(**self.llm_kwargs)
+
+            functions = {
+                "segmentation": lambda images: seg_model.predict_batch(images, self.max_batch_size),
+                "identification": lambda images: [desc for desc, _ in
+                                                  id_model.generate_descriptions_batch(images, self.max_batch_size)],
+                "text_extraction": lambda images: txt_ext_model.extract_text_batch(images, self.ocr_batch_size),
+            }
+            for name, fn in functions.items():
+                self.batchers[name] = MicroBatcher(fn, self.max_batch_size, self.max_wait_ms, self.max_queue, name).start()
+
+            dummy = ImageInput(np.zeros((64, 64, 3), dtype=np.uint8), name="warmup")
+            for batcher in self.batchers.values():
+                batcher.submit(dummy).result()
+
+            # Not warmed up, that would be a request to the LLM
+            if self.summ_model is not None:
+                self.batchers["summary"] = MicroBatcher(self.summ_model.summarize_many, self.max_batch_size,
+                                                        self.max_wait_ms, self.max_queue, "summary").start()
+        except Exception as e:
+            self.error = e
+            print(f"[INFO] Loading the models failed: {e!r}")
+            raise
+        self.ready.set()
+        print("[INFO] Models loaded, the service is ready")
+
+    def stop(self):
+        for batcher in self.batchers.values():
+            batcher.stop()
+        if self.summ_model is not None:
+            self.summ_model.close()
+
+    def submit(self, name, image):
+        if not self.ready.is_set():
+            raise NotReady("The models are still loading")
+        return self.batchers[name].submit(image)
+
+    def wait(self, future, deadline=None):
+        """
+        The result of future, waiting until deadline (a time.perf_counter()
+        value) or request_timeout from now. Once nobody waits for it anymore
+        it's cancelled, so the batcher drops it if it hasn't started on it yet.
+        """
+        timeout = self.request_timeout if deadline is None else max(deadline - time.perf_counter(), 0)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+
+    def segment(self, image):
+        _, object_metadata = self.wait(self.submit("segmentation", image))
+        return {"master_id": image.master_id, "objects": object_metadata}
+
+    def identify(self, image):
+        return {"master_id": image.master_id, "descriptions": self.wait(self.submit("identification", image))}
+
+    def ocr(self, image):
+        text_regions = self.wait(self.submit("text_extraction", image))
+        return {"master_id": image.master_id, "text": TextExtractionModel.join_text(text_regions),
+                "text_regions": text_regions}
+
+    def pipeline(self, image, summarize=True):
+        # One deadline for the whole request, not request_timeout for every
+        # model it waits on
+        deadline = time.perf_counter() + self.request_timeout
+        futures = dict()
+        try:
+            # The three models get the image at the same time, each one in
+            # its own batch with whatever other requests are waiting
+            for name in ("segmentation", "identification", "text_extraction"):
+                futures[name] = self.submit(name, image)
+            seg_data = self.wait(futures["segmentation"], deadline)
+            desc = self.wait(futures["identification"], deadline)
+            text_regions = self.wait(futures["text_extraction"], deadline)
+            text = TextExtractionModel.join_text(text_regions)
+
+            summary = None
+            if self.summ_model is not None and summarize:
+                futures["summary"] = self.submit("summary", (seg_data[1], desc, text))
+                summary = self.wait(futures["summary"], deadline)
+        except Exception:
+            # The request failed (or timed out), what's still queued for it
+            # would only be work for nobody
+            for future in futures.values():
+                future.cancel()
+            raise
+
+        final_dict = self.data_mapping.mapping(seg_data, (desc, None), text, summary, image.master_id)
+        master_data = final_dict[image.master_id]
+        master_data["text_regions"] = text_regions
+        return {"master_id": image.master_id, **master_data}
+
+    def stats(self):
+        return {
+            "ready": self.ready.is_set(),
+            "models": {
+                name: {"queued": len(batcher), "batches": batcher.batches, "items": batcher.items,
+                       "rejected": batcher.rejected}
+                for name, batcher in self.batchers.items()
+            },
+        }
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # Bigger uploads are refused before they're read
+    max_body_bytes = 32 * 1024 * 1024
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        service = self.server.service
+        path = urlparse(self.path).path.rstrip("/")
+        if path == "/healthz":
+            self.send_json(200, {"status": "ok"})
+        elif path == "/readyz":
+            if service.ready.is_set():
+                self.send_json(200, {"status": "ready"})
+            else:
+                status = "failed" if service.error is not None else "loading"
+                self.send_json(503, {"status": status})
+        elif path == "/stats":
+            self.send_json(200, service.stats())
+        else:
+            self.send_json(404, {"error": f"Unknown endpoint {path}"})
+
+    def do_POST(self):
+        service = self.server.service
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        path = url.path.rstrip("/")
+        handlers = {"/segment": service.segment, "/identify": service.identify, "/ocr": service.ocr,
+                    "/pipeline": service.pipeline}
+        if path not in handlers:
+            self.send_json(404, {"error": f"Unknown endpoint {path}"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            # The body can't be told apart from the next request, so drop the connection
+            self.close_connection = True
+            self.send_json(400, {"error": "Invalid Content-Length header"})
+            return
+        if length > self.max_body_bytes:
+            self.close_connection = True
+            self.send_json(413, {"error": f"Images are limited to {self.max_body_bytes} bytes"})
+            return
+
+        try:
+            image = ImageInput.from_bytes(self.rfile.read(length), name=query.get("name", [None])[0])
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+
+        try:
+            with metrics.stage("request", endpoint=path):
+                if path == "/pipeline":
+                    body = service.pipeline(image, summarize=query.get("summarize", ["1"])[0] != "0")
+                else:
+                    body = handlers[path](image)
+        except (QueueFull, NotReady) as e:
+            self.send_json(503, {"error": str(e)}, {"Retry-After": "1"})
+        except FutureTimeoutError:
+            self.send_json(504, {"error": f"No result within {service.request_timeout}s"})
+        except Exception as e:
+            self.send_json(500, {"error": repr(e)})
+        else:
+            self.send_json(200, body)
+
+    def log_message(self, format, *args):
+        # One line per request would drown everything else
+        pass
+
+
+class InferenceServer:
+    def __init__(self, service, host="127.0.0.1", port=8080) -> None:
+        # port=0 picks a free port, see base_url for the one that was given
+        self.service = service
+        self.server = ThreadingHTTPServer((host, port), ServiceHandler)
+        self.server.daemon_threads = True
+        self.server.service = service
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self, wait_ready=False):
+        """
+        Starts answering right away, /healthz works while the models load in the
+        background and /readyz turns to 200 when they're done.
+        """
+        loader = threading.Thread(target=self.service.load, name="model-loader", daemon=True)
+        loader.start()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        if wait_ready:
+            loader.join()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.service.stop()
+
+    def __enter__(self):
+        return self.start(wait_ready=True)
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP inference service with micro-batching")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-batch-size", type=int, default=8, help="Most images per model call")
+    parser.add_argument("--max-wait-ms", type=float, default=10, help="How long a request waits for others to batch with")
+    parser.add_argument("--max-queue", type=int, default=64, help="Requests waiting per model before answering 503")
+    parser.add_argument("--request-timeout", type=float, default=30.0, help="Seconds before a request gets a 504")
+    parser.add_argument("--ocr-batch-size", type=int, default=8, help="Text regions recognized per EasyOCR batch")
+    parser.add_argument("--summarize", action="store_true", help="Add a summary to the /pipeline responses")
+    parser.add_argument("--llm-base-url", default=None, help="OpenAI compatible server for the summaries")
+    parser.add_argument("--llm-api-key", default=os.environ.get("LLM_API_KEY"), help="API key of --llm-base-url (default: $LLM_API_KEY)")
+    parser.add_argument("--backend", choices=BACKENDS, default="torch", help="Run the YOLO models with PyTorch or ONNX Runtime")
+    parser.add_argument("--quantize", choices=QUANTIZE_MODES, default=None, help="INT8 quantization of the ONNX models")
+    parser.add_argument("--seg-config", type=InferenceConfig.from_string, default=None, help="Settings of the segmentation model, see models/inference_config.py")
+    parser.add_argument("--id-config", type=InferenceConfig.from_string, default=None, help="Settings of the identification model")
+    parser.add_argument("--metrics-jsonl", default=None, help="Write per-stage timings as JSON lines to this file")
+    parser.add_argument("--metrics-prom", default=None, help="Write aggregated metrics in the Prometheus text format to this file")
+    args = parser.parse_args()
+    if args.quantize and args.backend != "onnx":
+        parser.error("--quantize needs --backend onnx")
+
+    metrics.configure_from_env(args.metrics_jsonl, args.metrics_prom)
+
+    service = InferenceService(args.max_batch_size, args.max_wait_ms, args.max_queue, args.request_timeout,
+                               args.ocr_batch_size, args.summarize, args.backend, args.quantize,
+                               args.seg_config, args.id_config, args.llm_base_url, args.llm_api_key)
+    server = InferenceServer(service, args.host, args.port)
+    print(f"[INFO] Serving on {server.base_url}, loading the models")
+    server.start()
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        metrics.close()
+
+
+if __name__ == "__main__":
+    main()
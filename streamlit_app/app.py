@@ -11,13 +11,20 @@ from models.segmentation_model import SegmentationModel
 from models.identification_model import IdentificationModel
 from models.text_extraction_model import TextExtractionModel
 from models.summarization_model import SummarizationModel
+from models import model_registry
 from utils.data_mapping import DataMapping
 from utils.visualization import shorten_path
+from utils.pipeline import Pipeline
+from utils.image_input import ImageInput
+from utils import metrics
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import time
 import sys
+import hashlib
+import threading
 
 
-def visualize(final_dict, img_path):
+def visualize(final_dict):
 
 
     """
@@ -81,10 +88,53 @@ sys.path.insert(0, root_dir)
 
     # Optionally, print the PYTHONPATH to verify
 
-    
+
+# Streamlit reruns this whole script on every widget interaction. The model
+# weights are loaded once per process through the model registry, and this
+# cached resource makes sure that happens (once) before the first upload.
+# The model classes themselves hold per-call state, so each stage below creates
+# its own cheap instance on top of the shared weights.
+@st.cache_resource(show_spinner="Loading models...")
+def load_models():
+    # Metrics sinks and profiling are set through PIPELINE_METRICS_* / PIPELINE_PROFILE_*
+    # environment variables, see utils/metrics.py
+    metrics.configure_from_env()
+    model_registry.warmup(["segmentation", "identification", "text_extraction"])
+    return True
+
+
+# Each stage is cached by the hash of the uploaded file, so reruns and
+# re-uploads of the same image skip straight to the results. Arguments starting
+# with an underscore are not part of the cache key. Every session shares the
+# same model instances, the models take their model_registry lock themselves so
+# two sessions uploading at the same time take turns on each of them.
+@st.cache_data(show_spinner=False, max_entries=64)
+def run_segmentation(upload_hash, _image):
+    return SegmentationModel().predict(_image)
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def run_identification(upload_hash, _image):
+    return IdentificationModel().generate_descriptions(_image)
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def run_text_extraction(upload_hash, _image):
+    return TextExtractionModel().extract_text(_image)
+
+
+# One summarizer for the whole app, its client keeps the connections open and
+# remembers the responses, so a rerun streams a summary it has seen at once
+@st.cache_resource
+def load_summarizer():
+    return SummarizationModel()
+
+
 # Streamlit UI
 st.title("Pipeline Testing UI")
 
+load_models()
+
 uploaded_file = st.file_uploader("Choose an image...", type="jpg")
     # Get the root directory of the project
 
@@ -92,50 +142,80 @@ uploaded_file = st.file_uploader("Choose an image...", type="jpg")
 if uploaded_file is not None:
 
 
-    # Save the uploaded file to a temporary location
-    img_path = "temp.jpg"
-    with open(img_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
+    # The upload is decoded once here and every model gets this same buffer,
+    # nothing is written to disk. It's named after its content so that the
+    # master_id is the same for the same image
+    upload_bytes = uploaded_file.getvalue()
+    upload_hash = hashlib.sha256(upload_bytes).hexdigest()
+    image = ImageInput.from_bytes(upload_bytes, name=f"{upload_hash[:16]}.jpg")
 
     # Display the uploaded image
-    st.image(img_path, caption='Uploaded Image', use_column_width=True)
+    st.image(image.rgb, caption='Uploaded Image', use_column_width=True)
     st.write("")
 
-    # Now we will load each models one by one and test them on the uploaded image
-    seg_model = SegmentationModel()
-    segmented_objects, obj_metadata = seg_model.predict(img_path)
-
-    st.write("Object Metadata:", obj_metadata)
-
-    for object in obj_metadata:
-        
-        object_img_path = object['object_img_path']
-        if os.path.exists(object_img_path):
-            st.image(object_img_path, caption=f" Object Image {object['object_id']}", use_column_width=True)
-            print(f"[INFO] Successfully loaded object image from {object_img_path}")
-            st.write("")
-        else:
-            raise Exception(f" Path doesn't exist", object_img_path)
-
-    id_model = IdentificationModel()
-    desc = id_model.generate_descriptions(img_path)
-    st.write("Descriptions:", desc)
-
-    txt_ext_model = TextExtractionModel()
-    text = txt_ext_model.extract_text(img_path)
-    st.write("Extracted Text:", text)
-
-    summ_model = SummarizationModel()
-    summ_model_data = summ_model.summarize(obj_metadata, desc, text)
-    st.write("Summarization Model Data:", summ_model_data)
+    # Segmentation, identification and text extraction run at the same time
+    # through the pipeline orchestrator. Every stage gets its own spot on the page,
+    # created up front, and is rendered there as soon as it finishes.
+    labels = {
+        "segmentation": "Segmenting objects...",
+        "identification": "Identifying objects...",
+        "text_extraction": "Extracting text...",
+        "summary": "Summarizing...",
+    }
+    statuses = {name: st.status(label) for name, label in labels.items()}
+
+    def show_stage(name, output):
+        if name not in statuses:
+            return
+        with statuses[name]:
+            if name == "segmentation":
+                segmented_objects, obj_metadata = output
+                st.write("Object Metadata:", obj_metadata)
+                for object, segmented_image in zip(obj_metadata, segmented_objects):
+
+                    # The shaded object is already in memory, no need to read it back from disk
+                    st.image(segmented_image, channels="BGR", caption=f" Object Image {object['object_id']}", use_column_width=True)
+                    st.write("")
+                label = f"Segmentation: {len(obj_metadata)} objects"
+            elif name == "identification":
+                st.write("Descriptions:", output[0])
+                label = f"Identification: {len(output[0])} objects"
+            else:
+                st.write("Extracted Text:", output)
+                label = "Text extraction done"
+        statuses[name].update(label=label, state="complete", expanded=True)
+
+    # The stages run in pool threads, they need the script context to use st.cache_data
+    script_ctx = get_script_run_ctx()
+
+    def in_script_ctx(fn):
+        def wrapped(*args):
+            add_script_run_ctx(threading.current_thread(), script_ctx)
+            return fn(*args)
+        return wrapped
+
+    with Pipeline("thread", max_workers=3) as pipeline:
+        pipeline.add_stage("segmentation", in_script_ctx(run_segmentation), ["upload_hash", "image"])
+        pipeline.add_stage("identification", in_script_ctx(run_identification), ["upload_hash", "image"])
+        pipeline.add_stage("text_extraction", in_script_ctx(run_text_extraction), ["upload_hash", "image"])
+        outputs = pipeline.run({"upload_hash": upload_hash, "image": image}, on_stage_done=show_stage)
+
+    # The summary is streamed onto the page as the LLM writes it, instead of
+    # showing nothing until the whole response is there
+    with statuses["summary"]:
+        st.write("Summarization Model Data:")
+        summary = st.write_stream(load_summarizer().summarize_stream(
+            outputs["segmentation"][1], outputs["identification"][0], outputs["text_extraction"]))
+    statuses["summary"].update(label="Summarization done", state="complete", expanded=True)
 
     data_mapping = DataMapping()
-    final_dict = data_mapping.mapping((segmented_objects, obj_metadata), desc, text, summ_model_data)
+    final_dict = data_mapping.mapping(outputs["segmentation"], outputs["identification"], outputs["text_extraction"], summary,
+                                      image.master_id)
     st.write("Final Dictionary:", final_dict)
 
     # Visualize the final output
     if final_dict:
-        fig = visualize(final_dict, img_path)
+        fig = visualize(final_dict)
         st.pyplot(fig)
     else:
         st.write("No detections were made.")
@@ -143,4 +223,4 @@ if uploaded_file is not None:
     st.write("Mapped Data Table:")
     st.table(final_dict)
 else:
-    st.write("Please upload an image to start the pipeline testing.")
\ No newline at end of file
+    st.write("Please upload an image to start the pipeline testing.")
@@ -0,0 +1,102 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+
+from models import model_registry
+from models.segmentation_model import SegmentationModel
+from models.identification_model import IdentificationModel
+from utils.image_input import ImageInput
+
+
+class StubYOLO:
+	# Stands in for an ultralytics model: one person per image, its box and mask
+	# depending on the image size, and every call to predict() recorded
+
+	names = {0: "person", 1: "car"}
+
+	def __init__(self, with_masks):
+		self.with_masks = with_masks
+		self.batches = []
+
+	def predict(self, images, **kwargs):
+		self.batches.append(len(images))
+		return [self.result(img) for img in images]
+
+	def result(self, img):
+		height, width = img.shape[:2]
+		box = [width // 4, height // 4, width // 2, height // 2]
+		boxes = torch.tensor([box + [0.9, 0]], dtype=torch.float32)
+		masks = None
+		if self.with_masks:
+			masks = torch.zeros((1, height, width))
+			masks[0, box[1]:box[3], box[0]:box[2]] = 1
+		return Results(img, path="stub.jpg", names=self.names, boxes=boxes, masks=masks)
+
+
+def make_images(n):
+	rng = np.random.default_rng(0)
+	return [ImageInput(rng.integers(0, 255, (40 + 8 * i, 60 + 4 * i, 3), dtype=np.uint8), name=f"img{i}.jpg")
+			for i in range(n)]
+
+
+class TestBatchModels(unittest.TestCase):
+
+	def test_predict_batch(self):
+		stub = StubYOLO(with_masks=True)
+		with mock.patch.object(model_registry, "get", return_value=stub):
+			model = SegmentationModel("memory")
+		images = make_images(5)
+
+		outputs = model.predict_batch(images, batch_size=2)
+		# One forward pass per batch, one output per image in the input order
+		self.assertEqual(stub.batches, [2, 2, 1])
+		self.assertEqual(len(outputs), 5)
+
+		for image, (segmented_objects, obj_metadata) in zip(images, outputs):
+			expected_objects, expected_metadata = model.predict(image)
+			self.assertEqual(obj_metadata, expected_metadata)
+			self.assertEqual(obj_metadata[0]["master_id"], image.master_id)
+			for crop, expected in zip(segmented_objects, expected_objects):
+				np.testing.assert_array_equal(crop, expected)
+
+	def test_generate_descriptions_batch(self):
+		stub = StubYOLO(with_masks=False)
+		with mock.patch.object(model_registry, "get", return_value=stub):
+			model = IdentificationModel("memory")
+		images = make_images(5)
+
+		outputs = model.generate_descriptions_batch(images, batch_size=4)
+		self.assertEqual(stub.batches, [4, 1])
+		self.assertEqual(len(outputs), 5)
+
+		for image, (descriptions, output_img_path) in zip(images, outputs):
+			self.assertEqual((descriptions, output_img_path), model.generate_descriptions(image))
+			height, width = image.shape[:2]
+			self.assertEqual(descriptions, [{"object_class": "person", "conf": 0.9,
+											 "obj_id_bbox": [[width // 4, height // 4, width // 2, height // 2]]}])
+			# memory mode doesn't save the annotated image
+			self.assertIsNone(output_img_path)
+
+
+	def test_image_dir(self):
+		# The crops and annotated images go where image_dir says, not to the models' temporary directories
+		with tempfile.TemporaryDirectory() as temp_dir:
+			image_dir = os.path.join(temp_dir, "images")
+			with mock.patch.object(model_registry, "get", return_value=StubYOLO(with_masks=True)):
+				seg_model = SegmentationModel("sync", image_dir=image_dir)
+				id_model = IdentificationModel("sync", image_dir=image_dir)
+			image = make_images(1)[0]
+
+			_, obj_metadata = seg_model.predict(image)
+			_, output_img_path = id_model.generate_descriptions(image)
+			for path in (obj_metadata[0]["object_img_path"], output_img_path):
+				self.assertEqual(os.path.dirname(path), image_dir)
+				self.assertTrue(os.path.exists(path))
+
+if __name__ == '__main__':
+	unittest.main()
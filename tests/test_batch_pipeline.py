@@ -0,0 +1,120 @@
+import os
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+import cv2
+import numpy as np
+
+from models.text_extraction_model import TextExtractionModel
+from utils import batch_pipeline
+from utils.batch_pipeline import BatchPipeline
+
+
+class FakeSegmentationModel:
+	batches = []
+
+	def __init__(self, *args, **kwargs):
+		self.keep_objects = kwargs["keep_objects"]
+
+	def predict_batch(self, images, batch_size=8):
+		self.batches.append(len(images))
+		outputs = []
+		for image in images:
+			crop = image.bgr[:5, :5].copy()
+			metadata = [{"object_id": f"{image.master_id}_obj_0", "object_img_path": None, "obj_seg_bbox": [0, 0, 5, 5],
+						 "master_image": image.path, "master_id": image.master_id}]
+			outputs.append(([crop] if self.keep_objects else [], metadata))
+		return outputs
+
+	def flush(self):
+		pass
+
+
+class FakeIdentificationModel:
+	def __init__(self, *args, **kwargs):
+		pass
+
+	def generate_descriptions_batch(self, images, batch_size=8):
+		return [([{"object_class": "person", "conf": 0.9, "obj_id_bbox": [[0, 0, 5, 5]]}], None) for _ in images]
+
+	def flush(self):
+		pass
+
+
+class FakeTextExtractionModel:
+	join_text = staticmethod(TextExtractionModel.join_text)
+
+	def __init__(self, *args, **kwargs):
+		pass
+
+	def extract_text_batch(self, images, batch_size=8, workers=0):
+		return [[] for _ in images]
+
+
+@mock.patch.multiple(batch_pipeline, SegmentationModel=FakeSegmentationModel,
+					 IdentificationModel=FakeIdentificationModel, TextExtractionModel=FakeTextExtractionModel)
+class TestBatchPipeline(unittest.TestCase):
+
+	def setUp(self):
+		FakeSegmentationModel.batches = []
+		self.temp_dir = tempfile.TemporaryDirectory()
+		self.output_dir = os.path.join(self.temp_dir.name, "output")
+		self.img_paths = []
+		for idx in range(5):
+			path = os.path.join(self.temp_dir.name, f"img{idx}.png")
+			cv2.imwrite(path, np.full((20, 20, 3), idx * 40, dtype=np.uint8))
+			self.img_paths.append(path)
+
+	def tearDown(self):
+		self.temp_dir.cleanup()
+
+	def test_iter_results_streams_one_image_at_a_time(self):
+		pipeline = BatchPipeline(batch_size=2, output_dir=self.output_dir)
+		results = pipeline.iter_results(self.img_paths)
+
+		img_path, final_dict, crops = next(results)
+		self.assertEqual(img_path, self.img_paths[0])
+		self.assertEqual(list(final_dict), ["img0"])
+		self.assertEqual(crops, [])
+		# Written before it's handed out
+		self.assertTrue(os.path.exists(os.path.join(self.output_dir, "img0.json")))
+		# Only the first batch has been run so far
+		self.assertEqual(FakeSegmentationModel.batches, [2])
+
+		rest = list(results)
+		self.assertEqual([path for path, _, _ in rest], self.img_paths[1:])
+		self.assertEqual(FakeSegmentationModel.batches, [2, 2, 1])
+
+	def test_keep_crops(self):
+		pipeline = BatchPipeline(batch_size=2, output_dir=self.output_dir, keep_crops=True)
+		for _, _, crops in pipeline.iter_results(self.img_paths):
+			self.assertEqual(len(crops), 1)
+			self.assertEqual(crops[0].shape, (5, 5, 3))
+
+	def test_run_keeps_every_result(self):
+		results = BatchPipeline(batch_size=2, output_dir=self.output_dir).run(self.img_paths)
+		self.assertEqual(sorted(results), [f"img{idx}" for idx in range(5)])
+		with open(os.path.join(self.output_dir, "img3.json")) as f:
+			self.assertEqual(json.load(f)["img3"]["entries"][0]["obj_name"], "person")
+
+	def test_iter_results_leaves_the_pipeline_open(self):
+		pipeline = BatchPipeline(batch_size=2, output_dir=self.output_dir)
+		with mock.patch.object(pipeline, "close") as close:
+			self.assertEqual(len(list(pipeline.iter_results(self.img_paths[:3]))), 3)
+			# the same pipeline runs again, closing it is up to its owner
+			self.assertEqual(len(list(pipeline.iter_results(self.img_paths[3:]))), 2)
+		close.assert_not_called()
+
+	def test_memory_ceiling_shrinks_batches(self):
+		pipeline = BatchPipeline(batch_size=4, output_dir=self.output_dir, max_memory_mb=1)
+		with mock.patch("utils.memory_guard.metrics.rss_bytes", return_value=2 * 1024 * 1024):
+			with mock.patch("utils.memory_guard.trim_heap"):
+				paths = [path for path, _, _ in pipeline.iter_results(self.img_paths[:3])]
+		self.assertEqual(paths, self.img_paths[:3])
+		self.assertEqual(FakeSegmentationModel.batches, [2, 1])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+from unittest import mock
+
+from benchmarks import benchmark
+from benchmarks.benchmark import RSSTracker, compare, summarize_timings
+from benchmarks.mock_llm_server import MockLLMServer
+from models.summarization_model import SummarizationModel
+
+
+def make_results(p50_ms, images_per_sec):
+	return {"stages": {"segmentation": {"p50_ms": p50_ms, "p95_ms": 2 * p50_ms, "images_per_sec": images_per_sec,
+										"load_s": 1.0, "rss_delta_mb": 500.0}}}
+
+
+class TestBenchmark(unittest.TestCase):
+
+	def test_summarize_timings(self):
+		result = summarize_timings([0.01] * 19 + [0.1], load_s=1.23456)
+		self.assertEqual(result["n"], 20)
+		self.assertEqual(result["p50_ms"], 10.0)
+		self.assertGreater(result["p95_ms"], 10.0)
+		self.assertEqual(result["load_s"], 1.235)
+
+	def test_rss_tracker(self):
+		rss = iter([100 * 1024 * 1024, 300 * 1024 * 1024, 200 * 1024 * 1024])
+		with mock.patch.object(benchmark.metrics, "rss_bytes", side_effect=lambda: next(rss)):
+			tracker = RSSTracker()
+			tracker.sample()
+			tracker.sample()
+		# The peak since the start, not the memory the process had before
+		self.assertEqual(tracker.delta_mb(), 200.0)
+
+	def test_compare(self):
+		baseline = make_results(100.0, 10.0)
+		self.assertEqual(compare(make_results(110.0, 9.5), baseline, 0.2), [])
+
+		regressions = compare(make_results(150.0, 6.0), baseline, 0.2)
+		metrics = {metric for _, metric, *_ in regressions}
+		self.assertEqual(metrics, {"p50_ms", "p95_ms", "images_per_sec"})
+
+		# Stages that aren't in the baseline are skipped
+		self.assertEqual(compare(make_results(150.0, 6.0), {"stages": {}}, 0.2), [])
+
+	def test_mock_llm_server(self):
+		with MockLLMServer(delay=0.0) as server:
+			model = SummarizationModel(base_url=server.base_url)
+			summary = model.summarize([], [], "")
+			streamed = "".join(model.summarize_stream([], ["Object 1 is a car."], ""))
+			model.close()
+
+		self.assertIn("No text detected.", summary)
+		self.assertIn("No text detected.", streamed)
+		self.assertEqual(server.requests, 2)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import numpy as np
+from utils.data_mapping import DataMapping, iou_matrix, assign_boxes
+
+class TestDataMapping(unittest.TestCase):
+
+	def setUp(self):
+		self.data_mapping = DataMapping()
+
+		# Two segmented objects, obj_seg_bbox is [x, y, w, h]
+		self.obj_metadata = [
+			{"object_id": "0001_obj_0", "object_img_path": "obj_0.jpg", "obj_seg_bbox": [0, 0, 10, 10], "master_image": "0001.jpg", "master_id": "0001"},
+			{"object_id": "0001_obj_1", "object_img_path": "obj_1.jpg", "obj_seg_bbox": [50, 50, 20, 20], "master_image": "0001.jpg", "master_id": "0001"},
+		]
+
+	def test_iou_matrix(self):
+		iou = iou_matrix([[0, 0, 10, 10], [0, 0, 5, 10]], [[0, 0, 10, 10], [20, 20, 30, 30]])
+		self.assertEqual(iou.shape, (2, 2))
+		self.assertAlmostEqual(iou[0, 0], 1.0)
+		self.assertAlmostEqual(iou[1, 0], 0.5)
+		self.assertAlmostEqual(iou[0, 1], 0.0)
+
+	def test_assign_boxes(self):
+		iou = np.array([[0.2, 0.9], [0.8, 0.05]])
+		self.assertEqual(sorted(assign_boxes(iou, 0.1)), [(0, 1), (1, 0)])
+
+		# pairs below min_iou are dropped
+		self.assertEqual(sorted(assign_boxes(iou, 0.85)), [(0, 1)])
+
+	def test_mapping_out_of_order(self):
+		# Descriptions come in a different order than the segmented objects
+		# and there is one more of them
+		desc = [
+			{"object_class": "dog", "conf": 0.8, "obj_id_bbox": [[51, 49, 70, 71]]},
+			{"object_class": "kite", "conf": 0.4, "obj_id_bbox": [[200, 200, 220, 220]]},
+			{"object_class": "person", "conf": 0.9, "obj_id_bbox": [[0, 1, 10, 10]]},
+		]
+		final_dict = self.data_mapping.mapping(([None, None], self.obj_metadata), (desc, "id.jpg"), "text", "summary")
+
+		entries = final_dict["0001"]["entries"]
+		self.assertEqual(len(entries), 2)
+		self.assertEqual(entries[0]["obj_name"], "person")
+		self.assertEqual(entries[1]["obj_name"], "dog")
+		self.assertEqual([entry["confidence"] for entry in entries], [0.9, 0.8])
+		self.assertEqual(final_dict["0001"]["unmatched_descriptions"], [desc[1]])
+
+	def test_mapping_unmatched_objects(self):
+		desc = [{"object_class": "person", "conf": 0.9, "obj_id_bbox": [[0, 0, 10, 10]]}]
+		final_dict = self.data_mapping.mapping(([None, None], self.obj_metadata), (desc, "id.jpg"), None, None)
+
+		entries = final_dict["0001"]["entries"]
+
+		# the second segmented object is kept even without a description
+		self.assertEqual(len(entries), 2)
+		self.assertIsNone(entries[1]["obj_name"])
+		self.assertEqual(final_dict["0001"]["unmatched_descriptions"], [])
+
+	def test_mapping_no_objects(self):
+		self.assertEqual(self.data_mapping.mapping(([], []), ([], "id.jpg"), None, None), {})
+
+	def test_mapping_no_objects_keeps_image(self):
+		desc = [{"object_class": "person", "conf": 0.9, "obj_id_bbox": [0, 0, 10, 10]}]
+		final_dict = self.data_mapping.mapping(([], []), (desc, "id.jpg"), "STOP", "a summary", "0001")
+
+		# nothing was segmented, but the descriptions, text and summary aren't lost
+		self.assertEqual(final_dict["0001"]["entries"], [])
+		self.assertEqual(final_dict["0001"]["unmatched_descriptions"], desc)
+		self.assertEqual(final_dict["0001"]["text"], "STOP")
+		self.assertEqual(final_dict["0001"]["summary"], "a summary")
+
+	def test_visualize_memory_mode(self):
+		final_dict = {"0001": {"entries": [], "text": None, "summary": None, "id_model_image_path": None,
+							   "unmatched_descriptions": []}}
+
+		# memory mode saves no annotated image, say so instead of failing in cv2
+		with self.assertRaisesRegex(ValueError, "memory"):
+			self.data_mapping.visualize(final_dict, "img.jpg")
+
+if __name__ == '__main__':
+	unittest.main()
@@ -10,7 +10,7 @@ class TestIdentificationModel(unittest.TestCase):
 		self.model = IdentificationModel()
 
 		# sample image
-		self.sample_image_path = "test.jpg"
+		self.sample_image_path = "data/input_images/000000000025.jpg"
     
 
 	def test_generate_descriptions(self):
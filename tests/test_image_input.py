@@ -0,0 +1,54 @@
+import unittest
+import numpy as np
+import cv2
+from utils.image_input import ImageInput, as_image_input
+
+class TestImageInput(unittest.TestCase):
+
+	def setUp(self):
+		self.bgr = np.zeros((60, 80, 3), dtype=np.uint8)
+		self.bgr[:, :, 2] = 255 # red in BGR
+		self.image = ImageInput(self.bgr, name="0001.jpg")
+
+	def test_master_id(self):
+		self.assertEqual(self.image.master_id, "0001")
+
+	def test_views_are_shared(self):
+		# rgb is a view on the decoded buffer, not a copy
+		self.assertTrue(np.shares_memory(self.image.rgb, self.bgr))
+		self.assertEqual(self.image.rgb[0, 0, 0], 255)
+
+		# derived views are computed once
+		self.assertIs(self.image.gray, self.image.gray)
+		self.assertEqual(self.image.gray.shape, (60, 80))
+		self.assertIs(self.image.resized((40, 30)), self.image.resized((40, 30)))
+		self.assertEqual(self.image.resized((40, 30), gray=True).shape, (30, 40))
+		self.assertIs(self.image.reduced(0.5), self.image.reduced(0.5))
+		self.assertEqual(self.image.reduced(0.5).shape, (30, 40, 3))
+
+	def test_read_only(self):
+		with self.assertRaises(ValueError):
+			self.image.bgr[0, 0, 0] = 1
+
+		# the caller's own array is left writable
+		self.bgr[0, 0, 0] = 1
+
+	def test_from_bytes(self):
+		ok, encoded = cv2.imencode(".png", self.bgr)
+		image = ImageInput.from_bytes(encoded.tobytes(), name="0002.png")
+		self.assertEqual(image.shape, (60, 80, 3))
+		self.assertEqual(image.master_id, "0002")
+
+		# same bytes, same hash
+		self.assertEqual(image.content_hash, ImageInput.from_bytes(encoded.tobytes()).content_hash)
+
+	def test_as_image_input(self):
+		self.assertIs(as_image_input(self.image), self.image)
+		self.assertIsInstance(as_image_input(self.bgr), ImageInput)
+		with self.assertRaises(ValueError):
+			as_image_input(None)
+		with self.assertRaises(ValueError):
+			as_image_input("does_not_exist.jpg")
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+from utils.image_writer import ImageWriter
+
+class TestImageWriter(unittest.TestCase):
+
+	def setUp(self):
+		self.temp_dir = tempfile.TemporaryDirectory()
+		self.image = np.full((20, 30, 3), 127, dtype=np.uint8)
+
+	def tearDown(self):
+		self.temp_dir.cleanup()
+
+	def test_sync_write(self):
+		writer = ImageWriter(self.temp_dir.name, "sync")
+		path = writer.write("object", self.image)
+		self.assertTrue(path.endswith("object.jpg"))
+		self.assertTrue(os.path.exists(path))
+
+	def test_async_write(self):
+		writer = ImageWriter(self.temp_dir.name, "async", image_format="png")
+		paths = [writer.write(f"object_{idx}", self.image) for idx in range(5)]
+
+		# After flush every queued image has to be on disk
+		writer.close()
+		for path in paths:
+			self.assertTrue(os.path.exists(path))
+
+	def test_async_pending_is_bounded(self):
+		writer = ImageWriter(self.temp_dir.name, "async", max_pending=2)
+		paths = [writer.write(f"object_{idx}", self.image) for idx in range(6)]
+		self.assertLessEqual(len(writer.pending), 2)
+		writer.close()
+		self.assertTrue(all(os.path.exists(path) for path in paths))
+
+	def test_memory_mode(self):
+		writer = ImageWriter(self.temp_dir.name, "memory", image_format="webp", quality=80)
+		self.assertIsNone(writer.write("object", self.image))
+		self.assertEqual(os.listdir(self.temp_dir.name), [])
+
+		# Images are only encoded when asked for
+		encoded = writer.encode(self.image)
+		self.assertIsInstance(encoded, bytes)
+		self.assertGreater(len(encoded), 0)
+
+	def test_invalid_mode(self):
+		with self.assertRaises(ValueError):
+			ImageWriter(self.temp_dir.name, "invalid")
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+
+import numpy as np
+
+from models import inference_config
+from models.inference_config import InferenceConfig
+from utils.image_input import ImageInput
+
+
+class SquareDetector:
+	"""
+	Stands in for an ultralytics model: finds the bright pixels of every image
+	it gets and returns one box (and mask) around them.
+	"""
+	names = {0: "square", 1: "other"}
+
+	def __init__(self):
+		self.calls = []
+
+	def predict(self, images, conf=0.25, imgsz=640, max_det=300, classes=None, retina_masks=False):
+		self.calls.append({"sizes": [image.shape[:2] for image in images], "imgsz": imgsz, "classes": classes})
+		results = []
+		for image in images:
+			mask = image[..., 0] > 127
+			boxes, masks = np.zeros((0, 6), dtype=np.float32), None
+			if mask.any():
+				ys, xs = np.nonzero(mask)
+				boxes = np.array([[xs.min(), ys.min(), xs.max() + 1, ys.max() + 1, 0.9, 0]], dtype=np.float32)
+				masks = mask[None]
+			template = type("Template", (), {"path": "image0.jpg", "names": self.names})
+			results.append(inference_config.make_result(template, image, boxes, masks,
+														{"preprocess": 1.0, "inference": 2.0, "postprocess": 1.0}))
+		return results
+
+
+class TestInferenceConfig(unittest.TestCase):
+
+	def setUp(self):
+		bgr = np.zeros((1200, 1600, 3), dtype=np.uint8)
+		# A square right across the border of the first two tiles
+		bgr[100:300, 400:700] = 255
+		self.image = ImageInput(bgr, name="square.jpg")
+		self.model = SquareDetector()
+
+	def test_from_string(self):
+		config = InferenceConfig.from_string("mode=tiled, imgsz=1280,conf=0.25,classes=person;2,tile_overlap=0.3")
+		self.assertEqual(config.mode, "tiled")
+		self.assertEqual(config.imgsz, 1280)
+		self.assertEqual(config.conf, 0.25)
+		self.assertEqual(config.classes, ["person", 2])
+		self.assertEqual(config.tile_overlap, 0.3)
+
+		self.assertEqual(InferenceConfig.from_string("").cache_params(), {"conf": 0.30})
+		with self.assertRaises(ValueError):
+			InferenceConfig.from_string("size=640")
+		with self.assertRaises(ValueError):
+			InferenceConfig.from_string("mode=turbo")
+
+	def test_cache_params(self):
+		# Settings of the other modes don't split the cache
+		self.assertEqual(InferenceConfig(scale=0.25).cache_params(), {"conf": 0.30})
+		self.assertEqual(InferenceConfig(mode="fast", scale=0.25).cache_params(),
+						 {"conf": 0.30, "mode": "fast", "scale": 0.25})
+		self.assertEqual(InferenceConfig(mode="tiled", tile_size=320).cache_params(),
+						 {"conf": 0.30, "mode": "tiled", "tile_size": 320})
+
+	def test_class_ids(self):
+		self.assertIsNone(InferenceConfig().class_ids(SquareDetector.names))
+		self.assertEqual(InferenceConfig(classes=["other", 0]).class_ids(SquareDetector.names), [1, 0])
+		with self.assertRaises(ValueError):
+			InferenceConfig(classes=["person"]).class_ids(SquareDetector.names)
+
+	def test_full(self):
+		result = inference_config.predict(self.model, [self.image], InferenceConfig(imgsz=320, classes=["other"]))[0]
+		np.testing.assert_array_equal(result.boxes.xyxy.numpy(), [[400, 100, 700, 300]])
+		self.assertEqual(self.model.calls[0]["imgsz"], 320)
+		self.assertEqual(self.model.calls[0]["classes"], [1])
+
+	def test_fast(self):
+		result = inference_config.predict(self.model, [self.image], InferenceConfig(mode="fast", scale=0.5))[0]
+
+		# The model saw half the image at half the input size, the box and mask
+		# come back in the coordinates of the full image
+		self.assertEqual(self.model.calls[0]["sizes"], [(600, 800)])
+		self.assertEqual(self.model.calls[0]["imgsz"], 320)
+		np.testing.assert_allclose(result.boxes.xyxy.numpy(), [[400, 100, 700, 300]], atol=2)
+		self.assertEqual(result.masks.data.shape, (1, 1200, 1600))
+		self.assertEqual(result.orig_img.shape, (1200, 1600, 3))
+
+	def test_tiled(self):
+		config = InferenceConfig(mode="tiled", tile_size=512, tile_overlap=0.25)
+		result = inference_config.predict(self.model, [self.image], config, retina_masks=True)[0]
+
+		# Found in two tiles and the full image pass, merged back into one
+		# detection with the whole box and the whole mask
+		n_tiles = len(self.model.calls[0]["sizes"]) - 1
+		self.assertGreater(n_tiles, 1)
+		np.testing.assert_array_equal(result.boxes.xyxy.numpy(), [[400, 100, 700, 300]])
+		mask = result.masks.data.numpy()[0] > 0.5
+		self.assertEqual(mask.sum(), 200 * 300)
+		self.assertEqual(result.speed["inference"], 2.0 * (n_tiles + 1))
+
+	def test_tiled_small_image(self):
+		image = ImageInput(np.zeros((200, 300, 3), dtype=np.uint8), name="small.jpg")
+		results = inference_config.predict(self.model, [image], InferenceConfig(mode="tiled"))
+		self.assertEqual(len(results[0].boxes), 0)
+		self.assertEqual(self.model.calls[0]["sizes"], [(200, 300)])
+
+
+if __name__ == "__main__":
+	unittest.main()
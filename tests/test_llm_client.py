@@ -0,0 +1,218 @@
+import json
+import asyncio
+import tempfile
+import unittest
+
+import httpx
+
+from utils.llm_client import LLMClient, LLMError, normalize_prompt
+from utils.result_cache import ResultCache
+
+
+class FakeLLMClient(LLMClient):
+	# Answers every prompt with its length and records what was sent
+
+	def __init__(self, failures=0, delay=0.0, **kwargs):
+		super().__init__(backoff=0.0, **kwargs)
+		self.failures = failures
+		self.delay = delay
+		self.sent = []
+		self.in_flight = 0
+		self.max_in_flight = 0
+
+	def open_session(self):
+		return None
+
+	async def request_stream(self, session, prompt):
+		response = await self.request(session, prompt)
+		for word in response.split(" "):
+			yield word + " "
+
+	async def request(self, session, prompt):
+		self.in_flight += 1
+		self.max_in_flight = max(self.max_in_flight, self.in_flight)
+		try:
+			await asyncio.sleep(self.delay)
+			self.sent.append(prompt)
+			if self.failures:
+				self.failures -= 1
+				raise ConnectionError("server went away")
+			return f"summary of {len(normalize_prompt(prompt))} chars"
+		finally:
+			self.in_flight -= 1
+
+
+class TestLLMClient(unittest.TestCase):
+
+	def test_normalize_prompt(self):
+		self.assertEqual(normalize_prompt("  a\n\t b   c "), "a b c")
+
+	def test_cache_on_normalized_prompt(self):
+		client = FakeLLMClient()
+		first = client.complete_sync("describe   the\nobjects")
+		second = client.complete_sync("describe the objects")
+		self.assertEqual(first, second)
+		self.assertEqual(len(client.sent), 1)
+		client.close()
+
+	def test_persistent_cache(self):
+		with tempfile.TemporaryDirectory() as cache_dir:
+			client = FakeLLMClient(cache=ResultCache(cache_dir))
+			client.complete_sync("prompt")
+			client.close()
+
+			# A new client (a new run) gets the response from disk
+			client = FakeLLMClient(cache=ResultCache(cache_dir))
+			client.complete_sync("prompt")
+			self.assertEqual(client.sent, [])
+			client.close()
+
+	def test_retry(self):
+		client = FakeLLMClient(failures=2, retries=3)
+		self.assertTrue(client.complete_sync("prompt").startswith("summary"))
+		self.assertEqual(len(client.sent), 3)
+		client.close()
+
+	def test_gives_up(self):
+		client = FakeLLMClient(failures=5, retries=2)
+		with self.assertRaises(LLMError):
+			client.complete_sync("prompt")
+		self.assertEqual(len(client.sent), 3)
+		client.close()
+
+	def test_complete_many(self):
+		client = FakeLLMClient(delay=0.02, max_concurrency=3)
+		prompts = [f"prompt {'x' * i}" for i in range(1, 11)] + ["prompt  x"]
+		responses = client.complete_many_sync(prompts)
+
+		self.assertEqual(responses, [f"summary of {len(normalize_prompt(p))} chars" for p in prompts])
+		# "prompt x" shows up twice but is only sent once
+		self.assertEqual(len(client.sent), 10)
+		self.assertEqual(client.max_in_flight, 3)
+		client.close()
+
+	def test_openai_compatible_server(self):
+		requests = []
+
+		def handler(request):
+			requests.append(request)
+			return httpx.Response(200, json={"choices": [{"message": {"content": "local summary"}}]})
+
+		class MockServerClient(LLMClient):
+			def open_session(self):
+				return httpx.AsyncClient(base_url=self.base_url, transport=httpx.MockTransport(handler))
+
+		client = MockServerClient(base_url="http://localhost:8000/v1/", api_key="key")
+		self.assertEqual(client.complete_sync("prompt"), "local summary")
+		self.assertEqual(str(requests[0].url), "http://localhost:8000/v1/chat/completions")
+		client.close()
+
+	def test_stream(self):
+		client = FakeLLMClient()
+		pieces = list(client.stream_sync("prompt"))
+		self.assertEqual(pieces, ["summary ", "of ", "6 ", "chars "])
+
+		# Once the stream is done the whole response is cached
+		self.assertEqual(list(client.stream_sync("prompt")), ["summary of 6 chars "])
+		self.assertEqual(client.complete_sync("prompt"), "summary of 6 chars ")
+		self.assertEqual(len(client.sent), 1)
+		client.close()
+
+	def test_stream_retry(self):
+		client = FakeLLMClient(failures=1)
+		self.assertEqual("".join(client.stream_sync("prompt")), "summary of 6 chars ")
+		self.assertEqual(len(client.sent), 2)
+		client.close()
+
+	def test_stream_async(self):
+		async def collect(client):
+			return [piece async for piece in client.stream("prompt")]
+
+		client = FakeLLMClient()
+		self.assertEqual(asyncio.run(collect(client)), ["summary ", "of ", "6 ", "chars "])
+
+	def test_openai_compatible_stream(self):
+		def handler(request):
+			events = [{"choices": [{"delta": {"role": "assistant"}}]}]
+			events += [{"choices": [{"delta": {"content": piece}}]} for piece in ("local ", "summary")]
+			body = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+			return httpx.Response(200, text=body, headers={"content-type": "text/event-stream"})
+
+		class MockServerClient(LLMClient):
+			def open_session(self):
+				return httpx.AsyncClient(base_url=self.base_url, transport=httpx.MockTransport(handler))
+
+		client = MockServerClient(base_url="http://localhost:8000/v1")
+		self.assertEqual(list(client.stream_sync("prompt")), ["local ", "summary"])
+		client.close()
+
+	def test_retries_only_transient_errors(self):
+		statuses = []
+
+		def handler(request):
+			status = statuses.pop(0)
+			body = {"choices": [{"message": {"content": "local summary"}}]} if status == 200 else {"error": "no"}
+			return httpx.Response(status, json=body)
+
+		class MockServerClient(LLMClient):
+			def open_session(self):
+				return httpx.AsyncClient(base_url=self.base_url, transport=httpx.MockTransport(handler))
+
+		# 503 and 429 go away on their own, so they're retried
+		statuses.extend([503, 429, 200])
+		client = MockServerClient(base_url="http://localhost:8000/v1", backoff=0.0)
+		self.assertEqual(client.complete_sync("prompt"), "local summary")
+		client.close()
+
+		# a 400 won't, the request is sent once
+		statuses.extend([400, 200])
+		client = MockServerClient(base_url="http://localhost:8000/v1", backoff=0.0)
+		with self.assertRaises(LLMError):
+			client.complete_sync("another prompt")
+		self.assertEqual(statuses, [200])
+		client.close()
+
+	def test_session_closed_on_new_loop(self):
+		class Session:
+			closed = False
+
+			async def aclose(self):
+				self.closed = True
+
+		class SessionClient(FakeLLMClient):
+			def open_session(self):
+				return Session()
+
+		client = SessionClient()
+		asyncio.run(client.complete("prompt"))
+		first = client.session
+		asyncio.run(client.complete("another prompt"))
+		self.assertTrue(first.closed)
+		self.assertFalse(client.session.closed)
+
+	def test_stream_timeout_closes_stream(self):
+		class SlowStreamClient(FakeLLMClient):
+			closed = 0
+
+			async def request_stream(self, session, prompt):
+				try:
+					# only the first attempt is too slow
+					await asyncio.sleep(1.0 if not self.closed else 0.0)
+					yield "late"
+				finally:
+					self.closed += 1
+
+		client = SlowStreamClient(timeout=0.05, retries=1)
+		self.assertEqual(list(client.stream_sync("prompt")), ["late"])
+		self.assertEqual(client.closed, 2)
+		client.close()
+
+	def test_cache_key(self):
+		keys = {LLMClient(base_url=url, model_name=model).cache_key("prompt")
+				for url in ("http://a/v1", "http://b/v1") for model in ("small", "large")}
+		# every server and model has its own responses
+		self.assertEqual(len(keys), 4)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from unittest import mock
+
+from utils import memory_guard
+from utils.memory_guard import MemoryGuard, MemoryLimitExceeded
+
+MB = 1024 * 1024
+
+
+class TestMemoryGuard(unittest.TestCase):
+
+	def test_no_ceiling(self):
+		guard = MemoryGuard(None)
+		with mock.patch.object(memory_guard.metrics, "rss_bytes", return_value=10 ** 12):
+			self.assertEqual(guard.check(8), 8)
+
+	def test_under_the_ceiling(self):
+		with mock.patch.object(memory_guard.metrics, "rss_bytes", return_value=100 * MB):
+			guard = MemoryGuard(200)
+			self.assertEqual(guard.check(8), 8)
+		self.assertEqual(guard.peak_bytes, 100 * MB)
+
+	def test_release_before_shrinking(self):
+		released = []
+		# Over the ceiling until the release callback ran
+		usage = iter([100 * MB, 300 * MB, 150 * MB])
+		with mock.patch.object(memory_guard.metrics, "rss_bytes", side_effect=lambda: next(usage)):
+			guard = MemoryGuard(200, release=[lambda: released.append(True)])
+			self.assertEqual(guard.check(8), 8)
+		self.assertEqual(released, [True])
+
+	def test_batches_shrink_then_stop(self):
+		with mock.patch.object(memory_guard.metrics, "rss_bytes", return_value=300 * MB):
+			guard = MemoryGuard(200)
+			self.assertEqual(guard.check(8), 4)
+			self.assertEqual(guard.check(3), 1)
+			with self.assertRaises(MemoryLimitExceeded):
+				guard.check(1)
+		self.assertEqual(guard.peak_bytes, 300 * MB)
+
+	def test_batches_grow_back(self):
+		usage = iter([100 * MB, 300 * MB, 300 * MB, 190 * MB, 100 * MB, 100 * MB, 100 * MB])
+		with mock.patch.object(memory_guard.metrics, "rss_bytes", side_effect=lambda: next(usage)):
+			guard = MemoryGuard(200, batch_size=8)
+			self.assertEqual(guard.check(8), 4)
+			# under the ceiling but too close to it
+			self.assertEqual(guard.check(4), 4)
+			self.assertEqual(guard.check(4), 8)
+			# never past the batch size the run started with
+			self.assertEqual(guard.check(8), 8)
+
+	def test_unknown_memory_is_not_enforced(self):
+		with mock.patch.object(memory_guard.metrics, "rss_bytes", return_value=None):
+			guard = MemoryGuard(200)
+			self.assertEqual(guard.check(8), 8)
+
+
+if __name__ == "__main__":
+	unittest.main()
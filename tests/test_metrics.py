@@ -0,0 +1,105 @@
+import os
+import json
+import tempfile
+import unittest
+import unittest.mock
+
+from utils import metrics
+from utils.data_mapping import DataMapping
+
+
+class TestMetrics(unittest.TestCase):
+
+	def setUp(self):
+		self.sink = metrics.add_sink(metrics.MemorySink())
+
+	def tearDown(self):
+		metrics.close()
+
+	def test_stage(self):
+		with metrics.stage("inference", model="segmentation") as span:
+			span.count(images=2, objects=5)
+
+		event, = self.sink.events
+		self.assertEqual(event["stage"], "inference")
+		self.assertEqual(event["labels"], {"model": "segmentation"})
+		self.assertEqual(event["counts"], {"images": 2, "objects": 5})
+		self.assertGreaterEqual(event["duration_ms"], 0)
+		self.assertIsNone(event["error"])
+
+	def test_error(self):
+		with self.assertRaises(KeyError):
+			with metrics.stage("mapping"):
+				raise KeyError("obj_seg_bbox")
+		self.assertEqual(self.sink.events[0]["error"], "KeyError")
+
+	def test_inactive(self):
+		metrics.close()
+		with metrics.stage("decode") as span:
+			span.count(images=1)
+		self.assertIs(span, metrics.NULL_SPAN)
+		self.assertEqual(self.sink.events, [])
+
+	def test_instrumented_mapping(self):
+		obj_metadata = [{"object_id": "img_obj_0", "object_img_path": None, "obj_seg_bbox": [0, 0, 10, 10],
+						 "master_image": "img.jpg", "master_id": "img"}]
+		desc = [{"object_class": "person", "conf": 0.9, "obj_id_bbox": [[0, 0, 10, 10]]}]
+		DataMapping().mapping(([None], obj_metadata), (desc, None), "STOP", None)
+		self.assertEqual([(e["stage"], e["counts"]) for e in self.sink.events], [("mapping", {"objects": 1})])
+
+	def test_record_speed(self):
+		class Result:
+			speed = {"preprocess": 2.0, "inference": 10.0, "postprocess": 1.0}
+
+		metrics.record_speed([Result(), Result()], model="identification")
+		durations = {e["stage"]: e["duration_ms"] for e in self.sink.events}
+		self.assertEqual(durations, {"yolo_preprocess": 4.0, "yolo_inference": 20.0, "yolo_postprocess": 2.0})
+
+	def test_sinks(self):
+		with tempfile.TemporaryDirectory() as temp_dir:
+			jsonl_path = os.path.join(temp_dir, "metrics.jsonl")
+			prom_path = os.path.join(temp_dir, "metrics.prom")
+			metrics.configure(jsonl=jsonl_path, prometheus=prom_path)
+
+			for _ in range(3):
+				with metrics.stage("ocr", model="text_extraction") as span:
+					span.count(regions=4)
+			metrics.close()
+
+			with open(jsonl_path) as f:
+				events = [json.loads(line) for line in f]
+			self.assertEqual(len(events), 3)
+
+			with open(prom_path) as f:
+				prom = f.read()
+			self.assertIn('pipeline_stage_duration_seconds_count{model="text_extraction",stage="ocr"} 3', prom)
+			self.assertIn('pipeline_stage_items_total{item="regions",model="text_extraction",stage="ocr"} 12', prom)
+
+	def test_configure_from_env(self):
+		metrics.close()
+		with tempfile.TemporaryDirectory() as temp_dir:
+			env_path = os.path.join(temp_dir, "env.jsonl")
+			cli_path = os.path.join(temp_dir, "cli.jsonl")
+			with unittest.mock.patch.dict(os.environ, {"PIPELINE_METRICS_JSONL": env_path}):
+				# The argument wins over the environment, and there's only one sink
+				metrics.configure_from_env(jsonl=cli_path)
+				self.assertEqual([sink.path for sink in metrics._sinks], [cli_path])
+				metrics.close()
+
+				metrics.configure_from_env(jsonl=None)
+				self.assertEqual([sink.path for sink in metrics._sinks], [env_path])
+
+	def test_profile_hook(self):
+		with tempfile.TemporaryDirectory() as temp_dir:
+			metrics.set_profile_hook(metrics.CProfileHook(temp_dir, ["inference"]))
+			with metrics.stage("inference"):
+				# Nested stages are not profiled again
+				with metrics.stage("inference"):
+					sum(range(1000))
+			with metrics.stage("mapping"):
+				pass
+			self.assertEqual(os.listdir(temp_dir), ["inference-00000.prof"])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,137 @@
+import threading
+import time
+import unittest
+
+from utils.micro_batcher import MicroBatcher, QueueFull
+
+
+class MicroBatcherTest(unittest.TestCase):
+	def setUp(self):
+		self.calls = []
+		self.batcher = None
+
+	def tearDown(self):
+		if self.batcher is not None:
+			self.batcher.stop(timeout=5)
+
+	def double(self, items):
+		self.calls.append(list(items))
+		return [item * 2 for item in items]
+
+	def test_concurrent_submits_share_one_call(self):
+		self.batcher = MicroBatcher(self.double, max_batch_size=8, max_wait_ms=200).start()
+		futures = [self.batcher.submit(idx) for idx in range(5)]
+
+		self.assertEqual([future.result(timeout=5) for future in futures], [0, 2, 4, 6, 8])
+		self.assertEqual(self.calls, [[0, 1, 2, 3, 4]])
+		self.assertEqual((self.batcher.batches, self.batcher.items), (1, 5))
+
+	def test_batches_are_capped(self):
+		self.batcher = MicroBatcher(self.double, max_batch_size=2, max_wait_ms=200).start()
+		futures = [self.batcher.submit(idx) for idx in range(5)]
+
+		self.assertEqual([future.result(timeout=5) for future in futures], [0, 2, 4, 6, 8])
+		self.assertTrue(all(len(batch) <= 2 for batch in self.calls))
+		self.assertEqual(sum(self.calls, []), [0, 1, 2, 3, 4])
+
+	def test_lone_item_waits_at_most_max_wait(self):
+		self.batcher = MicroBatcher(self.double, max_batch_size=8, max_wait_ms=20).start()
+		start = time.perf_counter()
+		self.assertEqual(self.batcher.submit(3).result(timeout=5), 6)
+		self.assertLess(time.perf_counter() - start, 1.0)
+
+	def test_full_queue_is_rejected(self):
+		release = threading.Event()
+
+		def blocked(items):
+			release.wait(5)
+			return items
+
+		self.batcher = MicroBatcher(blocked, max_batch_size=1, max_wait_ms=0, max_queue=1).start()
+		first = self.batcher.submit("a")
+		# Wait for the worker to take the first item out of the queue
+		deadline = time.perf_counter() + 5
+		while len(self.batcher) and time.perf_counter() < deadline:
+			time.sleep(0.01)
+		second = self.batcher.submit("b")
+
+		with self.assertRaises(QueueFull):
+			self.batcher.submit("c")
+		self.assertEqual(self.batcher.rejected, 1)
+
+		release.set()
+		self.assertEqual((first.result(timeout=5), second.result(timeout=5)), ("a", "b"))
+
+	def test_errors_reach_every_caller(self):
+		def broken(items):
+			raise ValueError("model failed")
+
+		self.batcher = MicroBatcher(broken, max_batch_size=4, max_wait_ms=100).start()
+		futures = [self.batcher.submit(idx) for idx in range(3)]
+		for future in futures:
+			with self.assertRaises(ValueError):
+				future.result(timeout=5)
+
+		# The worker keeps going after a failed batch
+		self.batcher.fn = self.double
+		self.assertEqual(self.batcher.submit(1).result(timeout=5), 2)
+
+	def test_wrong_output_count_is_an_error(self):
+		self.batcher = MicroBatcher(lambda items: items[:1], max_batch_size=4, max_wait_ms=100).start()
+		futures = [self.batcher.submit(idx) for idx in range(2)]
+		with self.assertRaises(RuntimeError):
+			futures[1].result(timeout=5)
+
+	def test_cancelled_items_are_skipped(self):
+		release = threading.Event()
+
+		def blocked(items):
+			release.wait(5)
+			return self.double(items)
+
+		self.batcher = MicroBatcher(blocked, max_batch_size=1, max_wait_ms=0).start()
+		first = self.batcher.submit(1)
+		deadline = time.perf_counter() + 5
+		while len(self.batcher) and time.perf_counter() < deadline:
+			time.sleep(0.01)
+
+		# Still queued, so it can be cancelled and never reaches fn
+		second = self.batcher.submit(2)
+		self.assertTrue(second.cancel())
+		third = self.batcher.submit(3)
+		release.set()
+		self.assertEqual((first.result(timeout=5), third.result(timeout=5)), (2, 6))
+		self.assertEqual(self.calls, [[1], [3]])
+
+	def test_stop_finishes_queued_items(self):
+		self.batcher = MicroBatcher(self.double, max_batch_size=2, max_wait_ms=0).start()
+		futures = [self.batcher.submit(idx) for idx in range(4)]
+		self.batcher.stop(timeout=5)
+		self.assertEqual([future.result(timeout=0) for future in futures], [0, 2, 4, 6])
+
+	def test_stop_with_a_full_queue(self):
+		release = threading.Event()
+
+		def blocked(items):
+			release.wait(5)
+			return self.double(items)
+
+		self.batcher = MicroBatcher(blocked, max_batch_size=1, max_wait_ms=0, max_queue=2).start()
+		futures = [self.batcher.submit(0)]
+		deadline = time.perf_counter() + 5
+		while len(self.batcher) and time.perf_counter() < deadline:
+			time.sleep(0.01)
+		futures += [self.batcher.submit(idx) for idx in (1, 2)]
+
+		# The queue is full, stop() must not block on it (only join for its timeout)
+		start = time.perf_counter()
+		self.batcher.stop(timeout=0.2)
+		self.assertLess(time.perf_counter() - start, 2)
+
+		# and the worker still finishes what was queued
+		release.set()
+		self.assertEqual([future.result(timeout=5) for future in futures], [0, 2, 4])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+import unittest.mock
+from unittest.mock import MagicMock
+from models import model_registry
+
+class TestModelRegistry(unittest.TestCase):
+
+	def setUp(self):
+		model_registry.clear()
+		self.loader = MagicMock(side_effect=lambda: object())
+		model_registry.register("dummy", self.loader)
+
+	def test_lazy_loading(self):
+		# Registering must not load anything
+		self.loader.assert_not_called()
+		self.assertFalse(model_registry.is_loaded("dummy"))
+
+		model_registry.get("dummy")
+		self.loader.assert_called_once()
+		self.assertTrue(model_registry.is_loaded("dummy"))
+
+	def test_shared_instance(self):
+		first = model_registry.get("dummy")
+		second = model_registry.get("dummy")
+
+		# Same object and the loader only ran once
+		self.assertIs(first, second)
+		self.loader.assert_called_once()
+
+	def test_warmup(self):
+		model_registry.warmup(["dummy"])
+		self.loader.assert_called_once()
+
+	def test_warmup_defaults(self):
+		# A bare warmup loads the default models only, not the ones registered with default=False
+		variant = MagicMock(side_effect=lambda: object())
+		with unittest.mock.patch.object(model_registry, "_loaders", {}), \
+				unittest.mock.patch.object(model_registry, "_defaults", []):
+			model_registry.register("dummy", self.loader)
+			model_registry.register("dummy_variant", variant, default=False)
+			model_registry.warmup()
+		self.loader.assert_called_once()
+		variant.assert_not_called()
+
+	def test_clear(self):
+		first = model_registry.get("dummy")
+		model_registry.clear()
+		second = model_registry.get("dummy")
+		self.assertIsNot(first, second)
+
+	def test_unknown_model(self):
+		with self.assertRaises(KeyError):
+			model_registry.get("does_not_exist")
+
+	def test_lock_per_model(self):
+		# One lock per model name, the same one for every caller
+		self.assertIs(model_registry.lock("dummy"), model_registry.lock("dummy"))
+		self.assertIsNot(model_registry.lock("dummy"), model_registry.lock("other"))
+
+if __name__ == '__main__':
+	unittest.main()
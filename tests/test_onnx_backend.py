@@ -0,0 +1,97 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from models import onnx_backend
+
+try:
+	import onnxruntime
+except ImportError:
+	onnxruntime = None
+
+
+class TestOnnxBackend(unittest.TestCase):
+
+	def test_registry_name(self):
+		self.assertEqual(onnx_backend.registry_name("segmentation"), "segmentation")
+		self.assertEqual(onnx_backend.registry_name("segmentation", "onnx"), "segmentation-onnx")
+		self.assertEqual(onnx_backend.registry_name("identification", "onnx", "static"), "identification-onnx-static")
+
+		with self.assertRaises(ValueError):
+			onnx_backend.registry_name("segmentation", "tensorrt")
+		with self.assertRaises(ValueError):
+			onnx_backend.registry_name("segmentation", "onnx", "int4")
+		with self.assertRaises(ValueError):
+			onnx_backend.registry_name("segmentation", "torch", "dynamic")
+
+	def test_match_detections(self):
+		ref_boxes = [[0, 0, 10, 10], [20, 20, 30, 30], [50, 50, 60, 60]]
+		boxes = [[21, 21, 31, 31], [0, 0, 10, 11], [50, 50, 60, 60]]
+
+		# The third pair overlaps perfectly but the classes differ
+		matches = onnx_backend.match_detections(ref_boxes, [0, 1, 2], boxes, [1, 0, 3])
+		self.assertEqual(sorted((ref_idx, idx) for ref_idx, idx, _ in matches), [(0, 1), (1, 0)])
+		self.assertTrue(all(0.5 <= iou <= 1.0 for _, _, iou in matches))
+
+		self.assertEqual(onnx_backend.match_detections([], [], boxes, [1, 0, 3]), [])
+
+	def test_summarize_parity(self):
+		comparisons = [
+			{"reference": 4, "detections": 3, "matched": 3, "box_ious": [1.0, 0.9, 0.8],
+			 "conf_diffs": [0.0, 0.01, 0.02], "mask_ious": []},
+			{"reference": 0, "detections": 1, "matched": 0, "box_ious": [], "conf_diffs": [], "mask_ious": []},
+		]
+		report = onnx_backend.summarize_parity(comparisons)
+		self.assertEqual(report["images"], 2)
+		self.assertEqual(report["recall"], 0.75)
+		self.assertEqual(report["precision"], 0.75)
+		self.assertEqual(report["mean_box_iou"], 0.9)
+		self.assertEqual(report["max_conf_diff"], 0.02)
+		self.assertIsNone(report["mean_mask_iou"])
+
+	def test_letterbox(self):
+		tensor = onnx_backend.letterbox(np.full((100, 200, 3), 255, dtype=np.uint8), 64)
+		self.assertEqual(tensor.shape, (1, 3, 64, 64))
+		self.assertEqual(tensor.dtype, np.float32)
+		self.assertEqual(tensor.max(), 1.0)
+
+	@unittest.skipIf(onnxruntime is None, "onnxruntime is not installed")
+	def test_export_quantize_and_parity(self):
+		from ultralytics import YOLO
+
+		with tempfile.TemporaryDirectory() as temp_dir:
+			# Random weights are enough to check that both backends agree
+			pt_path = os.path.join(temp_dir, "yolov8n.pt")
+			YOLO("yolov8n.yaml").save(pt_path)
+
+			with mock.patch.object(onnx_backend, "onnx_dir", os.path.join(temp_dir, "onnx")), \
+				 mock.patch.object(onnx_backend, "calibration_size", 2):
+				onnx_path = onnx_backend.export_onnx(pt_path)
+				self.assertTrue(os.path.exists(onnx_path))
+				self.assertFalse(os.path.exists(os.path.join(temp_dir, "yolov8n.onnx")))
+
+				# The second call uses the cached export
+				mtime = os.path.getmtime(onnx_path)
+				self.assertEqual(onnx_backend.export_onnx(pt_path), onnx_path)
+				self.assertEqual(os.path.getmtime(onnx_path), mtime)
+
+				quantized_path = onnx_backend.quantize_onnx(onnx_path, "static")
+				self.assertLess(os.path.getsize(quantized_path), os.path.getsize(onnx_path))
+
+			img = np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8)
+			kwargs = {"conf": 0.0001, "max_det": 20, "verbose": False}
+			ref = YOLO(pt_path).predict([img], **kwargs)[0]
+			result = YOLO(onnx_path, task="detect").predict([img], **kwargs)[0]
+			quantized = YOLO(quantized_path, task="detect").predict([img], **kwargs)[0]
+
+		report = onnx_backend.summarize_parity([onnx_backend.compare_results(ref, result)])
+		self.assertGreater(report["reference_detections"], 0)
+		self.assertGreaterEqual(report["recall"], 0.95)
+		self.assertEqual(quantized.names, ref.names)
+
+
+if __name__ == "__main__":
+	unittest.main()
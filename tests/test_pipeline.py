@@ -0,0 +1,82 @@
+import unittest
+import time
+from unittest import mock
+
+from utils import pipeline as pipeline_module
+from utils.pipeline import Pipeline
+
+def slow_double(x):
+	time.sleep(0.2)
+	return x * 2
+
+def add(a, b):
+	return a + b
+
+def fail(x):
+	raise RuntimeError("stage failed")
+
+class TestPipeline(unittest.TestCase):
+
+	def test_run_graph(self):
+		finished = []
+		with Pipeline("thread", max_workers=3) as pipeline:
+			pipeline.add_stage("a", slow_double, ["x"])
+			pipeline.add_stage("b", slow_double, ["x"])
+			pipeline.add_stage("sum", add, ["a", "b"])
+			outputs = pipeline.run({"x": 3}, on_stage_done=lambda name, output: finished.append(name))
+
+		self.assertEqual(outputs["sum"], 12)
+
+		# sum can only finish after both of its dependencies
+		self.assertEqual(finished[-1], "sum")
+
+	def test_independent_stages_run_concurrently(self):
+		with Pipeline("thread", max_workers=3) as pipeline:
+			for name in ("a", "b", "c"):
+				pipeline.add_stage(name, slow_double, ["x"])
+
+			start = time.perf_counter()
+			pipeline.run({"x": 1})
+			elapsed = time.perf_counter() - start
+
+		# Three 0.2s stages side by side, not one after another
+		self.assertLess(elapsed, 0.5)
+
+	def test_stage_error(self):
+		with Pipeline("thread") as pipeline:
+			pipeline.add_stage("a", fail, ["x"])
+			pipeline.add_stage("b", slow_double, ["a"])
+			with self.assertRaises(RuntimeError):
+				pipeline.run({"x": 1})
+
+	def test_unknown_dependency(self):
+		with Pipeline("thread") as pipeline:
+			pipeline.add_stage("a", slow_double, ["missing"])
+			with self.assertRaises(ValueError):
+				pipeline.run({"x": 1})
+
+	def test_cycle(self):
+		with Pipeline("thread") as pipeline:
+			pipeline.add_stage("a", slow_double, ["b"])
+			pipeline.add_stage("b", slow_double, ["a"])
+			with self.assertRaises(ValueError):
+				pipeline.run({"x": 1})
+
+	def test_summarizer_is_shared(self):
+		with mock.patch.object(pipeline_module, "SummarizationModel") as model_class, \
+				mock.patch.object(pipeline_module, "summ_model", None):
+			model_class.return_value.summarize.side_effect = lambda obj_metadata, desc, text: text
+			seg_data, id_data = ([], []), ([], None)
+			self.assertEqual(pipeline_module.summarize(seg_data, id_data, "a"), "a")
+			self.assertEqual(pipeline_module.summarize(seg_data, id_data, "b"), "b")
+		# every image goes through the same client
+		model_class.assert_called_once()
+
+	def test_process_executor(self):
+		with Pipeline("process", max_workers=2) as pipeline:
+			pipeline.add_stage("a", slow_double, ["x"])
+			pipeline.add_stage("sum", add, ["a", "x"])
+			self.assertEqual(pipeline.run({"x": 2})["sum"], 6)
+
+if __name__ == '__main__':
+	unittest.main()
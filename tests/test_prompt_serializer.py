@@ -0,0 +1,78 @@
+import unittest
+
+from utils.prompt_serializer import serialize, group_descriptions, round_box, count_tokens
+from models.summarization_model import SummarizationModel
+
+
+def make_inputs(n):
+	obj_metadata = [{"object_id": f"img_{i}", "object_img_path": f"/tmp/abc/img_{i}.jpg",
+					 "obj_seg_bbox": [10.123456 * i, 20.98765, 30.5, 40.25],
+					 "master_image": "/home/user/data/input_images/img.jpg", "master_id": "img"} for i in range(n)]
+	desc = [{"object_class": "car" if i % 2 else "person", "conf": f"{0.5 + i / 100:.2f}",
+			 "obj_id_bbox": [[1.23456 * i, 2.5, 300.75, 400.125]]} for i in range(n)]
+	return obj_metadata, desc
+
+
+class TestPromptSerializer(unittest.TestCase):
+
+	def test_round_box(self):
+		self.assertEqual(round_box([[1.4, 2.6, 3.5, 4.0]]), "[1,3,4,4]")
+		self.assertEqual(round_box([1.44, 2.66, 3.0, 4.0], 1), "[1.4,2.7,3.0,4.0]")
+
+	def test_group_descriptions(self):
+		obj_metadata, desc = make_inputs(5)
+		groups, others = group_descriptions(desc + ["Object 1 is a car."])
+		self.assertEqual(list(groups), ["person", "car"])
+		self.assertEqual(len(groups["person"]["conf"]), 3)
+		self.assertEqual(others, ["Object 1 is a car."])
+
+	def test_group_count(self):
+		# Some detections without a conf, some without a box, all of them count
+		desc = [{"object_class": "car", "conf": 0.9}, {"object_class": "car", "obj_id_bbox": [0, 0, 5, 5]},
+				{"object_class": "car"}]
+		data, _ = serialize([], desc, None)
+		self.assertIn("car x3", data)
+
+	def test_drops_paths(self):
+		obj_metadata, desc = make_inputs(3)
+		data, tokens = serialize(obj_metadata, desc, ["For Sale"])
+		self.assertNotIn("/tmp/abc", data)
+		self.assertNotIn("/home/user", data)
+		self.assertIn("person x2", data)
+		self.assertIn("For Sale", data)
+		self.assertEqual(tokens, count_tokens(data))
+		self.assertLess(len(data), len(repr(obj_metadata)))
+
+	def test_empty(self):
+		data, _ = serialize([], [], [])
+		self.assertIn("segmented objects: none", data)
+		self.assertIn("detections: none", data)
+		self.assertIn("text_results: none", data)
+
+	def test_budget(self):
+		obj_metadata, desc = make_inputs(200)
+		text = "lorem ipsum " * 500
+		full, full_tokens = serialize(obj_metadata, desc, text)
+		for budget in (800, 200, 50):
+			data, tokens = serialize(obj_metadata, desc, text, budget)
+			self.assertLessEqual(tokens, budget)
+			self.assertLess(tokens, full_tokens)
+
+		# Under a small budget the class counts are still there
+		data, _ = serialize(obj_metadata, desc, text, 200)
+		self.assertIn("person x100", data)
+
+	def test_summarization_prompt(self):
+		obj_metadata, desc = make_inputs(100)
+		model = SummarizationModel(max_prompt_tokens=600)
+		prompt = model.build_prompt(obj_metadata, desc, "For Sale")
+		self.assertLessEqual(model.last_prompt_stats["tokens"], 600)
+		self.assertEqual(model.last_prompt_stats["chars"], len(prompt))
+		self.assertIn("You are a summarization model.", prompt)
+
+		raw_prompt = SummarizationModel(compact_prompt=False).build_prompt(obj_metadata, desc, "For Sale")
+		self.assertLess(len(prompt), len(raw_prompt) / 4)
+
+
+if __name__ == '__main__':
+	unittest.main()
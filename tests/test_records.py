@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from utils.records import ImageRecord, records_from_mapping, records_to_mapping
+from utils.columnar_writer import ColumnarWriter, read_columnar, pa
+
+
+def make_final_dict(master_id, n):
+	entries = []
+	for i in range(n):
+		matched = i % 2 == 0
+		entries.append({
+			"obj_id": f"{master_id}_{i}",
+			"obj_img_path": f"/tmp/{master_id}_{i}.jpg",
+			"obj_seg_bbox": [i, 2 * i, 10, 20],
+			"master_image": f"data/input_images/{master_id}.jpg",
+			"obj_name": "person" if matched else None,
+			"confidence": 0.8 if matched else None,
+			"obj_id_bbox": [[i, 2 * i, i + 10, 2 * i + 20]] if matched else None,
+			"iou": 0.75 if matched else None,
+		})
+	return {master_id: {"entries": entries, "text": "STOP", "summary": None,
+						"id_model_image_path": None, "unmatched_descriptions": []}}
+
+
+class TestRecords(unittest.TestCase):
+
+	def test_round_trip(self):
+		final_dict = make_final_dict("img", 3)
+		records = records_from_mapping(final_dict)
+		self.assertEqual(len(records[0]), 3)
+		self.assertEqual(records[0].seg_boxes.shape, (3, 4))
+		self.assertEqual(records[0].seg_boxes.dtype, np.float32)
+		self.assertTrue(np.isnan(records[0].confidences[1]))
+		self.assertEqual(records_to_mapping(records), final_dict)
+
+	def test_objects(self):
+		record = records_from_mapping(make_final_dict("img", 2))[0]
+		first, second = record.objects()
+		self.assertEqual(first.obj_name, "person")
+		self.assertIsNone(second.id_bbox)
+		self.assertFalse(hasattr(first, "__dict__"))
+
+	def test_empty(self):
+		record = ImageRecord("img")
+		self.assertEqual(len(record), 0)
+		self.assertEqual(record.to_mapping()["entries"], [])
+
+
+class TestColumnarWriter(unittest.TestCase):
+
+	def write(self, output_dir, format):
+		with ColumnarWriter(output_dir, format, rows_per_flush=4) as writer:
+			for i in range(5):
+				for record in records_from_mapping(make_final_dict(f"img{i}", 3)):
+					writer.write(record)
+
+	def check(self, output_dir):
+		objects = read_columnar(output_dir, "objects")
+		images = read_columnar(output_dir, "images")
+		self.assertEqual(len(objects["obj_id"]), 15)
+		self.assertEqual(objects["seg_bbox"].shape, (15, 4))
+		self.assertEqual(list(objects["master_id"][:4]), ["img0"] * 3 + ["img1"])
+		self.assertTrue(np.isnan(objects["id_bbox"][1]).all())
+		self.assertAlmostEqual(float(objects["confidence"][0]), 0.8, places=5)
+		self.assertEqual(list(images["n_objects"]), [3] * 5)
+
+	def test_npz(self):
+		with tempfile.TemporaryDirectory() as output_dir:
+			self.write(output_dir, "npz")
+			# Flushed every 4 objects, that's every 2 images
+			self.assertTrue(os.path.exists(os.path.join(output_dir, "objects-00002.npz")))
+			self.check(output_dir)
+
+	@unittest.skipIf(pa is None, "pyarrow is not installed")
+	def test_parquet(self):
+		with tempfile.TemporaryDirectory() as output_dir:
+			self.write(output_dir, "parquet")
+			self.check(output_dir)
+
+	def test_bad_format(self):
+		with self.assertRaises(ValueError):
+			ColumnarWriter(tempfile.gettempdir(), "csv")
+
+
+if __name__ == '__main__':
+	unittest.main()
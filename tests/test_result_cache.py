@@ -0,0 +1,59 @@
+import unittest
+import os
+import tempfile
+from utils.result_cache import ResultCache, MISSING, hash_bytes
+
+class TestResultCache(unittest.TestCase):
+
+	def setUp(self):
+		self.temp_dir = tempfile.TemporaryDirectory()
+		self.cache = ResultCache(self.temp_dir.name, max_bytes=10 * 1024 * 1024)
+
+	def tearDown(self):
+		self.temp_dir.cleanup()
+
+	def test_put_get(self):
+		key = self.cache.make_key(hash_bytes(b"image"), "segmentation", "yolov8s-seg.pt", "8.2.71", {"conf": 0.30})
+		self.assertIsNone(self.cache.get(key))
+
+		self.cache.put(key, {"objects": [1, 2, 3]})
+		self.assertIn(key, self.cache)
+		self.assertEqual(self.cache.get(key), {"objects": [1, 2, 3]})
+
+	def test_none_value(self):
+		key = self.cache.make_key(hash_bytes(b"image"), "text_extraction", "easyocr-en", "1.7.1")
+		self.assertIs(self.cache.get(key, MISSING), MISSING)
+
+		# No text is a valid result and has to be told apart from a miss
+		self.cache.put(key, None)
+		self.assertIsNone(self.cache.get(key, MISSING))
+
+	def test_key_includes_model_and_thresholds(self):
+		content_hash = hash_bytes(b"image")
+		key = self.cache.make_key(content_hash, "segmentation", "yolov8s-seg.pt", "8.2.71", {"conf": 0.30})
+
+		self.assertNotEqual(key, self.cache.make_key(content_hash, "segmentation", "yolov8s-seg.pt", "8.2.71", {"conf": 0.50}))
+		self.assertNotEqual(key, self.cache.make_key(content_hash, "segmentation", "yolov8s-seg.pt", "8.3.0", {"conf": 0.30}))
+		self.assertNotEqual(key, self.cache.make_key(content_hash, "identification", "yolov8n.pt", "8.2.71", {"conf": 0.30}))
+		self.assertNotEqual(key, self.cache.make_key(hash_bytes(b"other image"), "segmentation", "yolov8s-seg.pt", "8.2.71", {"conf": 0.30}))
+
+	def test_lru_eviction(self):
+		# Random bytes don't compress, so every entry is ~1 KB on disk
+		cache = ResultCache(self.temp_dir.name, max_bytes=3500)
+		keys = [cache.make_key(hash_bytes(bytes([idx])), "stage", "model", "1") for idx in range(4)]
+
+		for idx, key in enumerate(keys[:3]):
+			cache.put(key, os.urandom(1000))
+			os.utime(cache.path_for(key), (idx, idx))
+
+		# Reading the oldest entry makes it the most recently used one
+		cache.get(keys[0])
+		cache.put(keys[3], os.urandom(1000))
+
+		self.assertIn(keys[0], cache)
+		self.assertNotIn(keys[1], cache)
+		self.assertIn(keys[3], cache)
+		self.assertLessEqual(cache.size(), 3500)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+
+from utils.results_store import ResultsStore
+
+
+def make_final_dict(master_id, objects, text):
+	entries = []
+	for i, (obj_name, conf) in enumerate(objects):
+		entries.append({
+			"obj_id": f"{master_id}_{i}",
+			"obj_img_path": None,
+			"obj_seg_bbox": [0, 0, 10, 10],
+			"master_image": f"data/input_images/{master_id}.jpg",
+			"obj_name": obj_name,
+			"confidence": conf,
+			"obj_id_bbox": [[0, 0, 10, 10]] if obj_name else None,
+			"iou": 1.0 if obj_name else None,
+		})
+	return {master_id: {"entries": entries, "text": text, "summary": f"summary of {master_id}",
+						"id_model_image_path": None, "unmatched_descriptions": []}}
+
+
+class TestResultsStore(unittest.TestCase):
+
+	def setUp(self):
+		self.temp_dir = tempfile.TemporaryDirectory()
+		self.store = ResultsStore(os.path.join(self.temp_dir.name, "results.db"))
+		self.store.add(make_final_dict("a", [("person", 0.9), ("car", 0.5)], "STOP sign ahead"))
+		self.store.add(make_final_dict("b", [("person", 0.6)], "stop"))
+		self.store.add(make_final_dict("c", [("person", 0.95), (None, None)], "For Sale"))
+
+	def tearDown(self):
+		self.store.close()
+		self.temp_dir.cleanup()
+
+	def master_ids(self, rows):
+		return [row["master_id"] for row in rows]
+
+	def test_query(self):
+		self.assertEqual(self.master_ids(self.store.query("person", 0.8, "STOP")), ["a"])
+		self.assertEqual(self.master_ids(self.store.query("person", 0.8)), ["a", "c"])
+		self.assertEqual(self.master_ids(self.store.query(text="stop")), ["a", "b"])
+		self.assertEqual(self.master_ids(self.store.query("car")), ["a"])
+		self.assertEqual(self.master_ids(self.store.query(summary="summary of b")), ["b"])
+		self.assertEqual(self.store.query("dog"), [])
+		self.assertEqual(len(self.store.query(limit=2)), 2)
+
+	def test_quotes_in_text(self):
+		self.assertEqual(self.store.query(text='"For" OR'), [])
+
+	def test_replace(self):
+		self.store.add(make_final_dict("a", [("dog", 0.7)], "woof"))
+		self.assertEqual(len(self.store), 3)
+		self.assertEqual(self.store.query("person", 0.8, "STOP"), [])
+		self.assertEqual(self.master_ids(self.store.query(text="woof")), ["a"])
+		self.assertEqual(self.store.class_counts(), {"person": 2, "dog": 1})
+
+	def test_get(self):
+		final_dict = make_final_dict("c", [("person", 0.95), (None, None)], "For Sale")
+		record = self.store.get("c")
+		self.assertEqual({"c": record.to_mapping()}, final_dict)
+		self.assertIsNone(self.store.get("missing"))
+
+	def test_persistent(self):
+		self.store.close()
+		self.store = ResultsStore(os.path.join(self.temp_dir.name, "results.db"))
+		self.assertEqual(len(self.store), 3)
+
+
+if __name__ == '__main__':
+	unittest.main()
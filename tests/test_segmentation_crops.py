@@ -0,0 +1,91 @@
+import os
+import glob
+import unittest
+from unittest import mock
+
+import cv2
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+
+from models import model_registry
+from models.segmentation_model import SegmentationModel
+
+IMAGE_PATHS = sorted(glob.glob("data/input_images/*.jpg"))
+
+
+def make_masks(height, width, seed):
+	"""
+	Masks at a lower resolution than the image, like the model's own: one in
+	two parts, one cut by the border of the image and a tiny one.
+	"""
+	rng = np.random.default_rng(seed)
+	mask_h, mask_w = max(32, height // 4), max(32, width // 4)
+	masks = np.zeros((3, mask_h, mask_w), dtype=np.uint8)
+
+	cx, cy = int(rng.integers(mask_w // 4, mask_w // 2)), int(rng.integers(mask_h // 4, mask_h // 2))
+	cv2.circle(masks[0], (cx, cy), 6, 1, -1)
+	cv2.rectangle(masks[0], (cx + 12, cy + 8), (cx + 20, cy + 14), 1, -1)
+	cv2.ellipse(masks[1], (mask_w - 3, mask_h // 2), (10, 7), 30, 0, 360, 1, -1)
+	masks[2, cy:cy + 2, cx:cx + 2] = 1
+	return torch.from_numpy(masks.astype(np.float32))
+
+
+def make_result(img, seed):
+	masks = make_masks(*img.shape[:2], seed)
+	boxes = torch.tensor([[0, 0, 10, 10, 0.9, 0]] * len(masks), dtype=torch.float32)
+	return Results(img, path="test.jpg", names={0: "person"}, boxes=boxes, masks=masks)
+
+
+@mock.patch.object(model_registry, "get", return_value=None)
+class TestSegmentationCrops(unittest.TestCase):
+
+	def assert_same_crops(self, model, masks, img):
+		model.vectorized_crops = False
+		reference = list(model.shade_objects(masks, img))
+		model.vectorized_crops = True
+		vectorized = list(model.shade_objects(masks, img))
+
+		self.assertEqual([(idx, bbox) for idx, bbox, _ in vectorized], [(idx, bbox) for idx, bbox, _ in reference])
+		for (_, _, crop), (_, _, expected) in zip(vectorized, reference):
+			np.testing.assert_array_equal(crop, expected)
+		return reference
+
+	def test_bundled_images(self, _):
+		self.assertTrue(IMAGE_PATHS)
+		model = SegmentationModel("memory")
+		for seed, path in enumerate(IMAGE_PATHS):
+			img = cv2.imread(path)
+			with self.subTest(path=path):
+				reference = self.assert_same_crops(model, make_result(img, seed).masks, img)
+				self.assertTrue(reference)
+
+	def test_no_masks(self, _):
+		model = SegmentationModel("memory")
+		img = np.zeros((40, 40, 3), dtype=np.uint8)
+		masks = Results(img, path="test.jpg", names={0: "person"}, boxes=torch.zeros((1, 6)),
+						masks=torch.zeros((1, 40, 40))).masks
+		self.assertEqual(self.assert_same_crops(model, masks, img), [])
+
+
+@unittest.skipUnless(os.path.exists(SegmentationModel.model_path), "needs the yolov8s-seg weights")
+class TestSegmentationCropsWithModel(unittest.TestCase):
+
+	def test_bundled_images(self):
+		model = SegmentationModel("memory")
+		for path in IMAGE_PATHS[:16]:
+			img = cv2.imread(path)
+			result = model.model.predict(img, conf=0.30, verbose=False)[0]
+			if result.masks is None:
+				continue
+			with self.subTest(path=path):
+				model.vectorized_crops = False
+				reference = list(model.shade_objects(result.masks, img))
+				model.vectorized_crops = True
+				for (idx, bbox, crop), (ref_idx, ref_bbox, expected) in zip(model.shade_objects(result.masks, img), reference):
+					self.assertEqual((idx, bbox), (ref_idx, ref_bbox))
+					np.testing.assert_array_equal(crop, expected)
+
+
+if __name__ == "__main__":
+	unittest.main()
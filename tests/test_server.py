@@ -0,0 +1,219 @@
+import json
+import http.client
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import cv2
+import numpy as np
+
+from models.text_extraction_model import TextExtractionModel
+from service import server
+from service.server import InferenceServer, InferenceService
+
+
+class FakeSegmentationModel:
+	calls = []
+
+	def __init__(self, *args, **kwargs):
+		pass
+
+	def predict_batch(self, images, batch_size=8):
+		self.calls.append(len(images))
+		return [([None], [{"object_id": f"{image.master_id}_obj_0", "object_img_path": None,
+						   "obj_seg_bbox": [0, 0, 10, 10], "master_image": None, "master_id": image.master_id}])
+				for image in images]
+
+
+class FakeIdentificationModel:
+	delay = 0.0
+
+	def __init__(self, *args, **kwargs):
+		pass
+
+	def generate_descriptions_batch(self, images, batch_size=8):
+		time.sleep(self.delay)
+		return [([{"object_class": "person", "conf": 0.9, "obj_id_bbox": [[0, 0, 10, 10]]}], None) for _ in images]
+
+
+class FakeTextExtractionModel:
+	# Set to block the OCR until the test lets it go
+	release = None
+	entered = threading.Event()
+	join_text = staticmethod(TextExtractionModel.join_text)
+
+	def __init__(self, *args, **kwargs):
+		pass
+
+	def extract_text_batch(self, images, batch_size=8):
+		if self.release is not None:
+			self.entered.set()
+			self.release.wait(5)
+		return [[{"text": "STOP", "conf": 0.9, "bbox": [0, 0, 10, 10]}] for _ in images]
+
+
+class FakeSummarizationModel:
+	threads = []
+
+	def __init__(self, *args, **kwargs):
+		pass
+
+	def summarize_many(self, items):
+		self.threads.append(threading.current_thread().name)
+		return [f"{len(obj_metadata)} objects, {text}" for obj_metadata, desc, text in items]
+
+	def close(self):
+		pass
+
+
+def encode_image():
+	return cv2.imencode(".png", np.zeros((16, 16, 3), dtype=np.uint8))[1].tobytes()
+
+
+@mock.patch.multiple(server, SegmentationModel=FakeSegmentationModel, IdentificationModel=FakeIdentificationModel,
+					 TextExtractionModel=FakeTextExtractionModel, SummarizationModel=FakeSummarizationModel)
+class TestServer(unittest.TestCase):
+
+	def setUp(self):
+		FakeSegmentationModel.calls = []
+		FakeIdentificationModel.delay = 0.0
+		FakeTextExtractionModel.release = None
+		FakeTextExtractionModel.entered.clear()
+
+	def post(self, base_url, endpoint, data):
+		request = urllib.request.Request(base_url + endpoint, data=data, method="POST")
+		try:
+			with urllib.request.urlopen(request, timeout=10) as response:
+				return response.status, json.loads(response.read())
+		except urllib.error.HTTPError as e:
+			return e.code, json.loads(e.read())
+
+	def get(self, base_url, endpoint):
+		try:
+			with urllib.request.urlopen(base_url + endpoint, timeout=10) as response:
+				return response.status, json.loads(response.read())
+		except urllib.error.HTTPError as e:
+			return e.code, json.loads(e.read())
+
+	def test_endpoints(self):
+		with InferenceServer(InferenceService(max_wait_ms=5), port=0) as srv:
+			self.assertEqual(self.get(srv.base_url, "/healthz"), (200, {"status": "ok"}))
+			self.assertEqual(self.get(srv.base_url, "/readyz"), (200, {"status": "ready"}))
+
+			status, body = self.post(srv.base_url, "/segment?name=img", encode_image())
+			self.assertEqual(status, 200)
+			self.assertEqual(body["master_id"], "img")
+			self.assertEqual(body["objects"][0]["obj_seg_bbox"], [0, 0, 10, 10])
+
+			status, body = self.post(srv.base_url, "/identify", encode_image())
+			self.assertEqual(body["descriptions"][0]["object_class"], "person")
+
+			status, body = self.post(srv.base_url, "/ocr", encode_image())
+			self.assertEqual(body["text"], "STOP")
+
+			status, body = self.post(srv.base_url, "/pipeline?name=img", encode_image())
+			self.assertEqual(status, 200)
+			self.assertEqual(body["entries"][0]["obj_name"], "person")
+			self.assertEqual(body["text"], "STOP")
+			self.assertEqual(len(body["text_regions"]), 1)
+
+			self.assertEqual(self.post(srv.base_url, "/segment", b"not an image")[0], 400)
+			self.assertEqual(self.post(srv.base_url, "/nothing", encode_image())[0], 404)
+
+	def test_bad_content_length(self):
+		with InferenceServer(InferenceService(max_wait_ms=5), port=0) as srv:
+			connection = http.client.HTTPConnection(*srv.server.server_address[:2], timeout=10)
+			connection.putrequest("POST", "/segment")
+			connection.putheader("Content-Length", "lots")
+			connection.endheaders()
+			response = connection.getresponse()
+			self.assertEqual(response.status, 400)
+			self.assertIn("Content-Length", json.loads(response.read())["error"])
+			connection.close()
+
+	def test_summary_off_the_handler_thread(self):
+		FakeSummarizationModel.threads = []
+		with InferenceServer(InferenceService(max_wait_ms=5, summarize=True), port=0) as srv:
+			status, body = self.post(srv.base_url, "/pipeline?name=img", encode_image())
+			self.assertEqual(status, 200)
+			self.assertEqual(body["summary"], "1 objects, STOP")
+
+			# ?summarize=0 doesn't wait for the LLM at all
+			status, body = self.post(srv.base_url, "/pipeline?summarize=0", encode_image())
+			self.assertIsNone(body["summary"])
+		self.assertEqual(FakeSummarizationModel.threads, ["summary-batcher"])
+
+	def test_concurrent_requests_are_batched(self):
+		with InferenceServer(InferenceService(max_batch_size=8, max_wait_ms=300), port=0) as srv:
+			FakeSegmentationModel.calls = []
+			with ThreadPoolExecutor(6) as executor:
+				statuses = list(executor.map(lambda idx: self.post(srv.base_url, f"/segment?name={idx}",
+																   encode_image())[0], range(6)))
+			self.assertEqual(statuses, [200] * 6)
+			self.assertEqual(sum(FakeSegmentationModel.calls), 6)
+			self.assertLess(len(FakeSegmentationModel.calls), 6)
+
+			stats = self.get(srv.base_url, "/stats")[1]
+			self.assertEqual(stats["models"]["segmentation"]["items"], 7)
+
+	def test_full_queue_gets_503(self):
+		with InferenceServer(InferenceService(max_batch_size=1, max_wait_ms=0, max_queue=1), port=0) as srv:
+			batcher = srv.service.batchers["text_extraction"]
+			FakeTextExtractionModel.release = threading.Event()
+
+			def wait_for(condition):
+				deadline = time.perf_counter() + 5
+				while not condition() and time.perf_counter() < deadline:
+					time.sleep(0.01)
+
+			with ThreadPoolExecutor(2) as executor:
+				# One request is held in the model, the next one waits in the queue
+				first = executor.submit(self.post, srv.base_url, "/ocr", encode_image())
+				FakeTextExtractionModel.entered.wait(5)
+				second = executor.submit(self.post, srv.base_url, "/ocr", encode_image())
+				wait_for(lambda: len(batcher) == 1)
+
+				request = urllib.request.Request(srv.base_url + "/ocr", data=encode_image(), method="POST")
+				with self.assertRaises(urllib.error.HTTPError) as context:
+					urllib.request.urlopen(request, timeout=10)
+				self.assertEqual(context.exception.code, 503)
+				self.assertEqual(context.exception.headers["Retry-After"], "1")
+
+				FakeTextExtractionModel.release.set()
+				self.assertEqual((first.result()[0], second.result()[0]), (200, 200))
+			self.assertEqual(batcher.rejected, 1)
+
+	def test_pipeline_has_one_deadline(self):
+		with InferenceServer(InferenceService(max_wait_ms=0, request_timeout=1.0), port=0) as srv:
+			# Identification takes most of the timeout and the OCR never answers
+			FakeIdentificationModel.delay = 0.8
+			FakeTextExtractionModel.release = threading.Event()
+			try:
+				start = time.perf_counter()
+				status, _ = self.post(srv.base_url, "/pipeline", encode_image())
+				elapsed = time.perf_counter() - start
+			finally:
+				FakeTextExtractionModel.release.set()
+			self.assertEqual(status, 504)
+			# Not a timeout for every model it waited on
+			self.assertLess(elapsed, 1.5)
+
+	def test_not_ready_before_loading(self):
+		service = InferenceService()
+		srv = InferenceServer(service, port=0)
+		with mock.patch.object(service, "load"):
+			srv.start()
+		try:
+			self.assertEqual(self.get(srv.base_url, "/healthz")[0], 200)
+			self.assertEqual(self.get(srv.base_url, "/readyz"), (503, {"status": "loading"}))
+			self.assertEqual(self.post(srv.base_url, "/segment", encode_image())[0], 503)
+		finally:
+			srv.stop()
+
+
+if __name__ == "__main__":
+	unittest.main()
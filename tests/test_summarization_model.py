@@ -1,19 +1,28 @@
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from models.summarization_model import SummarizationModel
 
+
+def mock_g4f(content):
+	# gpt4free's AsyncClient, which the LLMClient uses without a base_url
+	mock_response = MagicMock()
+	mock_response.choices[0].message.content = content
+	session = MagicMock(spec=["chat"])
+	session.chat.completions.create = AsyncMock(return_value=mock_response)
+	client = MagicMock(return_value=session)
+	return patch('g4f.client.AsyncClient', client)
+
+
 class TestSummarizationModel(unittest.TestCase):
 
 	def setUp(self):
 		self.model = SummarizationModel()
 
-	@patch('models.summarization_model.Client')
-	def test_summarize(self, MockClient):
-		
-		# Mock the response from the Client
-		mock_response = MagicMock()
-		mock_response.choices[0].message.content = "Mocked summary response"
-		MockClient().chat.completions.create.return_value = mock_response
+	def tearDown(self):
+		self.model.close()
+
+	@mock_g4f("Mocked summary response")
+	def test_summarize(self):
 
 		# Define test inputs
 		obj_metadata = [{"object_id": 1, "object_img_path": "path/to/object1.jpg", "obj_seg_bbox": [0, 0, 10, 10], "master_image": "path/to/master.jpg", "master_id": "0001"}]
@@ -26,12 +35,8 @@ class TestSummarizationModel(unittest.TestCase):
 		# Check if the summary is as expected
 		self.assertEqual(summary, "Mocked summary response")
 
-	@patch('models.summarization_model.Client')
-	def test_summarize_no_objects(self, MockClient):
-		# Mock the response from the Client
-		mock_response = MagicMock()
-		mock_response.choices[0].message.content = "No objects detected"
-		MockClient().chat.completions.create.return_value = mock_response
+	@mock_g4f("No objects detected")
+	def test_summarize_no_objects(self):
 
 		# Define test inputs with no objects
 		obj_metadata = []
@@ -44,12 +49,8 @@ class TestSummarizationModel(unittest.TestCase):
 		# Check if the summary is as expected
 		self.assertEqual(summary, "No objects detected")
 
-	@patch('models.summarization_model.Client')
-	def test_summarize_no_text(self, MockClient):
-		# Mock the response from the Client
-		mock_response = MagicMock()
-		mock_response.choices[0].message.content = "No text detected"
-		MockClient().chat.completions.create.return_value = mock_response
+	@mock_g4f("No text detected")
+	def test_summarize_no_text(self):
 
 		# Define test inputs with no text
 		obj_metadata = [{"object_id": 1, "object_img_path": "path/to/object1.jpg", "obj_seg_bbox": [0, 0, 10, 10], "master_image": "path/to/master.jpg", "master_id": "0001"}]
@@ -62,12 +63,8 @@ class TestSummarizationModel(unittest.TestCase):
 		# Check if the summary is as expected
 		self.assertEqual(summary, "No text detected")
 
-	@patch('models.summarization_model.Client')
-	def test_summarize_no_text(self, MockClient):
-		# Mock the response from the Client
-		mock_response = MagicMock()
-		mock_response.choices[0].message.content = "No text detected"
-		MockClient().chat.completions.create.return_value = mock_response
+	@mock_g4f("No text detected")
+	def test_summarize_no_text(self):
 
 		# inputs with no text
 		obj_metadata = [{"object_id": 1, "object_img_path": "path/to/object1.jpg", "obj_seg_bbox": [0, 0, 10, 10], "master_image": "path/to/master.jpg", "master_id": "0001"}]
@@ -79,5 +76,34 @@ class TestSummarizationModel(unittest.TestCase):
 
 		self.assertEqual(summary, "No text detected")
 
+	def test_summarize_many(self):
+		prompts = []
+
+		async def complete(prompt):
+			prompts.append(prompt)
+			return f"summary {len(prompts)}"
+
+		self.model.llm.complete = complete
+		obj_metadata = [{"object_id": 1, "object_img_path": "path/to/object1.jpg", "obj_seg_bbox": [0, 0, 10, 10], "master_image": "path/to/master.jpg", "master_id": "0001"}]
+		summaries = self.model.summarize_many([
+			(obj_metadata, ["Object 1 is a car."], "For Sale"),
+			([], [], ""),
+		])
+		self.model.close()
+
+		self.assertEqual(summaries, ["summary 1", "summary 2"])
+		self.assertIn("For Sale", prompts[0])
+
+	def test_summarize_stream(self):
+		async def stream(prompt):
+			for piece in ("No ", "objects ", "detected"):
+				yield piece
+
+		self.model.llm.stream = stream
+		pieces = list(self.model.summarize_stream([], [], []))
+		self.model.close()
+
+		self.assertEqual(pieces, ["No ", "objects ", "detected"])
+
 if __name__ == '__main__':
 	unittest.main()
\ No newline at end of file
@@ -2,11 +2,14 @@ import unittest
 from unittest.mock import patch, MagicMock
 import numpy as np
 from models.text_extraction_model import TextExtractionModel
+from models import model_registry
 
 class TestTextExtractionModel(unittest.TestCase):
 
-	@patch('models.text_extraction_model.easyocr.Reader')
+	@patch('easyocr.Reader')
 	def setUp(self, MockReader):
+		# The reader is shared through the registry, drop it so the patched one gets loaded
+		model_registry.clear()
 		self.model = TextExtractionModel()
 		self.mock_reader = MockReader.return_value
 
@@ -37,7 +40,10 @@ class TestTextExtractionModel(unittest.TestCase):
 		mock_preprocess_image.return_value = dummy_img
 
 		# Mocking the reader's readtext method to see if it returns the expected text
-		self.mock_reader.readtext.return_value = [("Hello",), ("World",)]
+		self.mock_reader.readtext.return_value = [
+			([[0, 0], [50, 0], [50, 20], [0, 20]], "Hello", 0.98),
+			([[60, 0], [120, 0], [120, 20], [60, 20]], "World", 0.95),
+		]
 
 		img_path = "dummy_path.jpg"
 		result = self.model.extract_text(img_path)
@@ -48,5 +54,80 @@ class TestTextExtractionModel(unittest.TestCase):
 		result = self.model.extract_text(img_path)
 		self.assertIsNone(result)
 
+	def test_preprocess_image_keep_aspect(self):
+		# Small images are upscaled, at most 2x
+		processed_img, scale = self.model.preprocess_image_keep_aspect(np.zeros((100, 400, 3), dtype=np.uint8))
+		self.assertEqual(processed_img.shape, (200, 800))
+		self.assertEqual(scale, 2.0)
+
+		# Big images are downscaled to max_side, keeping the aspect ratio
+		processed_img, scale = self.model.preprocess_image_keep_aspect(np.zeros((2000, 1000, 3), dtype=np.uint8), max_side=1280)
+		self.assertEqual(processed_img.shape, (1280, 640))
+
+	def test_extract_text_regions(self):
+		# 400x400 image is upscaled 2x, the detector works on the resized image
+		img = np.zeros((400, 400, 3), dtype=np.uint8)
+		self.mock_reader.detect.return_value = ([[[10, 50, 5, 20], [300, 340, 300, 320]]], [[]])
+		self.mock_reader.recognize.return_value = [([[10, 5], [50, 5], [50, 20], [10, 20]], "STOP", 0.9)]
+
+		# Only the detected region inside the target region is recognized
+		results = self.model.extract_text_regions(img, regions=[[0, 0, 40, 20]])
+		_, kwargs = self.mock_reader.recognize.call_args
+		self.assertEqual(kwargs["horizontal_list"], [[10, 50, 5, 20]])
+
+		# Boxes are returned in the coordinates of the original image
+		self.assertEqual(results, [{"text": "STOP", "conf": 0.9, "bbox": [5.0, 2.5, 25.0, 10.0]}])
+
+		# Without detection the regions themselves are recognized
+		self.model.extract_text_regions(img, regions=[[0, 0, 40, 20]], detect=False)
+		_, kwargs = self.mock_reader.recognize.call_args
+		self.assertEqual(kwargs["horizontal_list"], [[0, 80, 0, 40]])
+
+		# Nothing to read
+		self.mock_reader.detect.return_value = ([[]], [[]])
+		self.assertEqual(self.model.extract_text_regions(img), [])
+
+	def test_extract_text_batch(self):
+		images = [np.zeros((300, 400, 3), dtype=np.uint8), np.zeros((1200, 1600, 3), dtype=np.uint8)]
+		self.mock_reader.readtext_batched.return_value = [
+			[([[80, 60], [160, 60], [160, 120], [80, 120]], "Hello", 0.8), ([[200, 60], [280, 60], [280, 120], [200, 120]], "World", 0.7)],
+			[],
+		]
+
+		results = self.model.extract_text_batch(images, batch_size=4, workers=0)
+
+		# All the images go to EasyOCR in one call, resized to the same size
+		args, kwargs = self.mock_reader.readtext_batched.call_args
+		self.assertEqual([img.shape for img in args[0]], [(600, 800), (600, 800)])
+		self.assertEqual(kwargs["batch_size"], 4)
+
+		# One result list per image, boxes back in original image coordinates
+		self.assertEqual(len(results), 2)
+		self.assertEqual(results[0][0], {"text": "Hello", "conf": 0.8, "bbox": [40.0, 30.0, 80.0, 60.0]})
+		self.assertEqual(results[1], [])
+
+		self.assertEqual(self.model.join_text(results[0]), "Hello World")
+		self.assertIsNone(self.model.join_text(results[1]))
+
+	def test_reader_calls_hold_the_registry_lock(self):
+		# easyocr isn't thread safe, every call to the shared reader is made under its registry lock
+		lock = model_registry.lock("text_extraction")
+		held = []
+
+		def record(*args, **kwargs):
+			held.append(lock.locked())
+			return []
+
+		for method in ("readtext", "readtext_batched", "detect", "recognize"):
+			getattr(self.mock_reader, method).side_effect = record
+		self.mock_reader.detect.side_effect = lambda *args, **kwargs: (record(), ([[[10, 50, 5, 20]]], [[]]))[1]
+
+		img = np.zeros((300, 400, 3), dtype=np.uint8)
+		self.model.read_text(img)
+		self.model.extract_text_batch([img])
+		self.model.extract_text_regions(img)
+		self.assertEqual(held, [True, True, True, True])
+		self.assertFalse(lock.locked())
+
 if __name__ == '__main__':
 	unittest.main()
\ No newline at end of file
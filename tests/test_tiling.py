@@ -0,0 +1,47 @@
+import unittest
+
+import numpy as np
+
+from utils.tiling import tile_windows, merge_detections, intersection_over_smaller
+
+
+class TestTiling(unittest.TestCase):
+
+	def test_tile_windows(self):
+		windows = tile_windows(1000, 1500, tile_size=640, overlap=0.2)
+
+		# Every tile has the full size and together they cover the whole image
+		covered = np.zeros((1000, 1500), dtype=bool)
+		for x1, y1, x2, y2 in windows:
+			self.assertEqual((x2 - x1, y2 - y1), (640, 640))
+			covered[y1:y2, x1:x2] = True
+		self.assertTrue(covered.all())
+		self.assertEqual(windows[-1][2:], [1500, 1000])
+
+	def test_small_image_is_one_tile(self):
+		self.assertEqual(tile_windows(300, 400, tile_size=640), [[0, 0, 400, 300]])
+		with self.assertRaises(ValueError):
+			tile_windows(300, 400, overlap=1.0)
+
+	def test_intersection_over_smaller(self):
+		# Half of an object is inside the whole of it
+		overlap = intersection_over_smaller(np.array([0, 0, 10, 10], dtype=np.float32),
+											np.array([[0, 0, 5, 10], [20, 20, 30, 30]], dtype=np.float32))
+		np.testing.assert_allclose(overlap, [1.0, 0.0])
+
+	def test_merge_detections(self):
+		boxes = [[0, 0, 100, 100], [60, 0, 160, 100], [0, 0, 100, 100], [300, 300, 310, 310]]
+		scores = [0.9, 0.8, 0.7, 0.6]
+		classes = [0, 0, 1, 0]
+
+		clusters = merge_detections(boxes, scores, classes, threshold=0.3)
+		# The first two overlap enough to be merged, the same box of another class is kept apart
+		self.assertEqual(clusters, [(0, [0, 1]), (2, [2]), (3, [3])])
+
+		# A stricter threshold keeps them apart
+		self.assertEqual(len(merge_detections(boxes, scores, classes, threshold=0.5)), 4)
+		self.assertEqual(merge_detections([], [], []), [])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+from utils.tracker import IoUTracker
+
+
+class TestTracker(unittest.TestCase):
+
+	def test_identities_carry_over(self):
+		tracker = IoUTracker(min_iou=0.3, max_misses=1)
+		first = tracker.update([[0, 0, 10, 10], [50, 50, 60, 60]], ["person", "car"], 0)
+		self.assertEqual([(track.track_id, is_new) for track, is_new in first], [(1, True), (2, True)])
+
+		# Same objects moved a bit and listed in another order
+		second = tracker.update([[52, 51, 62, 61], [1, 0, 11, 10]], ["car", "person"], 1)
+		self.assertEqual([(track.track_id, is_new) for track, is_new in second], [(2, False), (1, False)])
+		self.assertEqual(second[0][0].hits, 2)
+
+	def test_classes_are_not_mixed(self):
+		tracker = IoUTracker(max_misses=0)
+		tracker.update([[0, 0, 10, 10]], ["person"], 0)
+		(track, is_new), = tracker.update([[0, 0, 10, 10]], ["dog"], 1)
+		self.assertTrue(is_new)
+		self.assertEqual(track.track_id, 2)
+
+		# A detection without a class continues the track and keeps its class
+		(track, is_new), = tracker.update([[0, 0, 10, 10]], [None], 2)
+		self.assertFalse(is_new)
+		self.assertEqual(track.obj_name, "dog")
+
+	def test_lost_tracks_are_dropped(self):
+		tracker = IoUTracker(max_misses=1)
+		tracker.update([[0, 0, 10, 10]], ["person"], 0)
+		tracker.update([], [], 1)
+		self.assertEqual(len(tracker.tracks), 1)
+		self.assertEqual(tracker.active(), [])
+
+		tracker.update([], [], 2)
+		self.assertEqual(tracker.tracks, [])
+		(track, is_new), = tracker.update([[0, 0, 10, 10]], ["person"], 3)
+		self.assertTrue(is_new)
+
+	def test_changed(self):
+		tracker = IoUTracker()
+		(track, _), = tracker.update([[0, 0, 100, 100]], ["car"], 0)
+		self.assertTrue(track.changed())
+		track.mark_processed("ABC 123")
+		self.assertFalse(track.changed())
+
+		tracker.update([[5, 0, 105, 100]], ["car"], 1)
+		self.assertFalse(track.changed(0.6))
+
+		tracker.update([[40, 0, 140, 100]], ["car"], 2)
+		self.assertTrue(track.changed(0.6))
+		self.assertEqual(track.text, "ABC 123")
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,137 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import cv2
+import numpy as np
+
+from utils import video_pipeline
+from utils.video_pipeline import VideoPipeline, iter_frames, source_name
+
+
+def write_video(path, n_frames, size=(64, 48)):
+	writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 10, size)
+	for idx in range(n_frames):
+		frame = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+		frame[:, :, 2] = idx * 10
+		writer.write(frame)
+	writer.release()
+
+
+class FakeSegmentationModel:
+	# The object boxes of every frame, as [x, y, w, h]
+	frames = []
+
+	def __init__(self, *args, **kwargs):
+		self.calls = 0
+
+	def predict(self, image):
+		boxes = self.frames[self.calls]
+		self.calls += 1
+		metadata = [{"object_id": f"{image.master_id}_obj_{idx}", "object_img_path": None, "obj_seg_bbox": box,
+					 "master_image": None, "master_id": image.master_id} for idx, box in enumerate(boxes)]
+		return [None] * len(boxes), metadata
+
+	def flush(self):
+		pass
+
+
+class FakeIdentificationModel:
+	def __init__(self, *args, **kwargs):
+		pass
+
+	def generate_descriptions(self, image):
+		return [], None
+
+	def flush(self):
+		pass
+
+
+class FakeTextExtractionModel:
+	def __init__(self, *args, **kwargs):
+		self.regions = []
+
+	def extract_text_regions(self, image, regions, detect=True):
+		self.regions.append(regions)
+		return [{"text": "STOP", "conf": 0.9, "bbox": [x, y, x + w, y + h]} for x, y, w, h in regions]
+
+
+class FakeSummarizationModel:
+	def __init__(self, *args, **kwargs):
+		self.calls = 0
+
+	def summarize(self, obj_metadata, desc, text):
+		self.calls += 1
+		return f"summary {self.calls}"
+
+	def close(self):
+		pass
+
+
+@mock.patch.multiple(video_pipeline, SegmentationModel=FakeSegmentationModel,
+					 IdentificationModel=FakeIdentificationModel, TextExtractionModel=FakeTextExtractionModel,
+					 SummarizationModel=FakeSummarizationModel)
+class TestVideoPipeline(unittest.TestCase):
+
+	def setUp(self):
+		self.temp_dir = tempfile.TemporaryDirectory()
+		self.video_path = os.path.join(self.temp_dir.name, "clip.avi")
+		write_video(self.video_path, 10)
+
+	def tearDown(self):
+		self.temp_dir.cleanup()
+
+	def test_iter_frames(self):
+		frames = list(iter_frames(self.video_path, frame_skip=2))
+		self.assertEqual([frame_idx for frame_idx, _, _ in frames], [0, 3, 6, 9])
+		self.assertEqual(frames[1][1], 0.3)
+		self.assertEqual(frames[1][2].master_id, "clip_000003")
+		# The frame that was read is really frame 3, not the 2nd decoded one
+		self.assertAlmostEqual(int(frames[1][2].bgr[..., 2].mean()), 30, delta=3)
+
+		self.assertEqual(len(list(iter_frames(self.video_path, max_frames=4))), 4)
+		with self.assertRaises(ValueError):
+			list(iter_frames(os.path.join(self.temp_dir.name, "missing.avi")))
+
+	def test_source_name(self):
+		self.assertEqual(source_name(0), "camera0")
+		self.assertEqual(source_name("data/clip.mp4"), "clip")
+		self.assertEqual(source_name("rtsp://camera.local/stream"), "stream")
+
+	def test_ocr_and_summary_only_for_new_or_changed_objects(self):
+		FakeSegmentationModel.frames = [
+			[[0, 0, 20, 20]],
+			[[1, 0, 20, 20]],						# moved a little
+			[[1, 0, 20, 20], [40, 30, 10, 10]],		# a new object
+			[[8, 0, 20, 20], [40, 30, 10, 10]],		# the first one moved a lot
+			[[8, 0, 20, 20], [40, 30, 10, 10]],
+		]
+		pipeline = VideoPipeline(summarize=True)
+		records = list(pipeline.process(self.video_path, max_frames=5))
+
+		self.assertEqual([record["new_tracks"] for record in records], [[1], [], [2], [], []])
+		self.assertEqual([record["changed_tracks"] for record in records], [[], [], [], [1], []])
+		self.assertEqual([record["ocr_ran"] for record in records], [True, False, True, True, False])
+		self.assertEqual([record["summary_ran"] for record in records], [True, False, True, True, False])
+
+		# OCR only saw the regions of the new / changed objects
+		self.assertEqual(pipeline.txt_ext_model.regions, [[[0, 0, 20, 20]], [[40, 30, 10, 10]], [[8, 0, 20, 20]]])
+
+		last = records[-1]
+		self.assertEqual([entry["track_id"] for entry in last["entries"]], [1, 2])
+		self.assertEqual(last["text"], "STOP STOP")
+		self.assertEqual(last["summary"], "summary 3")
+		self.assertEqual(last["master_id"], "clip_000004")
+
+	def test_run_writes_json_lines(self):
+		FakeSegmentationModel.frames = [[] for _ in range(10)]
+		output_path = os.path.join(self.temp_dir.name, "out", "clip.jsonl")
+		n_frames = VideoPipeline(frame_skip=1).run(self.video_path, output_path)
+		self.assertEqual(n_frames, 5)
+		with open(output_path) as f:
+			self.assertEqual(len(f.readlines()), 5)
+
+
+if __name__ == "__main__":
+	unittest.main()
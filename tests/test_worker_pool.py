@@ -0,0 +1,76 @@
+import os
+import functools
+import unittest
+
+import cv2
+import numpy as np
+
+from utils.image_input import ImageInput
+from utils.worker_pool import WorkerPool, next_batch, split_cores
+
+
+class FakePipeline:
+	# Built in every worker, so it has to be importable from there (top level)
+	def __init__(self, fail_on=None, fail_to_load=False) -> None:
+		if fail_to_load:
+			raise ValueError("no weights")
+		self.fail_on = fail_on
+
+	def process_batch(self, images):
+		if any(image.name == self.fail_on for image in images):
+			raise ValueError(f"can't process {self.fail_on}")
+		return [{"name": image.name, "shape": image.shape, "mean": float(image.bgr.mean()), "pid": os.getpid(),
+				 "omp_threads": os.environ.get("OMP_NUM_THREADS"), "cv2_threads": cv2.getNumThreads()}
+				for image in images]
+
+
+def make_images(count):
+	# Different sizes and contents, so a mixed up result would show
+	return [ImageInput(np.full((10 + idx, 20 + 2 * idx, 3), idx, dtype=np.uint8), name=f"img{idx}")
+			for idx in range(count)]
+
+
+class TestWorkerPool(unittest.TestCase):
+
+	def test_results_come_back_in_order(self):
+		with WorkerPool(FakePipeline, workers=2, threads=1, batch_size=3, max_pending=5) as pool:
+			outputs = list(pool.imap(make_images(12)))
+			self.assertEqual(pool.frames, {})
+
+		self.assertEqual([name for name, _ in outputs], [f"img{idx}" for idx in range(12)])
+		for idx, (_, output) in enumerate(outputs):
+			self.assertEqual(output["shape"], (10 + idx, 20 + 2 * idx, 3))
+			self.assertEqual(output["mean"], idx)
+			self.assertNotEqual(output["pid"], os.getpid())
+			self.assertEqual(output["omp_threads"], "1")
+			self.assertEqual(output["cv2_threads"], 1)
+
+	def test_worker_errors_are_raised(self):
+		with WorkerPool(functools.partial(FakePipeline, fail_on="img3"), workers=1, batch_size=1) as pool:
+			with self.assertRaises(RuntimeError) as context:
+				list(pool.imap(make_images(6)))
+		self.assertIn("img3", str(context.exception))
+		self.assertEqual(pool.frames, {})
+
+	def test_failed_startup_is_raised(self):
+		pool = WorkerPool(functools.partial(FakePipeline, fail_to_load=True), workers=1)
+		with self.assertRaises(RuntimeError) as context:
+			pool.start()
+		self.assertIn("no weights", str(context.exception))
+
+	def test_next_batch(self):
+		import queue
+		tasks = queue.Queue()
+		for task in (1, 2, 3, None):
+			tasks.put(task)
+		self.assertEqual(next_batch(tasks, 2), ([1, 2], False))
+		self.assertEqual(next_batch(tasks, 2), ([3], True))
+
+	def test_split_cores(self):
+		cores = split_cores(1, 1)
+		self.assertEqual(len(cores), 1)
+		self.assertIsNone(split_cores(1, 10 ** 6))
+
+
+if __name__ == "__main__":
+	unittest.main()
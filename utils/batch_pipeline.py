@@ -0,0 +1,365 @@
+"""
+    Batch mode of the pipeline. Instead of handling one image per call, this takes
+    a whole directory (or a glob pattern) of images, runs the YOLO models over them
+    in batches and writes one JSON result file per image.
+
+    Usage (from the root folder):
+        python3 utils/batch_pipeline.py data/input_images --batch-size 8
+        python3 utils/batch_pipeline.py "data/input_images/0000000000*.jpg" --summarize
+        python3 utils/batch_pipeline.py data/input_images --combined
+        python3 utils/batch_pipeline.py data/input_images --write-mode async --image-format webp --quality 80
+        python3 utils/batch_pipeline.py data/input_images --cache-dir data/cache
+        python3 utils/batch_pipeline.py data/input_images --columnar parquet --no-json
+        python3 utils/batch_pipeline.py data/input_images --store data/results.db
+        python3 utils/batch_pipeline.py data/input_images --backend onnx --quantize static
+        python3 utils/batch_pipeline.py data/input_images --seg-config mode=tiled,tile_size=640 --id-config mode=fast,conf=0.4
+        python3 utils/batch_pipeline.py data/input_images --metrics-jsonl data/metrics.jsonl --profile inference
+        python3 utils/batch_pipeline.py data/input_images --max-memory-mb 4096
+        python3 utils/batch_pipeline.py data/input_images --workers 4 --threads-per-worker 2 --pin-cores
+        python3 utils/batch_pipeline.py data/input_images --summarize --llm-base-url http://localhost:8000/v1 --llm-concurrency 8
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import functools
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from models.segmentation_model import SegmentationModel
+from models.identification_model import IdentificationModel
+from models.text_extraction_model import TextExtractionModel
+from models.summarization_model import SummarizationModel
+from models.onnx_backend import BACKENDS, QUANTIZE_MODES
+from models.inference_config import InferenceConfig
+from utils.data_mapping import DataMapping
+from utils.image_writer import WRITE_MODES
+from utils.result_cache import ResultCache
+from utils.image_input import ImageInput
+from utils.records import records_from_mapping
+from utils.columnar_writer import ColumnarWriter, COLUMNAR_FORMATS
+from utils.results_store import ResultsStore
+from utils.worker_pool import WorkerPool
+from utils.memory_guard import MemoryGuard
+from utils import metrics
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def collect_image_paths(source):
+    """
+    Returns a sorted list of image paths from a directory or a glob pattern.
+    """
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name) for name in os.listdir(source)]
+    else:
+        paths = glob.glob(source)
+    return sorted(path for path in paths if path.lower().endswith(IMAGE_EXTENSIONS))
+
+
+class BatchPipeline:
+    def __init__(self, batch_size=8, output_dir="data/output", summarize=False, combined=False,
+                 write_mode="sync", image_format="jpg", quality=95, cache_dir=None, cache_size_mb=512,
+                 ocr_batch_size=8, ocr_workers=0, llm_base_url=None, llm_api_key=None, llm_concurrency=4,
+                 llm_timeout=60.0, llm_retries=3, max_prompt_tokens=1024, columnar=None, write_json=True,
+                 store_path=None, backend="torch", quantize=None, seg_config=None, id_config=None,
+                 keep_crops=False, max_memory_mb=None, image_dir=None) -> None:
+        self.batch_size = batch_size
+        self.ocr_batch_size = ocr_batch_size
+        self.ocr_workers = ocr_workers
+        self.output_dir = output_dir
+        self.summarize = summarize
+
+        # columnar is "npz" or "parquet" to also stream the results into two
+        # tables (see utils/columnar_writer.py), write_json=False skips the per-image JSON
+        self.columnar = columnar
+        self.write_json = write_json
+
+        # Results also go into this SQLite database if set, see utils/results_store.py
+        self.store_path = store_path
+
+        # The shaded crops are only kept (and handed out by iter_results) with
+        # keep_crops=True, otherwise each one is dropped once it's written.
+        # max_memory_mb is the memory ceiling of the run, see utils/memory_guard.py
+        self.keep_crops = keep_crops
+        self.max_memory_mb = max_memory_mb
+
+        # In combined mode the segmentation pass also produces the descriptions,
+        # so the IdentificationModel is never loaded
+        self.combined = combined
+
+        # Every stage shares one on-disk cache, so images seen in an earlier run
+        # come back without running the models again
+        cache = ResultCache(cache_dir, cache_size_mb * 1024 * 1024) if cache_dir else None
+
+        # write_mode is how the shaded objects and annotated images are stored,
+        # see utils/image_writer.py. backend / quantize pick PyTorch or ONNX
+        # Runtime for both YOLO models, see models/onnx_backend.py. seg_config and
+        # id_config are their InferenceConfigs, see models/inference_config.py.
+        # image_dir is where those images are written, by default a temporary
+        # directory of the models that goes away with the process
+        self.seg_model = SegmentationModel(write_mode, image_format, quality, cache, backend, quantize, seg_config,
+                                           keep_objects=keep_crops, image_dir=image_dir)
+        self.id_model = None if combined else IdentificationModel(write_mode, image_format, quality, cache,
+                                                                  backend, quantize, id_config, image_dir=image_dir)
+        self.txt_ext_model = TextExtractionModel(cache)
+        self.summ_model = None
+        if summarize:
+            self.summ_model = SummarizationModel(cache, llm_base_url, llm_api_key, llm_concurrency,
+                                                 llm_timeout, llm_retries, max_prompt_tokens)
+        self.data_mapping = DataMapping()
+
+    def process_batch(self, batch_images, with_crops=False):
+        """
+        Runs the models over one batch of ImageInputs and returns the mapped
+        dict of every image (what DataMapping.mapping returns), in order.
+        with_crops=True returns (final_dict, shaded crops) pairs instead.
+        """
+        # The YOLO models are fed the whole batch in one forward pass
+        if self.combined:
+            combined_outputs = self.seg_model.predict_combined_batch(batch_images, self.batch_size)
+            seg_outputs = [seg_data for seg_data, _ in combined_outputs]
+            id_outputs = [id_data for _, id_data in combined_outputs]
+        else:
+            seg_outputs = self.seg_model.predict_batch(batch_images, self.batch_size)
+            id_outputs = self.id_model.generate_descriptions_batch(batch_images, self.batch_size)
+
+        # OCR runs batched too, text detection over the whole batch at once
+        ocr_outputs = self.txt_ext_model.extract_text_batch(batch_images, self.ocr_batch_size, self.ocr_workers)
+
+        texts = [self.txt_ext_model.join_text(text_regions) for text_regions in ocr_outputs]
+
+        # The summaries of the whole batch are requested in parallel
+        summaries = [None] * len(batch_images)
+        if self.summ_model is not None:
+            summaries = self.summ_model.summarize_many([
+                (seg_data[1], id_data[0], text) for seg_data, id_data, text in zip(seg_outputs, id_outputs, texts)
+            ])
+
+        outputs = []
+        for image, seg_data, id_data, text_regions, text, summary in zip(
+                batch_images, seg_outputs, id_outputs, ocr_outputs, texts, summaries):
+            final_dict = self.data_mapping.mapping(seg_data, id_data, text, summary, image.master_id)
+            for master_data in final_dict.values():
+                master_data["text_regions"] = text_regions
+            outputs.append((final_dict, seg_data[0]) if with_crops else final_dict)
+        return outputs
+
+    def iter_results(self, img_paths):
+        """
+        Generator over img_paths that yields (img_path, final_dict, crops) one
+        image at a time, final_dict being the image's mapped result and crops its
+        shaded objects (an empty list unless keep_crops=True). Every result is
+        written to the outputs before it's yielded, and nothing is kept after
+        the caller moves on, so a run of any length stays within one batch's
+        worth of memory (and under max_memory_mb, if set).
+        """
+        outputs = ResultOutputs(self.output_dir, self.write_json, self.columnar, self.store_path)
+        guard = MemoryGuard(self.max_memory_mb, release=[self.flush], batch_size=self.batch_size)
+        batch_size = self.batch_size
+        start = 0
+        try:
+            while start < len(img_paths):
+                batch_size = guard.check(batch_size)
+                batch_paths = img_paths[start:start + batch_size]
+                start += len(batch_paths)
+
+                # Every image is decoded once and the same buffer goes to all the models
+                batch_images = [ImageInput.from_path(path) for path in batch_paths]
+                batch_outputs = self.process_batch(batch_images, with_crops=True)
+                del batch_images
+
+                # Popped one by one, so the crops of an image are gone as soon
+                # as the caller is done with them
+                batch_outputs.reverse()
+                for img_path in batch_paths:
+                    final_dict, crops = batch_outputs.pop()
+                    outputs.add(img_path, final_dict)
+                    yield img_path, final_dict, crops
+                    del final_dict, crops
+        finally:
+            # Only what this run opened is closed, the models and the LLM client
+            # stay usable until the owner calls close()
+            self.flush()
+            outputs.close()
+        if guard.peak_bytes:
+            print(f"[INFO] Peak resident memory {guard.peak_bytes / 1024 / 1024:.0f} MB")
+
+    def run(self, img_paths):
+        """
+        Runs the whole pipeline over img_paths and returns a dict of
+        master_id -> mapped result (the same dict DataMapping.mapping returns).
+        Keeps every result, use iter_results() for long runs.
+        """
+        all_results = dict()
+        for _, final_dict, _ in self.iter_results(img_paths):
+            all_results.update(final_dict)
+        return all_results
+
+    def flush(self):
+        # Make sure every image written in the background is on disk
+        self.seg_model.flush()
+        if self.id_model is not None:
+            self.id_model.flush()
+
+    def close(self):
+        self.flush()
+        if self.summ_model is not None:
+            self.summ_model.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ResultOutputs:
+    """
+    Where the mapped results of the images go: one JSON file per image, the
+    columnar tables and / or the SQLite store. Kept apart from the models so
+    the worker pool (utils/worker_pool.py) can write what its workers send back.
+    """
+    def __init__(self, output_dir="data/output", write_json=True, columnar=None, store_path=None) -> None:
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.write_json = write_json
+        self.columnar_writer = ColumnarWriter(output_dir, columnar) if columnar else None
+        self.store = ResultsStore(store_path) if store_path else None
+
+    def add(self, img_path, final_dict):
+        if self.write_json:
+            self.write_result(img_path, final_dict)
+        if self.columnar_writer is not None or self.store is not None:
+            records = records_from_mapping(final_dict)
+            if self.columnar_writer is not None:
+                for record in records:
+                    self.columnar_writer.write(record)
+            if self.store is not None:
+                self.store.add_records(records)
+
+    def write_result(self, img_path, final_dict):
+        master_id = os.path.basename(img_path).split('.')[0]
+        output_path = os.path.join(self.output_dir, f"{master_id}.json")
+        with open(output_path, "w") as f:
+            json.dump(final_dict, f, indent=4)
+        print(f"[INFO] Results saved to {output_path}")
+
+    def close(self):
+        if self.columnar_writer is not None:
+            self.columnar_writer.close()
+        if self.store is not None:
+            self.store.close()
+
+
+def iter_parallel(img_paths, pipeline_factory, workers, threads=None, batch_size=8, pin_cores=False, outputs=None):
+    """
+    Same as BatchPipeline.iter_results() but over `workers` processes, see
+    utils/worker_pool.py. pipeline_factory builds the BatchPipeline of a worker,
+    the results are written here, in the order of img_paths, and yielded as
+    (img_path, final_dict). Unless the write mode is "memory", give the
+    BatchPipeline an image_dir: the paths of the crops and annotated images
+    would otherwise point into the worker's temporary directory, which is gone
+    once the worker exits.
+    """
+    outputs = outputs or ResultOutputs()
+    try:
+        with WorkerPool(pipeline_factory, workers, threads, batch_size, pin_cores=pin_cores) as pool:
+            for img_path, final_dict in pool.imap(ImageInput.from_path(path) for path in img_paths):
+                outputs.add(img_path, final_dict)
+                yield img_path, final_dict
+    finally:
+        outputs.close()
+
+
+def run_parallel(img_paths, pipeline_factory, workers, threads=None, batch_size=8, pin_cores=False, outputs=None):
+    all_results = dict()
+    for _, final_dict in iter_parallel(img_paths, pipeline_factory, workers, threads, batch_size, pin_cores, outputs):
+        all_results.update(final_dict)
+    return all_results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the pipeline over a directory or glob of images")
+    parser.add_argument("source", help="Directory of images or a glob pattern")
+    parser.add_argument("--batch-size", type=int, default=8, help="Images per YOLO forward pass")
+    parser.add_argument("--output-dir", default="data/output", help="Where the per-image JSON files go")
+    parser.add_argument("--summarize", action="store_true", help="Also run the SummarizationModel")
+    parser.add_argument("--combined", action="store_true", help="Get detections from the segmentation pass instead of running the IdentificationModel")
+    parser.add_argument("--write-mode", choices=WRITE_MODES, default="sync", help="How segmented objects are written")
+    parser.add_argument("--image-format", default="jpg", help="Format of the written images (jpg, png, webp)")
+    parser.add_argument("--quality", type=int, default=95, help="Quality of the written images, 0-100")
+    parser.add_argument("--backend", choices=BACKENDS, default="torch", help="Run the YOLO models with PyTorch or ONNX Runtime")
+    parser.add_argument("--quantize", choices=QUANTIZE_MODES, default=None, help="INT8 quantization of the ONNX models")
+    parser.add_argument("--seg-config", type=InferenceConfig.from_string, default=None,
+                        help="Settings of the segmentation model, e.g. mode=tiled,imgsz=640,conf=0.25,classes=person;car")
+    parser.add_argument("--id-config", type=InferenceConfig.from_string, default=None,
+                        help="Settings of the identification model, same format as --seg-config")
+    parser.add_argument("--ocr-batch-size", type=int, default=8, help="Text regions recognized per EasyOCR batch")
+    parser.add_argument("--ocr-workers", type=int, default=0, help="EasyOCR data loader workers")
+    parser.add_argument("--llm-base-url", default=None, help="OpenAI compatible server for the summaries, e.g. http://localhost:8000/v1")
+    parser.add_argument("--llm-api-key", default=os.environ.get("LLM_API_KEY"), help="API key of --llm-base-url (default: $LLM_API_KEY)")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="Summaries requested at the same time")
+    parser.add_argument("--llm-timeout", type=float, default=60.0, help="Seconds before a summary request is retried")
+    parser.add_argument("--llm-retries", type=int, default=3, help="Retries of a failed summary request")
+    parser.add_argument("--max-prompt-tokens", type=int, default=1024, help="Token budget of one summarization prompt")
+    parser.add_argument("--columnar", choices=COLUMNAR_FORMATS, default=None, help="Also write the results as objects/images tables")
+    parser.add_argument("--no-json", action="store_true", help="Don't write the per-image JSON files")
+    parser.add_argument("--store", default=None, help="Also add the results to this SQLite database, e.g. data/results.db")
+    parser.add_argument("--metrics-jsonl", default=None, help="Write per-stage timings as JSON lines to this file")
+    parser.add_argument("--metrics-prom", default=None, help="Write aggregated metrics in the Prometheus text format to this file")
+    parser.add_argument("--profile", default=None, help="Comma separated stages to run cProfile on (or all), e.g. inference,ocr")
+    parser.add_argument("--profile-dir", default=None, help="Where the .prof files go (default data/profiles)")
+    parser.add_argument("--max-memory-mb", type=float, default=None, help="Memory ceiling of the run, batches shrink (and the run stops) when it's reached")
+    parser.add_argument("--workers", type=int, default=0, help="Worker processes, each with its own models (0 runs everything in this process)")
+    parser.add_argument("--threads-per-worker", type=int, default=None, help="Intra-op threads of every worker (default: the cores divided between the workers)")
+    parser.add_argument("--pin-cores", action="store_true", help="Pin every worker to its own cores")
+    parser.add_argument("--cache-dir", default=None, help="Cache stage outputs in this directory, e.g. data/cache")
+    parser.add_argument("--cache-size-mb", type=int, default=512, help="Size limit of the cache")
+    args = parser.parse_args()
+    if args.quantize and args.backend != "onnx":
+        parser.error("--quantize needs --backend onnx")
+    if args.max_memory_mb and args.workers:
+        parser.error("--max-memory-mb applies to a single process, with --workers memory is bounded by the images in flight")
+
+    img_paths = collect_image_paths(args.source)
+    if not img_paths:
+        print(f"[INFO] No images found for {args.source}")
+        return
+
+    metrics.configure_from_env(args.metrics_jsonl, args.metrics_prom,
+                               args.profile.split(",") if args.profile else None, args.profile_dir)
+
+    pipeline_args = (args.batch_size, args.output_dir, args.summarize, args.combined,
+                     args.write_mode, args.image_format, args.quality,
+                     args.cache_dir, args.cache_size_mb, args.ocr_batch_size, args.ocr_workers,
+                     args.llm_base_url, args.llm_api_key, args.llm_concurrency, args.llm_timeout,
+                     args.llm_retries, args.max_prompt_tokens, args.columnar, not args.no_json,
+                     args.store, args.backend, args.quantize, args.seg_config, args.id_config)
+
+    # The results are streamed to the outputs and not kept here, so memory stays
+    # flat however many images there are
+    start = time.perf_counter()
+    if args.workers:
+        # The temporary directory of a worker is deleted when the worker exits,
+        # the paths in its results have to point somewhere that outlives it
+        image_dir = os.path.join(args.output_dir, "images")
+        results = iter_parallel(img_paths, functools.partial(BatchPipeline, *pipeline_args, image_dir=image_dir), args.workers,
+                                args.threads_per_worker, args.batch_size, args.pin_cores,
+                                ResultOutputs(args.output_dir, not args.no_json, args.columnar, args.store))
+        for _ in results:
+            pass
+    else:
+        with BatchPipeline(*pipeline_args, max_memory_mb=args.max_memory_mb) as pipeline:
+            for _ in pipeline.iter_results(img_paths):
+                pass
+    elapsed = time.perf_counter() - start
+    print(f"[INFO] Processed {len(img_paths)} images in {elapsed:.2f}s ({len(img_paths) / elapsed:.2f} images/sec)")
+    metrics.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+    Columnar export of the pipeline results, for runs over a whole corpus where one
+    JSON file per image gets slow to write and slow to load back.
+
+    Results are written as two tables, streamed to disk while the pipeline runs:
+
+        objects: one row per segmented object
+                 master_id, obj_id, obj_name, obj_img_path, confidence, iou,
+                 seg_bbox (4 floats, [x, y, w, h]), id_bbox (4 floats, [x1, y1, x2, y2])
+        images:  one row per image
+                 master_id, master_image, text, summary, id_model_image_path, n_objects
+
+    With format="parquet" (needs pyarrow) every flush appends a row group to
+    objects.parquet and images.parquet. With format="npz" (only numpy) every flush
+    writes a new shard, objects-00000.npz, images-00000.npz and so on, since an npz
+    file can't be appended to. read_columnar() loads either one back.
+
+    Usage:
+        with ColumnarWriter("data/output", "parquet") as writer:
+            for record in records_from_mapping(final_dict):
+                writer.write(record)
+"""
+import os
+import glob
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+COLUMNAR_FORMATS = ("npz", "parquet")
+
+OBJECT_COLUMNS = ("master_id", "obj_id", "obj_name", "obj_img_path", "confidence", "iou", "seg_bbox", "id_bbox")
+IMAGE_COLUMNS = ("master_id", "master_image", "text", "summary", "id_model_image_path", "n_objects")
+
+
+class ColumnarWriter:
+    def __init__(self, output_dir, format="npz", rows_per_flush=10000) -> None:
+        if format not in COLUMNAR_FORMATS:
+            raise ValueError(f"format must be one of {COLUMNAR_FORMATS}, got {format!r}")
+        if format == "parquet" and pa is None:
+            raise ImportError("Writing parquet needs pyarrow: pip install pyarrow")
+
+        self.output_dir = output_dir
+        self.format = format
+        self.rows_per_flush = rows_per_flush
+        os.makedirs(output_dir, exist_ok=True)
+
+        # Rows waiting for the next flush, the boxes stay as (N, 4) arrays
+        self.objects = {name: [] for name in OBJECT_COLUMNS}
+        self.images = {name: [] for name in IMAGE_COLUMNS}
+        self.pending_objects = 0
+
+        self.shard = 0
+        self.parquet_writers = dict()
+
+    def write(self, record):
+        """
+        Adds one utils.records.ImageRecord, written out once rows_per_flush
+        objects have piled up.
+        """
+        n = len(record)
+        self.objects["master_id"].extend([record.master_id] * n)
+        self.objects["obj_id"].extend(record.obj_ids)
+        self.objects["obj_name"].extend(record.obj_names)
+        self.objects["obj_img_path"].extend(record.obj_img_paths)
+        self.objects["confidence"].append(record.confidences)
+        self.objects["iou"].append(record.ious)
+        self.objects["seg_bbox"].append(record.seg_boxes)
+        self.objects["id_bbox"].append(record.id_boxes)
+
+        self.images["master_id"].append(record.master_id)
+        self.images["master_image"].append(record.master_image)
+        self.images["text"].append(record.text)
+        self.images["summary"].append(record.summary)
+        self.images["id_model_image_path"].append(record.id_model_image_path)
+        self.images["n_objects"].append(n)
+
+        self.pending_objects += n
+        if self.pending_objects >= self.rows_per_flush:
+            self.flush()
+
+    def columns(self):
+        objects = dict()
+        for name in OBJECT_COLUMNS:
+            if name in ("confidence", "iou"):
+                objects[name] = np.concatenate(self.objects[name]).astype(np.float32)
+            elif name in ("seg_bbox", "id_bbox"):
+                objects[name] = np.concatenate(self.objects[name]).astype(np.float32).reshape(-1, 4)
+            else:
+                objects[name] = self.objects[name]
+        images = dict(self.images)
+        images["n_objects"] = np.array(images["n_objects"], dtype=np.int32)
+        return objects, images
+
+    def flush(self):
+        if not self.images["master_id"]:
+            return
+        objects, images = self.columns()
+        if self.format == "parquet":
+            self.write_parquet("objects", objects)
+            self.write_parquet("images", images)
+        else:
+            self.write_npz("objects", objects)
+            self.write_npz("images", images)
+            self.shard += 1
+
+        for rows in (self.objects, self.images):
+            for column in rows.values():
+                column.clear()
+        self.pending_objects = 0
+
+    def write_npz(self, table, columns):
+        arrays = dict()
+        for name, values in columns.items():
+            if isinstance(values, np.ndarray):
+                arrays[name] = values
+            else:
+                # None can't go in a fixed width string array, "" stands in for it
+                arrays[name] = np.array(["" if value is None else str(value) for value in values], dtype=np.str_)
+        path = os.path.join(self.output_dir, f"{table}-{self.shard:05d}.npz")
+        np.savez_compressed(path, **arrays)
+        print(f"[INFO] Wrote {path}")
+
+    def write_parquet(self, table, columns):
+        arrays = dict()
+        for name, values in columns.items():
+            if name in ("seg_bbox", "id_bbox"):
+                arrays[name] = pa.FixedSizeListArray.from_arrays(pa.array(values.reshape(-1)), 4)
+            elif isinstance(values, np.ndarray) and values.dtype == np.float32:
+                # NaN means "no match", store it as a proper null
+                arrays[name] = pa.array(values, mask=np.isnan(values))
+            else:
+                arrays[name] = pa.array(values)
+        pa_table = pa.table(arrays)
+
+        if table not in self.parquet_writers:
+            path = os.path.join(self.output_dir, f"{table}.parquet")
+            self.parquet_writers[table] = pq.ParquetWriter(path, pa_table.schema)
+        self.parquet_writers[table].write_table(pa_table)
+
+    def close(self):
+        self.flush()
+        for writer in self.parquet_writers.values():
+            writer.close()
+        self.parquet_writers = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_columnar(output_dir, table="objects"):
+    """
+    Loads one table back as a dict of column name -> numpy array, from
+    whichever format is in output_dir. Boxes are (N, 4) arrays.
+    """
+    parquet_path = os.path.join(output_dir, f"{table}.parquet")
+    if os.path.exists(parquet_path):
+        if pq is None:
+            raise ImportError("Reading parquet needs pyarrow: pip install pyarrow")
+        pa_table = pq.read_table(parquet_path)
+        columns = dict()
+        for name in pa_table.column_names:
+            column = pa_table.column(name)
+            if name in ("seg_bbox", "id_bbox"):
+                columns[name] = column.combine_chunks().flatten().to_numpy(zero_copy_only=False).reshape(-1, 4)
+            else:
+                columns[name] = column.to_numpy()
+        return columns
+
+    shards = sorted(glob.glob(os.path.join(output_dir, f"{table}-*.npz")))
+    if not shards:
+        raise FileNotFoundError(f"No {table} table in {output_dir}")
+    loaded = [np.load(path) for path in shards]
+    return {name: np.concatenate([shard[name] for shard in loaded]) for name in loaded[0].files}
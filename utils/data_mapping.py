@@ -7,51 +7,139 @@ import matplotlib.pyplot as plt
 from matplotlib.gridspec import GridSpec
 import pandas as pd
 import cv2
-from matplotlib.gridspec import GridSpec
+import numpy as np
 from tabulate import tabulate
 from matplotlib.font_manager import FontProperties
 from utils.visualization import shorten_path
+from utils import metrics
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """
+    IoU of every box in boxes_a (N, 4) with every box in boxes_b (M, 4), both in
+    [x1, y1, x2, y2] format. Returns an (N, M) array, computed with broadcasting.
+    """
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+
+    area_a = (boxes_a[:, 2:] - boxes_a[:, :2]).prod(axis=1)
+    area_b = (boxes_b[:, 2:] - boxes_b[:, :2]).prod(axis=1)
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-9), 0.0)
+
+
+def assign_boxes(iou, min_iou):
+    """
+    Optimal one to one assignment on an IoU matrix. Returns a list of (row, col)
+    pairs whose IoU is at least min_iou. Uses the Hungarian algorithm from scipy
+    and falls back to a greedy highest-IoU-first matching if scipy is missing.
+    """
+    if iou.size == 0:
+        return []
+
+    if linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(-iou)
+    else:
+        rows, cols = [], []
+        order = np.argsort(-iou, axis=None)
+        used_rows, used_cols = set(), set()
+        for row, col in zip(*np.unravel_index(order, iou.shape)):
+            if row not in used_rows and col not in used_cols:
+                used_rows.add(row)
+                used_cols.add(col)
+                rows.append(row)
+                cols.append(col)
+
+    return [(int(row), int(col)) for row, col in zip(rows, cols) if iou[row, col] >= min_iou]
+
 
 class DataMapping:
-    def __init__(self) -> None:
-        pass
+    def __init__(self, min_iou=0.1) -> None:
+        # A segmented object and a description are only paired if their
+        # boxes overlap at least this much
+        self.min_iou = min_iou
 
-    def mapping(self, seg_mode_data: tuple, id_model_data, txt_ext_model_data: str, summ_model_data: str):
+    def mapping(self, seg_mode_data: tuple, id_model_data, txt_ext_model_data: str, summ_model_data: str,
+                master_id=None):
         """
         SegmentationModel data -> Tuple of segmented objects and object metadata
         IdentificationModel data -> Descriptions of objects
         TextExtractionModel data -> Extracted text from image
+
+        Segmented objects are paired with descriptions by the IoU of obj_seg_bbox
+        and obj_id_bbox (optimal assignment), not by their position in the lists.
+        Segmented objects without a matching description are kept with None for
+        the identification fields, descriptions without a matching segmented
+        object end up in "unmatched_descriptions".
+
+        master_id is the key of the image in the returned dict, it's taken from
+        the segmented objects when there are any. An image without segmented
+        objects still gets its entry (no entries, all the descriptions unmatched,
+        the text and summary) as long as master_id is given.
         """
-        final_data = []
+        with metrics.stage("mapping") as span:
+            final_dict = self.map_objects(seg_mode_data, id_model_data, txt_ext_model_data, summ_model_data,
+                                          master_id)
+            span.count(objects=sum(len(master_data["entries"]) for master_data in final_dict.values()))
+        return final_dict
+
+    def map_objects(self, seg_mode_data, id_model_data, txt_ext_model_data, summ_model_data, master_id=None):
         segmented_objects, obj_metadata = seg_mode_data
         final_dict = dict()
 
         desc, id_model_image_path = id_model_data
 
-        master_id = None
-
         # While all are generated according to segmented objects the TextExtractionModel using EasyOCR
         # generates text all at once
-        for (segmented_image, seg_obj_metdata, desc) in zip(segmented_objects, obj_metadata, desc):
-            object_id = seg_obj_metdata['object_id']
-            object_img_path = seg_obj_metdata['object_img_path']
-            object_seg_bbox = seg_obj_metdata['obj_seg_bbox']
-            master_image = seg_obj_metdata['master_image']
-
-            object_name = desc['object_class']
-            confidence = desc['conf']
-            obj_id_bbox = desc['obj_id_bbox']
+        if not obj_metadata:
+            if master_id is not None:
+                final_dict[master_id] = {
+                    "entries": [],
+                    "text": txt_ext_model_data,
+                    "summary": summ_model_data,
+                    "id_model_image_path": id_model_image_path,
+                    "unmatched_descriptions": list(desc),
+                }
+            return final_dict
+
+        # obj_seg_bbox is [x, y, w, h] while obj_id_bbox is [x1, y1, x2, y2]
+        seg_boxes = np.array([seg_obj_metdata['obj_seg_bbox'] for seg_obj_metdata in obj_metadata], dtype=np.float32)
+        seg_boxes[:, 2:] += seg_boxes[:, :2]
+        id_boxes = np.array([d['obj_id_bbox'] for d in desc], dtype=np.float32).reshape(-1, 4)
+
+        iou = iou_matrix(seg_boxes, id_boxes)
+        matches = dict(assign_boxes(iou, self.min_iou))
+
+        for seg_idx, seg_obj_metdata in enumerate(obj_metadata):
             master_id = seg_obj_metdata['master_id']
 
             new_entry = {
-                "obj_id": object_id,
-                "obj_img_path": object_img_path,
-                "obj_seg_bbox": object_seg_bbox,
-                "master_image": master_image,
-                "obj_name": object_name,
-                "confidence": confidence,
-                "obj_id_bbox": obj_id_bbox,
+                "obj_id": seg_obj_metdata['object_id'],
+                "obj_img_path": seg_obj_metdata['object_img_path'],
+                "obj_seg_bbox": seg_obj_metdata['obj_seg_bbox'],
+                "master_image": seg_obj_metdata['master_image'],
+                "obj_name": None,
+                "confidence": None,
+                "obj_id_bbox": None,
+                "iou": None,
             }
+
+            if seg_idx in matches:
+                id_idx = matches[seg_idx]
+                new_entry["obj_name"] = desc[id_idx]['object_class']
+                new_entry["confidence"] = desc[id_idx]['conf']
+                new_entry["obj_id_bbox"] = desc[id_idx]['obj_id_bbox']
+                new_entry["iou"] = round(float(iou[seg_idx, id_idx]), 3)
+
             if master_id in final_dict:
                 final_dict[master_id]['entries'].append(new_entry)
             else:
@@ -61,15 +149,28 @@ class DataMapping:
                     "summary": summ_model_data,
                     "id_model_image_path": id_model_image_path
                 }
+
+        matched_descriptions = set(matches.values())
+        unmatched = [d for id_idx, d in enumerate(desc) if id_idx not in matched_descriptions]
+        final_dict[master_id]["unmatched_descriptions"] = unmatched
         return final_dict
 
-    def visualize(self, final_dict, img_path):
+    def visualize(self, final_dict, img_path, annotated_image=None):
         """
         Visualize the original image with annotations and a table summarizing all data.
+
+        annotated_image is the BGR annotated image (e.g. result.plot()) when it's
+        already in memory, otherwise it's read from the id_model_image_path the
+        IdentificationModel saved. In "memory" output mode nothing is saved, so
+        it has to be passed then.
         """
         # Load the original image
-        id_model_image_path = list(final_dict.values())[0]['id_model_image_path']
-        annotated_image = cv2.imread(id_model_image_path)
+        if annotated_image is None:
+            id_model_image_path = list(final_dict.values())[0]['id_model_image_path']
+            if id_model_image_path is None:
+                raise ValueError("No annotated image to visualize: the models ran in \"memory\" output mode, "
+                                 "which doesn't save one. Pass it as annotated_image instead")
+            annotated_image = cv2.imread(id_model_image_path)
         annotated_image = cv2.cvtColor(annotated_image, cv2.COLOR_BGR2RGB)
 
         # Create a DataFrame for the table
@@ -121,20 +222,14 @@ if __name__ == "__main__":
 
     img_path = "data/input_images/000000000025.jpg"
 
-    seg_model = SegmentationModel()
-    segmented_objects, obj_metadata = seg_model.predict(img_path)
-
-    id_model = IdentificationModel()
-    desc, id_model_image_path = id_model.generate_descriptions(img_path)
-
-    txt_ext_model = TextExtractionModel()
-    text = txt_ext_model.extract_text(img_path)
+    # Segmentation, identification and text extraction run at the same time,
+    # mapping and summarization start as soon as those three are done
+    from utils.pipeline import build_pipeline
 
-    summ_model = SummarizationModel()
-    summ_model_data = summ_model.summarize(obj_metadata, desc, text)
+    with build_pipeline() as pipeline:
+        final_dict = pipeline.run({"img_path": img_path})["result"]
 
     data_mapping = DataMapping()
-    final_dict = data_mapping.mapping((segmented_objects, obj_metadata), (desc, id_model_image_path), text, summ_model_data)
 
     # Visualize the final output
-    data_mapping.visualize(final_dict, img_path)
\ No newline at end of file
+    data_mapping.visualize(final_dict, img_path)
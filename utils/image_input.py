@@ -0,0 +1,145 @@
+"""
+    ImageInput holds an image decoded once, plus the views the models derive from
+    it (grayscale, resized versions), each computed on first use and cached.
+
+    Every model accepts an ImageInput wherever it accepts an image path, so the
+    pipeline decodes a file once and hands the same buffer to segmentation,
+    identification and OCR instead of each of them reading the file again.
+
+        image = ImageInput.from_path("data/input_images/000000000025.jpg")
+        SegmentationModel().predict(image)
+        TextExtractionModel().extract_text(image)
+
+    The decoded buffer is made read-only, since it is shared, and views like
+    rgb are numpy views on it and not copies.
+"""
+import os
+import cv2
+import numpy as np
+
+from utils.result_cache import hash_bytes, hash_file
+from utils import metrics
+
+
+class ImageInput:
+    def __init__(self, bgr, path=None, name=None, data=None) -> None:
+        """
+        bgr is the decoded image as cv2 gives it. path is the file it came from,
+        if any, and name is used for the master_id when there is no path. data
+        are the encoded bytes, when known, so that hashing doesn't touch the disk.
+        """
+        if bgr is None:
+            raise ValueError("ImageInput needs a decoded image")
+
+        # A read-only view, the caller's own array stays writable
+        self.bgr = bgr.view()
+        self.bgr.flags.writeable = False
+        self.path = os.path.abspath(path) if path is not None else None
+        self.name = name
+        self.data = data
+
+        self._gray = None
+        self._resized = dict()
+        self._content_hash = None
+
+    @classmethod
+    def from_path(cls, path):
+        try:
+            with metrics.stage("decode"):
+                bgr = cv2.imread(os.path.abspath(path))
+        except Exception as e:
+            # if can't load image, raise an error
+            raise ValueError(f"Unable to load image file due to error: {e}")
+
+        if bgr is None:
+            raise ValueError(f"Unable to load image file {path}")
+        return cls(bgr, path=path)
+
+    @classmethod
+    def from_bytes(cls, data, name=None, path=None):
+        """
+        Decode an encoded image (e.g. an upload) without writing it to disk first.
+        """
+        with metrics.stage("decode"):
+            bgr = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if bgr is None:
+            raise ValueError("Unable to decode image bytes")
+        return cls(bgr, path=path, name=name, data=bytes(data))
+
+    @property
+    def master_id(self):
+        # Name of the original image without the extension
+        name = self.path or self.name
+        if name is None:
+            return self.content_hash[:16]
+        return os.path.basename(name).split('.')[0]
+
+    @property
+    def shape(self):
+        return self.bgr.shape
+
+    @property
+    def rgb(self):
+        # A view with the channels reversed, nothing is copied
+        return self.bgr[..., ::-1]
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY)
+            self._gray.flags.writeable = False
+        return self._gray
+
+    def resized(self, size, gray=False):
+        """
+        The image (or its grayscale version) resized to size = (width, height), cached.
+        """
+        key = (tuple(size), gray)
+        if key not in self._resized:
+            resized = cv2.resize(self.gray if gray else self.bgr, tuple(size))
+            resized.flags.writeable = False
+            self._resized[key] = resized
+        return self._resized[key]
+
+    def reduced(self, scale):
+        """
+        The image downscaled by scale (0.5 = half the width and height), cached.
+        Area interpolation, so small details average out instead of aliasing.
+        """
+        key = ("reduced", scale)
+        if key not in self._resized:
+            height, width = self.bgr.shape[:2]
+            size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+            reduced = cv2.resize(self.bgr, size, interpolation=cv2.INTER_AREA)
+            reduced.flags.writeable = False
+            self._resized[key] = reduced
+        return self._resized[key]
+
+    @property
+    def content_hash(self):
+        """
+        Hash of the image content, the same one utils.result_cache.hash_file
+        gives for the file, so cache keys don't depend on how the image came in.
+        """
+        if self._content_hash is None:
+            if self.data is not None:
+                self._content_hash = hash_bytes(self.data)
+            elif self.path is not None and os.path.exists(self.path):
+                self._content_hash = hash_file(self.path)
+            else:
+                self._content_hash = hash_bytes(str(self.bgr.shape).encode("utf-8") + self.bgr.tobytes())
+        return self._content_hash
+
+
+def as_image_input(image):
+    """
+    Turns whatever the models were given (a path, an ImageInput or a decoded
+    BGR array) into an ImageInput.
+    """
+    if isinstance(image, ImageInput):
+        return image
+    if isinstance(image, np.ndarray):
+        return ImageInput(image)
+    if isinstance(image, (str, os.PathLike)):
+        return ImageInput.from_path(image)
+    raise ValueError(f"Unable to load image from {image!r}")
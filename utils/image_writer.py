@@ -0,0 +1,125 @@
+"""
+    ImageWriter takes care of getting the images produced by the models (shaded
+    segmented objects, annotated outputs) out of the inference loop.
+
+    It has three modes:
+        "sync"   - encode and write right away, this is how it always worked
+        "async"  - hand the image to a small background thread pool and return
+                   the path immediately, call flush() before reading the files
+        "memory" - don't write anything, the images stay in memory as arrays
+                   and are only encoded when someone asks for the bytes
+
+    Format and quality are configurable, e.g. ImageWriter(dir, image_format="webp", quality=80)
+"""
+import os
+import cv2
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import metrics
+
+
+WRITE_MODES = ("sync", "async", "memory")
+
+
+class ImageWriter:
+    def __init__(self, output_dir, mode="sync", image_format="jpg", quality=95, max_workers=2,
+                 max_pending=64) -> None:
+        if mode not in WRITE_MODES:
+            raise ValueError(f"Unknown write mode {mode}, should be one of {WRITE_MODES}")
+
+        self.output_dir = output_dir
+        self.mode = mode
+        if mode != "memory":
+            os.makedirs(output_dir, exist_ok=True)
+        self.image_format = image_format.lower().lstrip(".")
+        self.quality = quality
+        self.max_workers = max_workers
+
+        # Every queued async write holds its image, so when the disk can't keep
+        # up write() waits once max_pending are queued instead of piling them up
+        self.max_pending = max_pending
+
+        self.executor = None
+        self.pending = []
+
+    def encode_params(self):
+        """
+        cv2 parameters for the configured format and quality (0-100).
+        """
+        if self.image_format in ("jpg", "jpeg"):
+            return [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        if self.image_format == "webp":
+            return [cv2.IMWRITE_WEBP_QUALITY, self.quality]
+        if self.image_format == "png":
+            # png is lossless, map quality to compression level 9 (smallest) .. 0 (fastest)
+            return [cv2.IMWRITE_PNG_COMPRESSION, max(0, min(9, (100 - self.quality) // 10))]
+        return []
+
+    def path_for(self, name):
+        return os.path.join(self.output_dir, f"{name}.{self.image_format}")
+
+    def encode(self, image):
+        """
+        Encode a BGR image to bytes in the configured format.
+        """
+        ok, buffer = cv2.imencode(f".{self.image_format}", image, self.encode_params())
+        if not ok:
+            raise ValueError(f"Unable to encode image as {self.image_format}")
+        return buffer.tobytes()
+
+    def write(self, name, image):
+        """
+        Write `image` as `name` in the output directory.
+
+        Returns the path the image is (or will be, in async mode) written to,
+        or None in memory mode since nothing is written at all.
+        """
+        if self.mode == "memory":
+            return None
+
+        path = self.path_for(name)
+        if self.mode == "sync":
+            self.write_file(path, image)
+        else:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="image_writer")
+            self.wait_pending(self.max_pending - 1)
+            self.pending.append(self.executor.submit(self.write_file, path, image))
+        return path
+
+    def write_file(self, path, image):
+        # cv2.imwrite releases the GIL while encoding, so the writer threads
+        # don't hold the inference loop back
+        with metrics.stage("disk_write", format=self.image_format, mode=self.mode) as span:
+            if not cv2.imwrite(path, image, self.encode_params()):
+                raise IOError(f"Unable to write image to {path}")
+            span.count(images=1)
+
+    def wait_pending(self, limit):
+        """
+        Forgets the finished writes (re-raising their errors) and waits for the
+        oldest ones until at most limit are left.
+        """
+        pending = []
+        for future in self.pending:
+            if future.done():
+                future.result()
+            else:
+                pending.append(future)
+        while len(pending) > limit:
+            pending.pop(0).result()
+        self.pending = pending
+
+    def flush(self):
+        """
+        Wait for every pending async write, re-raising the first error if any.
+        """
+        pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+
+    def close(self):
+        self.flush()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
@@ -0,0 +1,359 @@
+"""
+    Async chat completion client used by the SummarizationModel.
+
+    One LLMClient is kept for the whole run instead of building a new client per
+    summary, so the HTTP connections are pooled and reused. On top of that it:
+
+    - caps the number of requests in flight with a semaphore (max_concurrency)
+    - gives every request a timeout and retries failed ones with exponential backoff,
+      as long as the failure can go away on its own, see is_retryable()
+    - keeps the responses in memory (and optionally in a ResultCache) keyed on the
+      normalized prompt, so the same prompt is only ever sent once
+
+    With base_url set, requests go to an OpenAI compatible /chat/completions
+    endpoint (a local llama.cpp / vLLM / Ollama server or a mock of one) through
+    httpx. Without it the free gpt4free AsyncClient is used, like before.
+
+    stream() gives the response piece by piece as it arrives (server sent events
+    with "stream": true), so the first words can be shown long before the whole
+    summary is done.
+
+    Usage:
+        client = LLMClient(base_url="http://localhost:8000/v1", max_concurrency=8)
+        summaries = client.complete_many_sync(prompts)       # from plain code
+        summaries = await client.complete_many(prompts)      # from async code
+        for piece in client.stream_sync(prompt): print(piece, end="")
+"""
+import re
+import json
+import time
+import random
+import asyncio
+import threading
+from collections import OrderedDict
+
+from utils.result_cache import hash_bytes, package_version
+from utils import metrics
+
+
+def normalize_prompt(prompt):
+    # Whitespace differences (like the indentation of the instructions) don't
+    # change the answer, so they shouldn't change the cache key either
+    return re.sub(r"\s+", " ", prompt).strip()
+
+
+class LLMError(RuntimeError):
+    pass
+
+
+def is_retryable(error):
+    """
+    Only timeouts, connection errors, rate limiting (429) and server errors (5xx)
+    are worth another attempt. Any other 4xx means the request itself is wrong,
+    sending it again gets the same answer.
+    """
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    try:
+        import httpx
+    except ImportError:
+        return False
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+class LLMClient:
+    def __init__(self, model_name="gpt-3.5-turbo", base_url=None, api_key=None, max_concurrency=4,
+                 timeout=60.0, retries=3, backoff=1.0, cache=None, memory_entries=1024) -> None:
+        self.model_name = model_name
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+        # Optional utils.result_cache.ResultCache, so responses survive between runs
+        self.cache = cache
+        self.memory = OrderedDict()
+        self.memory_entries = memory_entries
+        self.lock = threading.Lock()
+
+        # The semaphore and the connection pool belong to an event loop, they
+        # are (re)created for whichever loop is running the requests
+        self.loop = None
+        self.semaphore = None
+        self.session = None
+
+        # Event loop thread used by the *_sync methods, started on first use
+        self.runner = None
+
+    def cache_key(self, prompt):
+        # The response depends on the server and the model answering it, not on
+        # the HTTP library that fetched it
+        backend = self.base_url or f"g4f-{package_version('g4f')}"
+        version = f"{backend}|{self.model_name}"
+        content_hash = hash_bytes(normalize_prompt(prompt).encode("utf-8"))
+        if self.cache is not None:
+            return self.cache.make_key(content_hash, "summarization", self.model_name, version)
+        return hash_bytes(f"{content_hash}|{version}".encode("utf-8"))
+
+    def backend_name(self):
+        return "openai_compatible" if self.base_url else "g4f"
+
+    def get_cached(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+        if self.cache is not None:
+            response = self.cache.get(key)
+            if response is not None:
+                self.remember(key, response)
+                return response
+        return None
+
+    def remember(self, key, response):
+        with self.lock:
+            self.memory[key] = response
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_entries:
+                self.memory.popitem(last=False)
+
+    def store(self, key, response):
+        self.remember(key, response)
+        if self.cache is not None:
+            self.cache.put(key, response)
+
+    async def get_session(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # A pool opened on another loop can't be used from this one, it's
+            # closed instead of leaking its connections
+            old_session, old_loop = self.session, self.loop
+            self.loop = loop
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.session = self.open_session()
+            await self.close_session(old_session, old_loop)
+        return self.session
+
+    async def close_session(self, session, loop):
+        if session is None or not hasattr(session, "aclose"):
+            return
+        if loop is not None and loop.is_running() and loop is not asyncio.get_running_loop():
+            # Still in use by its own loop (e.g. the runner), close it there
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(session.aclose(), loop))
+            return
+        try:
+            await session.aclose()
+        except RuntimeError:
+            # Its loop is closed already and the connections went with it
+            pass
+
+    def open_session(self):
+        if self.base_url:
+            import httpx
+
+            headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+            limits = httpx.Limits(max_connections=self.max_concurrency,
+                                  max_keepalive_connections=self.max_concurrency)
+            return httpx.AsyncClient(base_url=self.base_url, headers=headers, limits=limits,
+                                     timeout=self.timeout)
+
+        from g4f.client import AsyncClient
+        return AsyncClient()
+
+    async def request(self, session, prompt):
+        messages = [{"role": "user", "content": prompt}]
+        if self.base_url:
+            response = await session.post("/chat/completions", json={"model": self.model_name, "messages": messages})
+            response.raise_for_status()
+            return response.json()["choices"][0]["message"]["content"]
+
+        response = await asyncio.wait_for(
+            session.chat.completions.create(model=self.model_name, messages=messages),
+            self.timeout,
+        )
+        return response.choices[0].message.content
+
+    async def request_stream(self, session, prompt):
+        messages = [{"role": "user", "content": prompt}]
+        if self.base_url:
+            payload = {"model": self.model_name, "messages": messages, "stream": True}
+            async with session.stream("POST", "/chat/completions", json=payload) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    piece = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                    if piece:
+                        yield piece
+            return
+
+        async for chunk in session.chat.completions.create(model=self.model_name, messages=messages, stream=True):
+            piece = chunk.choices[0].delta.content
+            if piece:
+                yield piece
+
+    async def wait_before_retry(self, attempt):
+        # Exponential backoff with a bit of jitter so parallel requests
+        # that failed together don't all retry at the same moment
+        delay = self.backoff * 2 ** (attempt - 1)
+        await asyncio.sleep(delay + random.uniform(0, delay / 2))
+
+    async def complete(self, prompt):
+        """
+        Returns the response to prompt, from the cache if it has been seen before.
+        Raises LLMError once all the retries have failed.
+        """
+        key = self.cache_key(prompt)
+        response = self.get_cached(key)
+        if response is not None:
+            metrics.record("llm_call", 0.0, {"cache_hits": 1}, backend=self.backend_name())
+            return response
+
+        session = await self.get_session()
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await self.wait_before_retry(attempt)
+            try:
+                async with self.semaphore:
+                    with metrics.stage("llm_call", backend=self.backend_name()) as span:
+                        response = await self.request(session, prompt)
+                        span.count(prompt_chars=len(prompt), response_chars=len(response), attempts=attempt + 1)
+                break
+            except Exception as e:
+                error = e
+                print(f"[INFO] LLM request failed (attempt {attempt + 1}/{self.retries + 1}): {e!r}")
+                if not is_retryable(e):
+                    raise LLMError(f"LLM request failed: {e!r}") from e
+        else:
+            raise LLMError(f"LLM request failed after {self.retries + 1} attempts") from error
+
+        self.store(key, response)
+        return response
+
+    async def stream(self, prompt):
+        """
+        Async iterator over the pieces of the response as they arrive. A cached
+        response comes back in one piece. Failures before the first piece are
+        retried like in complete(), after that the response can't be restarted
+        so LLMError is raised straight away.
+        """
+        key = self.cache_key(prompt)
+        response = self.get_cached(key)
+        if response is not None:
+            yield response
+            return
+
+        session = await self.get_session()
+        pieces = []
+        error = None
+        start = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await self.wait_before_retry(attempt)
+            try:
+                async with self.semaphore:
+                    stream = self.request_stream(session, prompt)
+                    try:
+                        while True:
+                            # The timeout is for every piece, a long answer is fine as long as it keeps coming
+                            try:
+                                piece = await asyncio.wait_for(stream.__anext__(), self.timeout)
+                            except StopAsyncIteration:
+                                break
+                            if not pieces:
+                                # Time to the first piece is what the user waits for
+                                metrics.record("llm_first_piece", time.perf_counter() - start, backend=self.backend_name())
+                            pieces.append(piece)
+                            yield piece
+                    finally:
+                        # A piece that timed out leaves the request open, close it
+                        # before the next attempt opens another one
+                        await stream.aclose()
+                break
+            except Exception as e:
+                if pieces:
+                    raise LLMError("LLM stream broke off in the middle of the response") from e
+                error = e
+                print(f"[INFO] LLM stream failed (attempt {attempt + 1}/{self.retries + 1}): {e!r}")
+                if not is_retryable(e):
+                    raise LLMError(f"LLM request failed: {e!r}") from e
+        else:
+            raise LLMError(f"LLM request failed after {self.retries + 1} attempts") from error
+
+        response = "".join(pieces)
+        metrics.record("llm_stream", time.perf_counter() - start,
+                       {"prompt_chars": len(prompt), "response_chars": len(response), "pieces": len(pieces)},
+                       backend=self.backend_name())
+        self.store(key, response)
+
+    async def complete_many(self, prompts):
+        """
+        Sends all the prompts at once (at most max_concurrency in flight) and
+        returns the responses in the same order. Identical prompts are only sent once.
+        """
+        unique = dict()
+        for prompt in prompts:
+            unique.setdefault(normalize_prompt(prompt), prompt)
+        responses = await asyncio.gather(*(self.complete(prompt) for prompt in unique.values()))
+        by_prompt = dict(zip(unique, responses))
+        return [by_prompt[normalize_prompt(prompt)] for prompt in prompts]
+
+    def run(self, coro):
+        """
+        Runs coro on the client's own event loop and waits for the result, so
+        plain (non async) code shares one connection pool between calls
+        instead of opening a new one with every asyncio.run().
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.start_runner()).result()
+
+    def start_runner(self):
+        with self.lock:
+            if self.runner is None:
+                self.runner = asyncio.new_event_loop()
+                threading.Thread(target=self.runner.run_forever, daemon=True).start()
+        return self.runner
+
+    def complete_sync(self, prompt):
+        return self.run(self.complete(prompt))
+
+    def complete_many_sync(self, prompts):
+        return self.run(self.complete_many(prompts))
+
+    def stream_sync(self, prompt):
+        """
+        Plain generator version of stream(), every piece is fetched on the
+        client's event loop.
+        """
+        pieces = self.stream(prompt)
+        try:
+            while True:
+                try:
+                    yield self.run(pieces.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            # Stopped early, let the request clean up on its own loop
+            self.run(pieces.aclose())
+
+    async def aclose(self):
+        session, loop = self.session, self.loop
+        self.session = None
+        self.loop = None
+        await self.close_session(session, loop)
+
+    def close(self):
+        if self.runner is not None:
+            if self.loop is self.runner:
+                self.run(self.aclose())
+            self.runner.call_soon_threadsafe(self.runner.stop)
+            self.runner = None
+
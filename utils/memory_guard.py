@@ -0,0 +1,106 @@
+"""
+    Memory ceiling for long batch runs. Before every batch the pipeline asks
+    MemoryGuard.check() which batch size to use:
+
+        - under the ceiling, the same one
+        - over it, the memory that can be given back is released first (the
+          background image writes are flushed, the garbage collector runs and
+          glibc is asked to return freed pages to the OS) and if that isn't
+          enough the batch size is halved
+        - still over it with batches of one image, MemoryLimitExceeded is raised
+          instead of letting the machine start swapping or the OOM killer step in
+        - back under grow_below of the ceiling after it shrank, the batch size
+          doubles again, up to the batch size the run started with. The margin
+          keeps it from growing right back into the ceiling
+
+        guard = MemoryGuard(max_mb=4096, release=[seg_model.flush], batch_size=8)
+        batch_size = guard.check(batch_size)
+
+    Resident memory comes from utils.metrics.rss_bytes(), where it can't be read
+    (no /proc and no psutil) the ceiling isn't enforced.
+"""
+import gc
+import ctypes
+import ctypes.util
+
+from utils import metrics
+
+
+class MemoryLimitExceeded(MemoryError):
+    pass
+
+
+def trim_heap():
+    """
+    Hands the freed heap pages back to the OS (glibc only), otherwise the
+    resident memory stays at its peak even after the arrays are gone.
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6")
+        libc.malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def release_memory(release=()):
+    for fn in release:
+        fn()
+    gc.collect()
+    trim_heap()
+
+
+class MemoryGuard:
+    # Share of the ceiling the memory has to be under for the batches to grow back
+    grow_below = 0.8
+
+    def __init__(self, max_mb=None, release=None, batch_size=None) -> None:
+        """
+        max_mb is the ceiling of the process' resident memory, None for no
+        ceiling. release are callables that free memory (e.g. flush writers).
+        batch_size is the largest batch size check() grows back to, by
+        default the one of the first check().
+        """
+        self.max_bytes = int(max_mb * 1024 * 1024) if max_mb else None
+        self.release = list(release or [])
+        self.batch_size = batch_size
+        self.peak_bytes = 0
+        self.rss = None
+        if self.max_bytes is not None and metrics.rss_bytes() is None:
+            print("[INFO] Can't read the memory in use on this system, the memory ceiling is not enforced")
+            self.max_bytes = None
+
+    def over(self):
+        self.rss = metrics.rss_bytes()
+        if self.rss is None:
+            return False
+        self.peak_bytes = max(self.peak_bytes, self.rss)
+        return self.rss > self.max_bytes
+
+    def check(self, batch_size):
+        """
+        Returns the batch size to use for the next batch, see the top of the file.
+        """
+        if self.batch_size is None:
+            self.batch_size = batch_size
+        if self.max_bytes is None:
+            return batch_size
+        if not self.over():
+            return self.grow(batch_size)
+
+        release_memory(self.release)
+        if not self.over():
+            return batch_size
+
+        limit_mb = self.max_bytes / 1024 / 1024
+        if batch_size > 1:
+            print(f"[INFO] Over the memory ceiling of {limit_mb:.0f} MB, batch size {batch_size} -> {batch_size // 2}")
+            return batch_size // 2
+        raise MemoryLimitExceeded(f"{metrics.rss_bytes() / 1024 / 1024:.0f} MB in use, over the ceiling of "
+                                  f"{limit_mb:.0f} MB even with one image per batch")
+
+    def grow(self, batch_size):
+        if batch_size >= self.batch_size or self.rss is None or self.rss > self.max_bytes * self.grow_below:
+            return batch_size
+        grown = min(batch_size * 2, self.batch_size)
+        print(f"[INFO] Back under the memory ceiling, batch size {batch_size} -> {grown}")
+        return grown
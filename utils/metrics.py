@@ -0,0 +1,420 @@
+"""
+    Instrumentation of the hot paths of the pipeline.
+
+    The interesting parts of the code (model loading, decoding, preprocessing,
+    inference, crop extraction, disk writes, OCR, LLM calls, mapping) are wrapped in
+
+        with metrics.stage("inference", model="segmentation") as span:
+            results = self.model.predict(images)
+            span.count(images=len(images), objects=...)
+
+    which records how long the block took, the counts set on the span, the change
+    in resident memory of the process and whether it raised. Every record is an
+    event dict handed to the sinks that were added:
+
+        JsonLinesSink       one JSON object per line, for later analysis
+        PrometheusTextSink  aggregated histograms and counters in the Prometheus
+                            text format, for the node_exporter textfile collector
+        MemorySink          keeps the events in a list (tests, benchmarks)
+
+    With no sink and no profiler nothing is measured at all, so the
+    instrumentation costs next to nothing when it's not used.
+
+    A profile hook can be set to run a profiler around chosen stages, CProfileHook
+    writes a .prof file per call (open it with snakeviz or pstats).
+
+    Memory deltas are of the whole process, with several stages running in
+    parallel threads they include what the other threads allocated meanwhile.
+
+    Usage:
+        metrics.configure(jsonl="data/metrics.jsonl", prometheus="data/metrics.prom",
+                          profile_stages=["inference"], profile_dir="data/profiles")
+    or set PIPELINE_METRICS_JSONL, PIPELINE_METRICS_PROM, PIPELINE_PROFILE_STAGES and
+    PIPELINE_PROFILE_DIR and call metrics.configure_from_env(), which also takes
+    the same arguments as configure() and uses the environment for the ones left out.
+"""
+import os
+import json
+import time
+import bisect
+import cProfile
+import threading
+from contextlib import contextmanager
+
+
+_sinks = []
+_profile_hook = None
+_lock = threading.Lock()
+
+# Profilers don't nest, only the outermost profiled stage of a thread is profiled
+_local = threading.local()
+
+try:
+    _page_size = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _page_size = None
+
+
+def rss_bytes():
+    """
+    Current resident memory of the process, None where we can't tell.
+    """
+    if _page_size is not None:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * _page_size
+        except OSError:
+            pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+class Span:
+    __slots__ = ("counts",)
+
+    def __init__(self) -> None:
+        self.counts = dict()
+
+    def count(self, **counts):
+        self.counts.update(counts)
+
+
+class NullSpan:
+    # Handed out when nobody is listening
+    __slots__ = ()
+
+    def count(self, **counts):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def is_active():
+    return bool(_sinks) or _profile_hook is not None
+
+
+@contextmanager
+def stage(name, **labels):
+    """
+    Times the block and emits an event for the stage `name`. labels are added
+    to the event as they are (model name, output format and such).
+    """
+    if not is_active():
+        yield NULL_SPAN
+        return
+
+    span = Span()
+    profiler = start_profiler(name)
+    rss_start = rss_bytes()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield span
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        stop_profiler(profiler)
+        rss_end = rss_bytes()
+        record(name, duration, span.counts, error=error,
+               rss_bytes=rss_end, rss_delta_bytes=None if rss_start is None or rss_end is None else rss_end - rss_start,
+               **labels)
+
+
+def record(name, duration, counts=None, error=None, rss_bytes=None, rss_delta_bytes=None, **labels):
+    """
+    Emits an event for a duration (in seconds) measured somewhere else, e.g.
+    the preprocess / inference times ultralytics reports per image.
+    """
+    if not _sinks:
+        return
+    event = {
+        "ts": time.time(),
+        "stage": name,
+        "duration_ms": round(duration * 1000, 3),
+        "labels": labels,
+        "counts": counts or {},
+        "rss_bytes": rss_bytes,
+        "rss_delta_bytes": rss_delta_bytes,
+        "error": error,
+        "thread": threading.current_thread().name,
+    }
+    for sink in list(_sinks):
+        sink.write(event)
+
+
+def record_speed(results, **labels):
+    """
+    Emits the preprocess / inference / postprocess times ultralytics measured
+    for a batch of results (result.speed is in ms per image).
+    """
+    if not _sinks or not results:
+        return
+    for part in ("preprocess", "inference", "postprocess"):
+        total_ms = sum((getattr(result, "speed", None) or {}).get(part) or 0.0 for result in results)
+        record(f"yolo_{part}", total_ms / 1000, {"images": len(results)}, **labels)
+
+
+def add_sink(sink):
+    with _lock:
+        _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    with _lock:
+        if sink in _sinks:
+            _sinks.remove(sink)
+
+
+def flush():
+    for sink in list(_sinks):
+        sink.flush()
+
+
+def close():
+    """
+    Flushes and removes every sink and the profile hook.
+    """
+    global _profile_hook
+    with _lock:
+        sinks = list(_sinks)
+        _sinks.clear()
+        _profile_hook = None
+    for sink in sinks:
+        sink.close()
+
+
+def set_profile_hook(hook):
+    """
+    hook(stage_name) returns a started profiler for that stage or None to skip
+    it, and the profiler's stop() is called when the stage is done.
+    """
+    global _profile_hook
+    _profile_hook = hook
+
+
+def start_profiler(name):
+    hook = _profile_hook
+    if hook is None or getattr(_local, "profiling", False):
+        return None
+    profiler = hook(name)
+    if profiler is not None:
+        _local.profiling = True
+    return profiler
+
+
+def stop_profiler(profiler):
+    if profiler is not None:
+        _local.profiling = False
+        profiler.stop()
+
+
+class CProfileHook:
+    """
+    Runs cProfile around the stages in `stages` (all of them if None) and
+    writes output_dir/<stage>-<n>.prof for every call.
+    """
+    def __init__(self, output_dir="data/profiles", stages=None) -> None:
+        self.output_dir = output_dir
+        self.stages = set(stages) if stages else None
+        self.calls = dict()
+        self.lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+
+    def __call__(self, name):
+        if self.stages is not None and name not in self.stages:
+            return None
+        with self.lock:
+            n = self.calls.get(name, 0)
+            self.calls[name] = n + 1
+        return CProfileRun(os.path.join(self.output_dir, f"{name}-{n:05d}.prof"))
+
+
+class CProfileRun:
+    def __init__(self, path) -> None:
+        self.path = path
+        self.profiler = cProfile.Profile()
+        try:
+            self.profiler.enable()
+        except ValueError:
+            # Another profiler is already running in this thread (Python 3.12+)
+            self.profiler = None
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.path)
+
+
+class MemorySink:
+    def __init__(self) -> None:
+        self.events = []
+        self.lock = threading.Lock()
+
+    def write(self, event):
+        with self.lock:
+            self.events.append(event)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class JsonLinesSink:
+    def __init__(self, path) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.file = open(path, "a", buffering=1)
+        self.lock = threading.Lock()
+
+    def write(self, event):
+        line = json.dumps(event, default=str)
+        with self.lock:
+            self.file.write(line + "\n")
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+# Upper bounds (seconds) of the duration histogram buckets
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def prometheus_labels(labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in sorted(labels.items())) + "}"
+
+
+class PrometheusTextSink:
+    """
+    Aggregates the events and rewrites `path` in the Prometheus text format
+    at most every `interval` seconds (and on flush/close).
+    """
+    def __init__(self, path, prefix="pipeline", interval=10.0) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.prefix = prefix
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.last_write = 0.0
+
+        # (stage, sorted label items) -> aggregates
+        self.durations = dict()
+        self.items = dict()
+        self.errors = dict()
+        self.rss_bytes = None
+
+    def write(self, event):
+        labels = {"stage": event["stage"], **{key: value for key, value in event["labels"].items()}}
+        key = tuple(sorted(labels.items()))
+        duration = event["duration_ms"] / 1000
+        with self.lock:
+            histogram = self.durations.setdefault(key, {"buckets": [0] * len(DURATION_BUCKETS), "sum": 0.0, "count": 0})
+            index = bisect.bisect_left(DURATION_BUCKETS, duration)
+            if index < len(DURATION_BUCKETS):
+                histogram["buckets"][index] += 1
+            histogram["sum"] += duration
+            histogram["count"] += 1
+
+            for item, n in event["counts"].items():
+                if isinstance(n, (int, float)):
+                    item_key = key + (("item", item),)
+                    self.items[item_key] = self.items.get(item_key, 0) + n
+            if event["error"] is not None:
+                self.errors[key] = self.errors.get(key, 0) + 1
+            if event["rss_bytes"] is not None:
+                self.rss_bytes = event["rss_bytes"]
+
+            due = time.monotonic() - self.last_write >= self.interval
+        if due:
+            self.flush()
+
+    def render(self):
+        name = f"{self.prefix}_stage_duration_seconds"
+        lines = [f"# HELP {name} Time spent in each pipeline stage", f"# TYPE {name} histogram"]
+        for key, histogram in sorted(self.durations.items()):
+            labels = dict(key)
+            cumulative = 0
+            for bound, n in zip(DURATION_BUCKETS, histogram["buckets"]):
+                cumulative += n
+                lines.append(f"{name}_bucket{prometheus_labels({**labels, 'le': bound})} {cumulative}")
+            lines.append(f"{name}_bucket{prometheus_labels({**labels, 'le': '+Inf'})} {histogram['count']}")
+            lines.append(f"{name}_sum{prometheus_labels(labels)} {histogram['sum']:.6f}")
+            lines.append(f"{name}_count{prometheus_labels(labels)} {histogram['count']}")
+
+        name = f"{self.prefix}_stage_items_total"
+        lines += [f"# HELP {name} Things counted in each stage (images, objects, text regions...)", f"# TYPE {name} counter"]
+        for key, n in sorted(self.items.items()):
+            lines.append(f"{name}{prometheus_labels(dict(key))} {n}")
+
+        name = f"{self.prefix}_stage_errors_total"
+        lines += [f"# HELP {name} Stages that raised", f"# TYPE {name} counter"]
+        for key, n in sorted(self.errors.items()):
+            lines.append(f"{name}{prometheus_labels(dict(key))} {n}")
+
+        if self.rss_bytes is not None:
+            name = f"{self.prefix}_process_rss_bytes"
+            lines += [f"# HELP {name} Resident memory of the process", f"# TYPE {name} gauge",
+                      f"{name} {self.rss_bytes}"]
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        with self.lock:
+            text = self.render()
+            self.last_write = time.monotonic()
+            # Written next to the target and renamed, so a scrape never sees half a file
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(text)
+            os.replace(tmp_path, self.path)
+
+    def close(self):
+        self.flush()
+
+
+def configure(jsonl=None, prometheus=None, profile_stages=None, profile_dir="data/profiles"):
+    """
+    Adds the usual sinks in one go. profile_stages is a list of stage names,
+    or ["all"] to profile every stage.
+    """
+    if jsonl:
+        add_sink(JsonLinesSink(jsonl))
+    if prometheus:
+        add_sink(PrometheusTextSink(prometheus))
+    if profile_stages:
+        stages = None if "all" in profile_stages else profile_stages
+        set_profile_hook(CProfileHook(profile_dir, stages))
+
+
+def configure_from_env(jsonl=None, prometheus=None, profile_stages=None, profile_dir=None):
+    """
+    configure() with whatever isn't given taken from PIPELINE_METRICS_JSONL,
+    PIPELINE_METRICS_PROM, PIPELINE_PROFILE_STAGES and PIPELINE_PROFILE_DIR,
+    so the command line options of a script win over the environment and every
+    sink is only added once.
+    """
+    if profile_stages is None:
+        stages = os.environ.get("PIPELINE_PROFILE_STAGES")
+        profile_stages = [stage.strip() for stage in stages.split(",") if stage.strip()] if stages else None
+    configure(
+        jsonl=jsonl or os.environ.get("PIPELINE_METRICS_JSONL"),
+        prometheus=prometheus or os.environ.get("PIPELINE_METRICS_PROM"),
+        profile_stages=profile_stages,
+        profile_dir=profile_dir or os.environ.get("PIPELINE_PROFILE_DIR", "data/profiles"),
+    )
@@ -0,0 +1,153 @@
+"""
+    Dynamic micro-batching for a model that is called from many threads at once.
+
+    Every caller submit()s one item and gets a concurrent.futures.Future back. A
+    single worker thread takes the first waiting item, waits at most max_wait_ms
+    for more to come in (or until max_batch_size are there) and hands the whole
+    batch to fn in one call. So ten clients asking for segmentation at the same
+    time cost one YOLO forward pass of ten images instead of ten passes, while a
+    lone request is delayed by max_wait_ms at the most.
+
+    Since only the worker thread ever calls fn, the model behind it doesn't have
+    to be thread safe.
+
+    The queue is bounded: when max_queue items are already waiting, submit()
+    raises QueueFull right away, so a server can answer "busy, retry later"
+    instead of piling up requests it will never get to in time.
+
+        batcher = MicroBatcher(model.predict_batch, max_batch_size=8, max_wait_ms=10, name="segmentation")
+        batcher.start()
+        result = batcher.submit(image).result()
+"""
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+from utils import metrics
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+class MicroBatcher:
+    # How often an idle worker checks whether it was stopped, for when stop()
+    # can't put its wake up sentinel in a full queue
+    poll_interval = 0.1
+
+    def __init__(self, fn, max_batch_size=8, max_wait_ms=10, max_queue=64, name="batch") -> None:
+        """
+        fn takes a list of items and returns a list with one output per item.
+        """
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = None
+        self.running = False
+
+        # Counters for the stats endpoint of the service
+        self.batches = 0
+        self.items = 0
+        self.rejected = 0
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self.work, name=f"{self.name}-batcher", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """
+        Finishes the items already queued and stops the worker.
+        """
+        if self.thread is None:
+            return
+        self.running = False
+        # Wakes the worker up if it's waiting on an empty queue. A full queue
+        # means it's busy anyway, it sees running is False once it's drained
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self.thread.join(timeout)
+        self.thread = None
+
+    def submit(self, item):
+        future = Future()
+        try:
+            self.queue.put_nowait((item, future, time.perf_counter()))
+        except queue.Full:
+            self.rejected += 1
+            raise QueueFull(f"{self.name} queue is full ({self.queue.maxsize} waiting)")
+        return future
+
+    def __len__(self):
+        # Items waiting for a batch
+        return self.queue.qsize()
+
+    def collect(self):
+        """
+        Blocks for the first item, then gathers more until the batch is full or
+        max_wait has passed since the first one came in.
+        """
+        try:
+            first = self.queue.get(timeout=self.poll_interval)
+        except queue.Empty:
+            return []
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                entry = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                # stop() was called, run what we have and let the loop end
+                self.running = False
+                break
+            batch.append(entry)
+        return batch
+
+    def work(self):
+        while self.running or not self.queue.empty():
+            batch = self.collect()
+            if not batch:
+                continue
+            self.run_batch(batch)
+
+    def run_batch(self, batch):
+        # Futures cancelled while they were queued (the caller stopped waiting)
+        # are dropped, the others can't be cancelled from here on
+        batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        items = [item for item, _, _ in batch]
+        futures = [future for _, future, _ in batch]
+        started = time.perf_counter()
+        metrics.record("queue_wait", max(started - queued for _, _, queued in batch), model=self.name)
+
+        try:
+            with metrics.stage("micro_batch", model=self.name) as span:
+                outputs = self.fn(items)
+                span.count(items=len(items))
+            if len(outputs) != len(items):
+                raise RuntimeError(f"{self.name} returned {len(outputs)} outputs for {len(items)} items")
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        finally:
+            self.batches += 1
+            self.items += len(items)
+
+        for future, output in zip(futures, outputs):
+            future.set_result(output)
@@ -0,0 +1,194 @@
+"""
+    Pipeline orchestrator. The pipeline is described as a small dependency graph
+    of stages, every stage is a function of the outputs of the stages it depends
+    on. A stage is submitted to a thread (or process) pool as soon as all of its
+    dependencies are done, so independent stages run at the same time.
+
+    For the default graph built by build_pipeline():
+
+        img_path ── image ──┬── segmentation ───┐
+                            ├── identification ─┼── mapping ───┬── result
+                            └── text_extraction ┴── summary ───┘
+
+    The image is decoded once by the "image" stage and that same ImageInput is
+    handed to the three models.
+
+    segmentation, identification and text_extraction only need the image, so the
+    wall time of one image is roughly the slowest of the three instead of their sum.
+
+    Usage:
+        with build_pipeline() as pipeline:
+            final_dict = pipeline.run({"img_path": img_path})["result"]
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from models.segmentation_model import SegmentationModel
+from models.identification_model import IdentificationModel
+from models.text_extraction_model import TextExtractionModel
+from models.summarization_model import SummarizationModel
+from utils.data_mapping import DataMapping
+from utils.image_input import ImageInput
+
+
+class Pipeline:
+    def __init__(self, executor="thread", max_workers=3) -> None:
+        """
+        executor is "thread" or "process". With processes every worker loads its
+        own copy of the models, and stage functions, inputs and outputs have to be
+        picklable (module level functions, not lambdas).
+        """
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown executor {executor}, should be 'thread' or 'process'")
+
+        self.executor_type = executor
+        self.max_workers = max_workers
+        self.executor = None
+
+        # name -> (fn, deps), in the order they were added
+        self.stages = dict()
+
+    def add_stage(self, name, fn, deps=()):
+        """
+        Add a stage. fn is called with the outputs of deps, in that order. A
+        dependency is either another stage or one of the inputs given to run().
+        """
+        if name in self.stages:
+            raise ValueError(f"Stage {name} already exists")
+        self.stages[name] = (fn, tuple(deps))
+        return self
+
+    def get_executor(self):
+        # Created once and reused by every run(), so process workers keep their models loaded
+        if self.executor is None:
+            if self.executor_type == "thread":
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="pipeline")
+            else:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self.executor
+
+    def run(self, inputs, on_stage_done=None):
+        """
+        Runs every stage and returns a dict with the inputs and the output of each stage.
+
+        on_stage_done(name, output) is called from the calling thread as soon as
+        a stage finishes, e.g. to show results while the others are still running.
+        If a stage raises, the stages not started yet are cancelled and the
+        exception is raised here.
+        """
+        outputs = dict(inputs)
+        for name, (_, deps) in self.stages.items():
+            unknown = [dep for dep in deps if dep not in self.stages and dep not in inputs]
+            if unknown:
+                raise ValueError(f"Stage {name} depends on unknown stages {unknown}")
+
+        executor = self.get_executor()
+        waiting = {name for name in self.stages if name not in outputs}
+        running = dict()
+
+        while waiting or running:
+            # Submit every stage whose dependencies are all done
+            for name in [name for name in waiting if all(dep in outputs for dep in self.stages[name][1])]:
+                fn, deps = self.stages[name]
+                running[executor.submit(fn, *[outputs[dep] for dep in deps])] = name
+                waiting.discard(name)
+
+            if not running:
+                raise ValueError(f"Stages {sorted(waiting)} can never run, the graph has a cycle")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    outputs[name] = future.result()
+                except Exception:
+                    for other in running:
+                        other.cancel()
+                    raise
+
+                if on_stage_done is not None:
+                    on_stage_done(name, outputs[name])
+
+        return outputs
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# The stage functions of the default pipeline. They are module level so that
+# they can be sent to process workers. Creating the model classes is cheap,
+# the weights are shared through the model registry (per process).
+
+def decode(img_path):
+    return ImageInput.from_path(img_path)
+
+
+def segment(image):
+    return SegmentationModel().predict(image)
+
+
+def identify(image):
+    return IdentificationModel().generate_descriptions(image)
+
+
+def extract_text(image):
+    return TextExtractionModel().extract_text(image)
+
+
+# One SummarizationModel per process, shared by every image, so they all go
+# through the same LLM client: its pooled connections, its limit on parallel
+# requests and its cache of the responses
+summ_model = None
+summ_model_lock = threading.Lock()
+
+
+def get_summarizer():
+    global summ_model
+    with summ_model_lock:
+        if summ_model is None:
+            summ_model = SummarizationModel()
+    return summ_model
+
+
+def summarize(seg_data, id_data, text):
+    return get_summarizer().summarize(seg_data[1], id_data[0], text)
+
+
+def map_results(image, seg_data, id_data, text):
+    # The summary is filled in by attach_summary() once it's ready, so the
+    # mapping doesn't have to wait for the LLM
+    return DataMapping().mapping(seg_data, id_data, text, None, image.master_id)
+
+
+def attach_summary(final_dict, summary):
+    for master_data in final_dict.values():
+        master_data["summary"] = summary
+    return final_dict
+
+
+def without_summary(final_dict):
+    return final_dict
+
+
+def build_pipeline(executor="thread", max_workers=3, summarize_results=True):
+    pipeline = Pipeline(executor, max_workers)
+    pipeline.add_stage("image", decode, ["img_path"])
+    pipeline.add_stage("segmentation", segment, ["image"])
+    pipeline.add_stage("identification", identify, ["image"])
+    pipeline.add_stage("text_extraction", extract_text, ["image"])
+    pipeline.add_stage("mapping", map_results, ["image", "segmentation", "identification", "text_extraction"])
+
+    if summarize_results:
+        pipeline.add_stage("summary", summarize, ["segmentation", "identification", "text_extraction"])
+        pipeline.add_stage("result", attach_summary, ["mapping", "summary"])
+    else:
+        pipeline.add_stage("result", without_summary, ["mapping"])
+    return pipeline
@@ -0,0 +1,141 @@
+"""
+    Compact serialization of the model outputs for the summarization prompt.
+
+    Putting the raw Python reprs of obj_metadata and the descriptions in the prompt
+    sends the absolute paths of every crop and the master image (which the model
+    is told to ignore anyway) and bboxes with 15 decimals. The prompt then grows
+    fast with the number of objects and so does the LLM latency. Instead this:
+
+    - keeps only the object ids and their boxes, rounded to whole pixels
+    - groups the detections by class: "car x3 conf 0.91,0.88,0.75 boxes ..."
+    - fits everything in a token budget, dropping detail step by step (boxes
+      first, then confidences, then cutting the text) until the prompt fits
+
+    Tokens are counted with tiktoken if it's installed, otherwise estimated as
+    one token per 4 characters, which is close enough for English.
+"""
+import re
+import functools
+
+
+@functools.lru_cache(maxsize=1)
+def get_encoding():
+    # Loaded on the first count, not on import: get_encoding() reads the BPE
+    # ranks from tiktoken's cache (or downloads them the first time)
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def round_box(box, precision=0):
+    # obj_id_bbox comes from xyxy.tolist() and is nested, [[x1, y1, x2, y2]]
+    while len(box) == 1 and isinstance(box[0], (list, tuple)):
+        box = box[0]
+    values = [round(float(v), precision) for v in box]
+    if precision == 0:
+        values = [int(v) for v in values]
+    return "[" + ",".join(str(v) for v in values) + "]"
+
+
+def serialize_objects(obj_metadata, with_boxes=True):
+    if not obj_metadata:
+        return "segmented objects: none"
+    if not with_boxes:
+        return f"segmented objects: {len(obj_metadata)}"
+    objects = "; ".join(f"{obj.get('object_id')} {round_box(obj['obj_seg_bbox'])}"
+                        if obj.get("obj_seg_bbox") is not None else str(obj.get("object_id"))
+                        for obj in obj_metadata)
+    return f"segmented objects ({len(obj_metadata)}, id [x,y,w,h]): {objects}"
+
+
+def group_descriptions(desc):
+    """
+    Groups the IdentificationModel descriptions by class, keeping the order in
+    which the classes first show up. Anything that isn't a description dict
+    (plain strings for example) is returned separately as it is.
+    """
+    groups = dict()
+    others = []
+    for description in desc or []:
+        if isinstance(description, dict) and "object_class" in description:
+            group = groups.setdefault(description["object_class"], {"count": 0, "conf": [], "boxes": []})
+            group["count"] += 1
+            if description.get("conf") is not None:
+                group["conf"].append(f"{float(description['conf']):.2f}")
+            if description.get("obj_id_bbox") is not None:
+                group["boxes"].append(round_box(description["obj_id_bbox"]))
+        else:
+            others.append(str(description))
+    return groups, others
+
+
+def serialize_descriptions(desc, with_boxes=True, with_conf=True):
+    groups, others = group_descriptions(desc)
+    parts = []
+    for object_class, group in groups.items():
+        part = f"{object_class} x{group['count']}"
+        if with_conf and group["conf"]:
+            part += " conf " + ",".join(group["conf"])
+        if with_boxes and group["boxes"]:
+            part += " boxes " + ",".join(group["boxes"])
+        parts.append(part)
+    parts.extend(others)
+    if not parts:
+        return "detections: none"
+    return "detections: " + "; ".join(parts)
+
+
+def serialize_text(txt_results):
+    if isinstance(txt_results, (list, tuple)):
+        txt_results = " ".join(str(text) for text in txt_results)
+    text = re.sub(r"\s+", " ", str(txt_results or "")).strip()
+    return f"text_results: {text}" if text else "text_results: none"
+
+
+def truncate_to_tokens(text, max_tokens):
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = get_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text)[:max(max_tokens - 1, 0)]) + "…"
+    return text[:max(max_tokens * 4 - 1, 0)] + "…"
+
+
+def serialize(obj_metadata, desc, txt_results, max_tokens=None):
+    """
+    Returns the compact data part of the prompt and the number of tokens it
+    takes. With max_tokens the detail is reduced until it fits:
+    1. everything, 2. no detection boxes, 3. no object boxes either,
+    4. no confidences either, 5. the extracted text is cut to what's left.
+    """
+    levels = [
+        (True, True, True),
+        (False, True, True),
+        (False, False, True),
+        (False, False, False),
+    ]
+    for id_boxes, seg_boxes, with_conf in levels:
+        lines = [
+            serialize_objects(obj_metadata, seg_boxes),
+            serialize_descriptions(desc, id_boxes, with_conf),
+            serialize_text(txt_results),
+        ]
+        data = "\n".join(lines)
+        tokens = count_tokens(data)
+        if max_tokens is None or tokens <= max_tokens:
+            return data, tokens
+
+    # Still too long, the text goes last since it can be cut anywhere
+    head = "\n".join(lines[:2])
+    remaining = max_tokens - count_tokens(head) - 1
+    data = truncate_to_tokens(head, max_tokens) if remaining <= 0 else head + "\n" + truncate_to_tokens(lines[2], remaining)
+    return data, count_tokens(data)
@@ -0,0 +1,133 @@
+"""
+    Typed records of the pipeline results.
+
+    The dicts DataMapping.mapping() returns repeat every key for every object and
+    keep the boxes as nested Python lists, which is fine for one image but adds up
+    over a whole corpus. An ImageRecord keeps the objects of one image as columns
+    instead: one (N, 4) float32 array for each kind of box and one array for the
+    confidences and IoUs, with NaN where the IdentificationModel found no match.
+    ObjectRecord is a slotted view of a single row for code that wants objects.
+
+    Both convert back and forth with the dict format, so everything that reads
+    final_dict keeps working:
+
+        records = records_from_mapping(final_dict)
+        final_dict = records_to_mapping(records)
+"""
+import math
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import numpy as np
+
+
+# Keys of a DataMapping.mapping() image dict that ImageRecord has fields for
+MAPPING_KEYS = ("entries", "text", "summary", "id_model_image_path")
+
+def box_array(boxes):
+    """
+    (N, 4) float32 array of boxes, None boxes become rows of NaN. obj_id_bbox
+    comes from xyxy.tolist() and is nested ([[x1, y1, x2, y2]]), that's flattened too.
+    """
+    array = np.full((len(boxes), 4), np.nan, dtype=np.float32)
+    for i, box in enumerate(boxes):
+        if box is not None:
+            array[i] = np.asarray(box, dtype=np.float32).reshape(4)
+    return array
+
+
+def optional_float(value):
+    # The float32 columns turn 0.8 into 0.800000011920929, round that back
+    return None if value is None or math.isnan(value) else round(float(value), 6)
+
+
+@dataclass(slots=True)
+class ObjectRecord:
+    obj_id: str
+    seg_bbox: np.ndarray                 # [x, y, w, h]
+    obj_img_path: Optional[str] = None
+    obj_name: Optional[str] = None
+    confidence: float = math.nan
+    id_bbox: Optional[np.ndarray] = None # [x1, y1, x2, y2], None without a match
+    iou: float = math.nan
+
+    def to_dict(self, master_image=None):
+        # Same keys as the entries of DataMapping.mapping()
+        return {
+            "obj_id": self.obj_id,
+            "obj_img_path": self.obj_img_path,
+            "obj_seg_bbox": self.seg_bbox.tolist(),
+            "master_image": master_image,
+            "obj_name": self.obj_name,
+            "confidence": optional_float(self.confidence),
+            "obj_id_bbox": None if self.id_bbox is None else [self.id_bbox.tolist()],
+            "iou": optional_float(self.iou),
+        }
+
+
+@dataclass(slots=True)
+class ImageRecord:
+    master_id: str
+    master_image: Optional[str] = None
+    text: str = ""
+    summary: Optional[str] = None
+    id_model_image_path: Optional[str] = None
+
+    # One entry (or row) per segmented object
+    obj_ids: List[str] = field(default_factory=list)
+    obj_img_paths: List[Optional[str]] = field(default_factory=list)
+    obj_names: List[Optional[str]] = field(default_factory=list)
+    seg_boxes: np.ndarray = field(default_factory=lambda: np.zeros((0, 4), dtype=np.float32))
+    id_boxes: np.ndarray = field(default_factory=lambda: np.zeros((0, 4), dtype=np.float32))
+    confidences: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.float32))
+    ious: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.float32))
+
+    # Whatever else is in the dict (unmatched_descriptions, text_regions), kept as it is
+    extra: dict = field(default_factory=dict)
+
+    def __len__(self):
+        return len(self.obj_ids)
+
+    def objects(self):
+        for i in range(len(self)):
+            id_bbox = None if np.isnan(self.id_boxes[i]).all() else self.id_boxes[i]
+            yield ObjectRecord(self.obj_ids[i], self.seg_boxes[i], self.obj_img_paths[i], self.obj_names[i],
+                               float(self.confidences[i]), id_bbox, float(self.ious[i]))
+
+    @classmethod
+    def from_mapping(cls, master_id, master_data):
+        entries = master_data["entries"]
+        master_image = entries[0]["master_image"] if entries else None
+        return cls(
+            master_id=master_id,
+            master_image=master_image,
+            text=master_data.get("text") or "",
+            summary=master_data.get("summary"),
+            id_model_image_path=master_data.get("id_model_image_path"),
+            obj_ids=[entry["obj_id"] for entry in entries],
+            obj_img_paths=[entry["obj_img_path"] for entry in entries],
+            obj_names=[entry["obj_name"] for entry in entries],
+            seg_boxes=box_array([entry["obj_seg_bbox"] for entry in entries]),
+            id_boxes=box_array([entry["obj_id_bbox"] for entry in entries]),
+            confidences=np.array([np.nan if entry["confidence"] is None else float(entry["confidence"])
+                                  for entry in entries], dtype=np.float32),
+            ious=np.array([np.nan if entry["iou"] is None else entry["iou"] for entry in entries], dtype=np.float32),
+            extra={key: value for key, value in master_data.items() if key not in MAPPING_KEYS},
+        )
+
+    def to_mapping(self):
+        return {
+            "entries": [obj.to_dict(self.master_image) for obj in self.objects()],
+            "text": self.text,
+            "summary": self.summary,
+            "id_model_image_path": self.id_model_image_path,
+            **self.extra,
+        }
+
+
+def records_from_mapping(final_dict):
+    return [ImageRecord.from_mapping(master_id, master_data) for master_id, master_data in final_dict.items()]
+
+
+def records_to_mapping(records):
+    return {record.master_id: record.to_mapping() for record in records}
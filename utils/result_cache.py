@@ -0,0 +1,156 @@
+"""
+    On-disk cache for the outputs of the pipeline stages.
+
+    Entries are keyed by the hash of the image content (not its path, so the same
+    picture uploaded twice under different names is still a hit) together with
+    the stage, model name, model version and the thresholds used. Changing any of
+    those gives a new key, so stale results never come back after an upgrade.
+
+    Every entry is a zlib compressed pickle file under cache_dir (masks and
+    such compress very well). Reading an entry touches its
+    modification time, and once the cache grows past max_bytes the least recently
+    used entries are deleted first.
+"""
+import os
+import json
+import zlib
+import pickle
+import hashlib
+import tempfile
+import threading
+from importlib import metadata
+
+
+# Returned by get() for a missing entry when None is a valid cached value
+MISSING = object()
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def package_version(name):
+    """
+    Installed version of a package, used as the model version part of the keys.
+    """
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+class ResultCache:
+    def __init__(self, cache_dir="data/cache", max_bytes=512 * 1024 * 1024) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Running total of the cache size, computed on the first put() so
+        # that we don't have to scan the directory after every write
+        self.total_bytes = None
+
+    def make_key(self, content_hash, stage, model_name, version, params=None):
+        """
+        Key of one stage output. params holds anything else the output depends
+        on, like the confidence threshold, and must be JSON serializable.
+        """
+        key_data = json.dumps({
+            "content": content_hash,
+            "stage": stage,
+            "model": model_name,
+            "version": version,
+            "params": params or {},
+        }, sort_keys=True)
+        return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+    def path_for(self, key):
+        # Two level layout so a single directory doesn't end up with every entry
+        return os.path.join(self.cache_dir, key[:2], key + ".pkl")
+
+    def get(self, key, default=None):
+        path = self.path_for(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.loads(zlib.decompress(f.read()))
+        except (FileNotFoundError, EOFError, zlib.error, pickle.UnpicklingError):
+            return default
+
+        # Mark as recently used for the LRU eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return value
+
+    def put(self, key, value):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+
+        # Write to a temporary file first so a reader never sees half an entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 1))
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = self.size()
+            else:
+                self.total_bytes += os.path.getsize(path) - old_size
+            over_budget = self.total_bytes > self.max_bytes
+
+        if over_budget:
+            self.evict()
+
+    def __contains__(self, key):
+        return os.path.exists(self.path_for(key))
+
+    def entries(self):
+        """
+        (mtime, size, path) of every entry in the cache.
+        """
+        found = []
+        for sub_dir in os.scandir(self.cache_dir):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if entry.name.endswith(".pkl"):
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, stat.st_size, entry.path))
+        return found
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """
+        Delete least recently used entries until the cache fits in max_bytes.
+        """
+        with self.lock:
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+            self.total_bytes = total
+
+    def clear(self):
+        with self.lock:
+            for _, _, path in self.entries():
+                os.remove(path)
+            self.total_bytes = 0
@@ -0,0 +1,278 @@
+"""
+    Persistent store of the pipeline results in a local SQLite database, so that
+    questions about the whole corpus can be answered without running the models again.
+
+    Tables:
+        images:     one row per image (master_id, master_image, text, summary, ...),
+                    the rest of the image dict (unmatched_descriptions, text_regions) as JSON
+        objects:    one row per segmented object, with its class, confidence and boxes,
+                    indexed on master_id, (obj_name, confidence) and confidence
+        image_text: FTS5 full text index over the OCR text and the summary
+
+    Adding an image that is already in the store replaces it.
+
+    Usage:
+        with ResultsStore("data/results.db") as store:
+            store.add(final_dict)
+            store.query(obj_name="person", min_conf=0.8, text="STOP")
+
+    Or from the root folder:
+        python3 utils/results_store.py data/results.db ingest data/output
+        python3 utils/results_store.py data/results.db query --class person --min-conf 0.8 --text STOP
+        python3 utils/results_store.py data/results.db show 000000000025
+"""
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import threading
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.records import ImageRecord, records_from_mapping
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    master_id TEXT PRIMARY KEY,
+    master_image TEXT,
+    text TEXT,
+    summary TEXT,
+    id_model_image_path TEXT,
+    n_objects INTEGER NOT NULL,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS objects (
+    id INTEGER PRIMARY KEY,
+    master_id TEXT NOT NULL REFERENCES images(master_id) ON DELETE CASCADE,
+    obj_id TEXT,
+    obj_name TEXT,
+    obj_img_path TEXT,
+    confidence REAL,
+    iou REAL,
+    seg_x REAL, seg_y REAL, seg_w REAL, seg_h REAL,
+    id_x1 REAL, id_y1 REAL, id_x2 REAL, id_y2 REAL
+);
+CREATE INDEX IF NOT EXISTS objects_master_id ON objects(master_id);
+CREATE INDEX IF NOT EXISTS objects_class_conf ON objects(obj_name, confidence);
+CREATE INDEX IF NOT EXISTS objects_conf ON objects(confidence);
+CREATE VIRTUAL TABLE IF NOT EXISTS image_text USING fts5(master_id UNINDEXED, text, summary);
+"""
+
+
+def to_sql(value):
+    # NaN (no match) goes in as NULL
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+def fts_phrase(text):
+    # Searched as a phrase, so quotes and FTS operators in the text are taken literally
+    return '"' + text.replace('"', '""') + '"'
+
+
+class ResultsStore:
+    def __init__(self, db_path="data/results.db") -> None:
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        # One connection shared by the pipeline threads, guarded by the lock
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA foreign_keys=ON")
+            self.connection.executescript(SCHEMA)
+
+    def add(self, final_dict):
+        """
+        Stores the dict DataMapping.mapping() returns (any number of images).
+        """
+        self.add_records(records_from_mapping(final_dict))
+
+    def add_records(self, records):
+        with self.lock, self.connection:
+            for record in records:
+                self.connection.execute("DELETE FROM images WHERE master_id = ?", (record.master_id,))
+                self.connection.execute("DELETE FROM image_text WHERE master_id = ?", (record.master_id,))
+                self.connection.execute(
+                    "INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (record.master_id, record.master_image, record.text, record.summary,
+                     record.id_model_image_path, len(record), json.dumps(record.extra)),
+                )
+                self.connection.execute(
+                    "INSERT INTO image_text (master_id, text, summary) VALUES (?, ?, ?)",
+                    (record.master_id, record.text or "", record.summary or ""),
+                )
+                self.connection.executemany(
+                    "INSERT INTO objects (master_id, obj_id, obj_name, obj_img_path, confidence, iou, "
+                    "seg_x, seg_y, seg_w, seg_h, id_x1, id_y1, id_x2, id_y2) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (record.master_id, record.obj_ids[i], record.obj_names[i], record.obj_img_paths[i],
+                         to_sql(record.confidences[i]), to_sql(record.ious[i]),
+                         *map(to_sql, record.seg_boxes[i]), *map(to_sql, record.id_boxes[i]))
+                        for i in range(len(record))
+                    ],
+                )
+
+    def query(self, obj_name=None, min_conf=None, text=None, summary=None, limit=None):
+        """
+        master_ids (with their image path, OCR text and the number of matching
+        objects) of the images that have an object of class obj_name with a
+        confidence of at least min_conf, and whose OCR text / summary contain
+        the given words. Every filter is optional.
+        """
+        conditions, params = [], []
+        if obj_name is not None or min_conf is not None:
+            object_conditions = ["o.master_id = i.master_id"]
+            if obj_name is not None:
+                object_conditions.append("o.obj_name = ?")
+                params.append(obj_name)
+            if min_conf is not None:
+                object_conditions.append("o.confidence >= ?")
+                params.append(min_conf)
+            matches = f"(SELECT COUNT(*) FROM objects o WHERE {' AND '.join(object_conditions)})"
+        else:
+            matches = "i.n_objects"
+
+        fts = []
+        if text:
+            fts.append(f"text : {fts_phrase(text)}")
+        if summary:
+            fts.append(f"summary : {fts_phrase(summary)}")
+        if fts:
+            conditions.append("i.master_id IN (SELECT master_id FROM image_text WHERE image_text MATCH ?)")
+            params.append(" AND ".join(fts))
+
+        sql = f"SELECT * FROM (SELECT i.master_id, i.master_image, i.text, {matches} AS matches FROM images i"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += ")"
+        if obj_name is not None or min_conf is not None:
+            sql += " WHERE matches > 0"
+        sql += " ORDER BY master_id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        with self.lock:
+            return [dict(row) for row in self.connection.execute(sql, params)]
+
+    def get(self, master_id):
+        """
+        The stored ImageRecord of master_id, or None.
+        """
+        with self.lock:
+            image = self.connection.execute("SELECT * FROM images WHERE master_id = ?", (master_id,)).fetchone()
+            if image is None:
+                return None
+            rows = self.connection.execute("SELECT * FROM objects WHERE master_id = ? ORDER BY id", (master_id,)).fetchall()
+
+        def column(names):
+            return np.array([[np.nan if row[name] is None else row[name] for name in names] for row in rows],
+                            dtype=np.float32).reshape(len(rows), len(names))
+
+        return ImageRecord(
+            master_id=image["master_id"],
+            master_image=image["master_image"],
+            text=image["text"] or "",
+            summary=image["summary"],
+            id_model_image_path=image["id_model_image_path"],
+            obj_ids=[row["obj_id"] for row in rows],
+            obj_img_paths=[row["obj_img_path"] for row in rows],
+            obj_names=[row["obj_name"] for row in rows],
+            seg_boxes=column(("seg_x", "seg_y", "seg_w", "seg_h")),
+            id_boxes=column(("id_x1", "id_y1", "id_x2", "id_y2")),
+            confidences=column(("confidence",)).reshape(-1),
+            ious=column(("iou",)).reshape(-1),
+            extra=json.loads(image["extra"] or "{}"),
+        )
+
+    def class_counts(self, min_conf=None):
+        """
+        {obj_name: number of objects} over the whole store.
+        """
+        sql = "SELECT obj_name, COUNT(*) AS n FROM objects WHERE obj_name IS NOT NULL"
+        params = []
+        if min_conf is not None:
+            sql += " AND confidence >= ?"
+            params.append(min_conf)
+        sql += " GROUP BY obj_name ORDER BY n DESC"
+        with self.lock:
+            return {row["obj_name"]: row["n"] for row in self.connection.execute(sql, params)}
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Store and query pipeline results")
+    parser.add_argument("db_path", help="SQLite database, e.g. data/results.db")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="Add the JSON results written by the batch pipeline")
+    ingest.add_argument("paths", nargs="+", help="JSON files or directories of them")
+
+    query = commands.add_parser("query", help="Find images by object class, confidence and text")
+    query.add_argument("--class", dest="obj_name", default=None, help="Object class, e.g. person")
+    query.add_argument("--min-conf", type=float, default=None, help="Lowest confidence of the object")
+    query.add_argument("--text", default=None, help="Words the OCR text has to contain")
+    query.add_argument("--summary", default=None, help="Words the summary has to contain")
+    query.add_argument("--limit", type=int, default=None)
+
+    show = commands.add_parser("show", help="Print the stored result of one image")
+    show.add_argument("master_id")
+
+    commands.add_parser("stats", help="Number of images and objects per class")
+    args = parser.parse_args()
+
+    with ResultsStore(args.db_path) as store:
+        if args.command == "ingest":
+            json_paths = []
+            for path in args.paths:
+                if os.path.isdir(path):
+                    json_paths += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".json"))
+                else:
+                    json_paths.append(path)
+            for path in json_paths:
+                with open(path) as f:
+                    store.add(json.load(f))
+            print(f"[INFO] Added {len(json_paths)} result files, {len(store)} images in {args.db_path}")
+
+        elif args.command == "query":
+            rows = store.query(args.obj_name, args.min_conf, args.text, args.summary, args.limit)
+            for row in rows:
+                print(f"{row['master_id']}\t{row['matches']}\t{row['master_image']}")
+            print(f"[INFO] {len(rows)} images")
+
+        elif args.command == "show":
+            record = store.get(args.master_id)
+            if record is None:
+                print(f"[INFO] {args.master_id} is not in {args.db_path}")
+            else:
+                print(json.dumps({record.master_id: record.to_mapping()}, indent=4))
+
+        else:
+            print(f"[INFO] {len(store)} images")
+            for obj_name, n in store.class_counts().items():
+                print(f"{obj_name}\t{n}")
+
+
+if __name__ == "__main__":
+    main()
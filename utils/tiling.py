@@ -0,0 +1,85 @@
+"""
+    Helpers for running a detector over a large image in overlapping tiles.
+
+    A 4000x3000 photo is shrunk to 640 pixels before YOLO sees it, and anything
+    smaller than a couple of dozen pixels is gone by then. Cutting the image into
+    tiles of about the model's input size keeps the objects at their own size.
+    Objects on a tile border are found (partly) in both tiles, and merge_detections()
+    folds those duplicates back into one detection.
+
+        windows = tile_windows(3000, 4000, tile_size=640, overlap=0.2)
+        # ... run the model over image[y1:y2, x1:x2] for every window and
+        # shift its boxes by (x1, y1) ...
+        clusters = merge_detections(boxes, scores, classes, threshold=0.5)
+"""
+import numpy as np
+
+
+def tile_starts(length, tile_size, stride):
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, stride))
+    # The last tile is shifted back so it ends on the border instead of
+    # sticking out, so every tile has the same size
+    starts.append(length - tile_size)
+    return starts
+
+
+def tile_windows(height, width, tile_size=640, overlap=0.2):
+    """
+    [x1, y1, x2, y2] windows of tile_size that cover the whole image, neighbours
+    overlap by `overlap` (0.2 = 20%) of a tile. An image that fits in one tile
+    gives a single window over the whole of it.
+    """
+    if not 0 <= overlap < 1:
+        raise ValueError(f"overlap must be in [0, 1), got {overlap}")
+    stride = max(1, int(tile_size * (1 - overlap)))
+    return [
+        [x, y, min(x + tile_size, width), min(y + tile_size, height)]
+        for y in tile_starts(height, tile_size, stride)
+        for x in tile_starts(width, tile_size, stride)
+    ]
+
+
+def intersection_over_smaller(box, boxes):
+    """
+    Intersection of box (4,) with every box of boxes (N, 4) divided by the area
+    of the smaller of the two. An object cut in half by a tile border has a low
+    IoU with the whole object but an overlap of 1 by this measure.
+    """
+    top_left = np.maximum(box[:2], boxes[:, :2])
+    bottom_right = np.minimum(box[2:], boxes[:, 2:])
+    intersection = np.clip(bottom_right - top_left, 0, None).prod(axis=1)
+
+    area = (box[2:] - box[:2]).prod()
+    areas = (boxes[:, 2:] - boxes[:, :2]).prod(axis=1)
+    smaller = np.minimum(area, areas)
+    return np.where(smaller > 0, intersection / np.maximum(smaller, 1e-9), 0.0)
+
+
+def merge_detections(boxes, scores, classes, threshold=0.5):
+    """
+    Greedy non maximum suppression per class, on the intersection over the
+    smaller box. Returns a list of (kept index, indices of every detection it
+    absorbed, itself included), highest score first. The caller decides how a
+    cluster is merged, e.g. union of the boxes and of the masks.
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+    classes = np.asarray(classes).reshape(-1)
+
+    order = np.argsort(-scores, kind="stable")
+    remaining = np.ones(len(boxes), dtype=bool)
+    clusters = []
+    for idx in order:
+        if not remaining[idx]:
+            continue
+        candidates = np.flatnonzero(remaining & (classes == classes[idx]))
+        overlap = intersection_over_smaller(boxes[idx], boxes[candidates])
+        members = candidates[overlap >= threshold]
+
+        # The box itself always belongs to its own cluster, even a degenerate one
+        members = np.union1d(members, [idx])
+        remaining[members] = False
+        clusters.append((int(idx), [int(member) for member in members]))
+    return clusters
@@ -0,0 +1,124 @@
+"""
+    A small IoU tracker that carries object identities across the frames of a video.
+
+    Every frame the detections are matched to the tracks of the frames before with
+    the same IoU matrix and optimal assignment DataMapping uses to pair segmented
+    objects with descriptions (utils/data_mapping.py). A detection without a match
+    starts a new track, a track that isn't matched for more than max_misses frames
+    is dropped. Two boxes of different classes are never matched.
+
+    Every track also remembers the box it had the last time it was "processed"
+    (OCR'd, summarized), so the video pipeline can tell which objects are new or
+    have changed enough to be worth processing again, see Track.changed().
+
+        tracker = IoUTracker(min_iou=0.3)
+        for boxes, names in frames:
+            for track, is_new in tracker.update(boxes, names, frame_idx):
+                ...
+"""
+import numpy as np
+
+from utils.data_mapping import iou_matrix, assign_boxes
+
+
+class Track:
+    __slots__ = ("track_id", "box", "obj_name", "first_frame", "last_frame", "hits", "misses",
+                 "processed_box", "processed_name", "text")
+
+    def __init__(self, track_id, box, obj_name, frame_idx) -> None:
+        self.track_id = track_id
+        self.box = np.asarray(box, dtype=np.float32)
+        self.obj_name = obj_name
+        self.first_frame = frame_idx
+        self.last_frame = frame_idx
+        self.hits = 1
+        self.misses = 0
+
+        # State when the object was last OCR'd / summarized, None if never
+        self.processed_box = None
+        self.processed_name = None
+        self.text = None
+
+    def changed(self, min_iou=0.6):
+        """
+        True if the track was never processed, got another class, or its box
+        moved or grew so much that it overlaps its processed box by less than min_iou.
+        """
+        if self.processed_box is None or self.obj_name != self.processed_name:
+            return True
+        return float(iou_matrix(self.box, self.processed_box)[0, 0]) < min_iou
+
+    def mark_processed(self, text=None):
+        self.processed_box = self.box.copy()
+        self.processed_name = self.obj_name
+        self.text = text
+
+    def __repr__(self):
+        return f"Track({self.track_id}, {self.obj_name}, box={self.box.tolist()}, hits={self.hits})"
+
+
+class IoUTracker:
+    def __init__(self, min_iou=0.3, max_misses=5) -> None:
+        # With frame skipping objects move further between two processed
+        # frames, a lower min_iou keeps them matched
+        self.min_iou = min_iou
+        self.max_misses = max_misses
+        self.tracks = []
+        self.next_id = 1
+
+    def update(self, boxes, names, frame_idx):
+        """
+        boxes are the [x1, y1, x2, y2] boxes of this frame's detections and names
+        their classes (None for unknown). Returns one (track, is_new) per detection,
+        in the same order.
+        """
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        names = list(names)
+
+        matches = dict()
+        if self.tracks and len(boxes):
+            iou = iou_matrix(np.stack([track.box for track in self.tracks]), boxes)
+            for track_idx, track in enumerate(self.tracks):
+                for det_idx, name in enumerate(names):
+                    if track.obj_name is not None and name is not None and track.obj_name != name:
+                        iou[track_idx, det_idx] = 0
+            matches = {det_idx: track_idx for track_idx, det_idx in assign_boxes(iou, self.min_iou)}
+
+        outputs = []
+        matched_tracks = set()
+        for det_idx, (box, name) in enumerate(zip(boxes, names)):
+            if det_idx in matches:
+                track = self.tracks[matches[det_idx]]
+                track.box = box
+                # A detection without a class doesn't erase the one we know
+                track.obj_name = name if name is not None else track.obj_name
+                track.last_frame = frame_idx
+                track.hits += 1
+                track.misses = 0
+                matched_tracks.add(matches[det_idx])
+                outputs.append((track, False))
+            else:
+                track = Track(self.next_id, box, name, frame_idx)
+                self.next_id += 1
+                outputs.append((track, True))
+
+        # Tracks not seen this frame age, and are dropped after max_misses frames
+        kept = []
+        for track_idx, track in enumerate(self.tracks):
+            if track_idx not in matched_tracks:
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    continue
+            kept.append(track)
+        self.tracks = kept + [track for track, is_new in outputs if is_new]
+        return outputs
+
+    def active(self):
+        """
+        Tracks that were seen on the last frame.
+        """
+        return [track for track in self.tracks if track.misses == 0]
+
+    def reset(self):
+        self.tracks = []
+        self.next_id = 1
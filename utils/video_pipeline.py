@@ -0,0 +1,282 @@
+"""
+    Video / camera mode of the pipeline. Frames are read from a video file, a
+    camera (its index, e.g. 0) or a stream URL (rtsp://...) and every processed
+    frame goes through segmentation and identification like a still image would.
+
+    Running OCR and the summary on every frame would cost far more than the
+    detection itself, while from one frame to the next almost nothing changes.
+    So the objects are tracked across frames (utils/tracker.py) and:
+
+        - OCR only runs on the regions of objects that are new, changed class,
+          or moved / grew enough since they were last read (change_iou); the
+          text of the other objects is carried over from their track
+        - the summary is only asked for again on frames where objects appeared
+          or changed, otherwise the last one is carried over
+
+    frame_skip=N processes every (N+1)th frame, the frames in between are only
+    grabbed and not even decoded.
+
+    Every processed frame gives the usual mapped dict (see DataMapping.mapping),
+    its entries carry a "track_id" and "new", plus the frame number, timestamp
+    and which tracks were new or changed. They are written as JSON lines, one per frame.
+
+    Usage (from the root folder):
+        python3 utils/video_pipeline.py data/video.mp4 --frame-skip 4 --output data/output/video.jsonl
+        python3 utils/video_pipeline.py 0 --combined --summarize --max-frames 300
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from models.segmentation_model import SegmentationModel
+from models.identification_model import IdentificationModel
+from models.text_extraction_model import TextExtractionModel
+from models.summarization_model import SummarizationModel
+from models.onnx_backend import BACKENDS, QUANTIZE_MODES
+from models.inference_config import InferenceConfig
+from utils.data_mapping import DataMapping
+from utils.image_input import ImageInput
+from utils.tracker import IoUTracker
+from utils import metrics
+
+
+def source_name(source):
+    source = str(source)
+    if source.isdigit():
+        return f"camera{source}"
+    return os.path.splitext(os.path.basename(source.rstrip("/")))[0] or "stream"
+
+
+def open_capture(source):
+    # A number is a camera index, anything else a file or a stream URL
+    source = str(source)
+    capture = cv2.VideoCapture(int(source) if source.isdigit() else source)
+    if not capture.isOpened():
+        raise ValueError(f"Unable to open video source {source}")
+    return capture
+
+
+def iter_frames(source, frame_skip=0, max_frames=None):
+    """
+    Yields (frame_idx, timestamp in seconds, ImageInput) for every (frame_skip + 1)th
+    frame of source, at most max_frames of them. The skipped frames are only
+    grabbed, not decoded.
+    """
+    capture = open_capture(source)
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    name = source_name(source)
+    start = time.perf_counter()
+    try:
+        frame_idx, yielded = 0, 0
+        while max_frames is None or yielded < max_frames:
+            if frame_idx % (frame_skip + 1):
+                if not capture.grab():
+                    break
+            else:
+                with metrics.stage("decode"):
+                    ok, bgr = capture.read()
+                if not ok:
+                    break
+                # Cameras don't always report a frame rate, use the wall clock then
+                timestamp = frame_idx / fps if fps and fps > 0 else time.perf_counter() - start
+                yield frame_idx, round(timestamp, 3), ImageInput(bgr, name=f"{name}_{frame_idx:06d}")
+                yielded += 1
+            frame_idx += 1
+    finally:
+        capture.release()
+
+
+class VideoPipeline:
+    def __init__(self, frame_skip=0, combined=False, summarize=False, ocr=True, ocr_detect=True,
+                 min_iou=0.3, max_misses=5, change_iou=0.6, write_mode="memory", backend="torch", quantize=None,
+                 seg_config=None, id_config=None, llm_base_url=None, llm_api_key=None) -> None:
+        self.frame_skip = frame_skip
+        # ocr_detect=False reads every object region as one line of text,
+        # quicker than running EasyOCR's text detector over the frame
+        self.ocr_detect = ocr_detect
+        self.change_iou = change_iou
+
+        # Shaded objects and annotated images of every frame would pile up
+        # quickly, so by default nothing is written ("memory" mode)
+        self.combined = combined
+        self.seg_model = SegmentationModel(write_mode, backend=backend, quantize=quantize, config=seg_config)
+        self.id_model = None if combined else IdentificationModel(write_mode, backend=backend, quantize=quantize,
+                                                                  config=id_config)
+        self.txt_ext_model = TextExtractionModel() if ocr else None
+        self.summ_model = SummarizationModel(base_url=llm_base_url, api_key=llm_api_key) if summarize else None
+        self.data_mapping = DataMapping()
+        self.tracker = IoUTracker(min_iou, max_misses)
+
+        self.summary = None
+
+    def detect(self, image):
+        if self.combined:
+            return self.seg_model.predict_combined(image)
+        return self.seg_model.predict(image), self.id_model.generate_descriptions(image)
+
+    def read_text(self, image, tracks):
+        """
+        OCR over the regions of the given tracks only, every text region goes
+        to the track whose box holds its centre.
+        """
+        regions = [[x1, y1, x2 - x1, y2 - y1] for x1, y1, x2, y2 in (track.box.tolist() for track in tracks)]
+        text_regions = self.txt_ext_model.extract_text_regions(image, regions, detect=self.ocr_detect)
+
+        texts = {track.track_id: [] for track in tracks}
+        for region in text_regions:
+            x1, y1, x2, y2 = region["bbox"]
+            centre = ((x1 + x2) / 2, (y1 + y2) / 2)
+            for track in tracks:
+                bx1, by1, bx2, by2 = track.box.tolist()
+                if bx1 <= centre[0] <= bx2 and by1 <= centre[1] <= by2:
+                    texts[track.track_id].append(region["text"])
+                    break
+        return {track_id: " ".join(parts) or None for track_id, parts in texts.items()}
+
+    def process_frame(self, image, frame_idx=0, timestamp=None):
+        """
+        Detection, tracking and (for new or changed objects only) OCR and
+        summary of one frame. Returns the frame's record.
+        """
+        seg_data, id_data = self.detect(image)
+        final_dict = self.data_mapping.mapping(seg_data, id_data, None, None, image.master_id)
+        master_data = final_dict[image.master_id]
+        entries = master_data["entries"]
+
+        with metrics.stage("tracking") as span:
+            # obj_seg_bbox is [x, y, w, h], the tracker wants [x1, y1, x2, y2]
+            boxes = np.array([entry["obj_seg_bbox"] for entry in entries], dtype=np.float32).reshape(-1, 4)
+            boxes[:, 2:] += boxes[:, :2]
+            tracked = self.tracker.update(boxes, [entry["obj_name"] for entry in entries], frame_idx)
+            span.count(objects=len(tracked))
+
+        new_tracks = [track for track, is_new in tracked if is_new]
+        changed_tracks = [track for track, is_new in tracked if not is_new and track.changed(self.change_iou)]
+        to_process = new_tracks + changed_tracks
+
+        if to_process:
+            texts = self.read_text(image, to_process) if self.txt_ext_model is not None else dict()
+            for track in to_process:
+                track.mark_processed(texts.get(track.track_id))
+
+        for entry, (track, is_new) in zip(entries, tracked):
+            entry["track_id"] = track.track_id
+            entry["new"] = is_new
+            entry["text"] = track.text
+
+        text = " ".join(track.text for track, _ in tracked if track.text) or None
+
+        # The summary is only asked for again when the scene changed
+        summarized = False
+        if self.summ_model is not None and (to_process or self.summary is None):
+            self.summary = self.summ_model.summarize(seg_data[1], id_data[0], text)
+            summarized = True
+
+        master_data.update({
+            "master_id": image.master_id,
+            "frame": frame_idx,
+            "timestamp": timestamp,
+            "text": text,
+            "summary": self.summary,
+            "new_tracks": [track.track_id for track in new_tracks],
+            "changed_tracks": [track.track_id for track in changed_tracks],
+            "ocr_ran": bool(to_process) and self.txt_ext_model is not None,
+            "summary_ran": summarized,
+        })
+        return master_data
+
+    def process(self, source, max_frames=None):
+        """
+        Generator of the records of the processed frames of source.
+        """
+        self.tracker.reset()
+        self.summary = None
+        for frame_idx, timestamp, image in iter_frames(source, self.frame_skip, max_frames):
+            yield self.process_frame(image, frame_idx, timestamp)
+        self.seg_model.flush()
+        if self.id_model is not None:
+            self.id_model.flush()
+
+    def run(self, source, output_path=None, max_frames=None):
+        """
+        Processes source and writes one JSON line per processed frame to
+        output_path (if given). Returns the number of processed frames.
+        """
+        output = None
+        if output_path:
+            if os.path.dirname(output_path):
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            output = open(output_path, "w")
+
+        n_frames, n_ocr = 0, 0
+        try:
+            for record in self.process(source, max_frames):
+                n_frames += 1
+                n_ocr += record["ocr_ran"]
+                if output is not None:
+                    output.write(json.dumps(record) + "\n")
+                print(f"[INFO] Frame {record['frame']}: {len(record['entries'])} objects, "
+                      f"{len(record['new_tracks'])} new, {len(record['changed_tracks'])} changed")
+        finally:
+            if output is not None:
+                output.close()
+
+        print(f"[INFO] Processed {n_frames} frames, OCR ran on {n_ocr} of them")
+        return n_frames
+
+    def close(self):
+        if self.summ_model is not None:
+            self.summ_model.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the pipeline over a video file, camera or stream")
+    parser.add_argument("source", help="Video file, camera index (e.g. 0) or stream URL")
+    parser.add_argument("--output", default=None, help="JSON lines file of the frame results (default data/output/<source>.jsonl)")
+    parser.add_argument("--frame-skip", type=int, default=0, help="Frames skipped after every processed one")
+    parser.add_argument("--max-frames", type=int, default=None, help="Stop after this many processed frames")
+    parser.add_argument("--combined", action="store_true", help="Get detections from the segmentation pass instead of running the IdentificationModel")
+    parser.add_argument("--summarize", action="store_true", help="Summarize the frames where objects appeared or changed")
+    parser.add_argument("--no-ocr", action="store_true", help="Don't read text at all")
+    parser.add_argument("--no-ocr-detect", action="store_true", help="Read every new object as one line of text instead of detecting text in it")
+    parser.add_argument("--min-iou", type=float, default=0.3, help="Least IoU for a detection to continue a track")
+    parser.add_argument("--max-misses", type=int, default=5, help="Processed frames a track survives without a detection")
+    parser.add_argument("--change-iou", type=float, default=0.6, help="Objects that moved below this IoU since their last OCR are read again")
+    parser.add_argument("--backend", choices=BACKENDS, default="torch", help="Run the YOLO models with PyTorch or ONNX Runtime")
+    parser.add_argument("--quantize", choices=QUANTIZE_MODES, default=None, help="INT8 quantization of the ONNX models")
+    parser.add_argument("--seg-config", type=InferenceConfig.from_string, default=None, help="Settings of the segmentation model, see models/inference_config.py")
+    parser.add_argument("--id-config", type=InferenceConfig.from_string, default=None, help="Settings of the identification model")
+    parser.add_argument("--llm-base-url", default=None, help="OpenAI compatible server for the summaries")
+    parser.add_argument("--llm-api-key", default=os.environ.get("LLM_API_KEY"), help="API key of --llm-base-url (default: $LLM_API_KEY)")
+    parser.add_argument("--metrics-jsonl", default=None, help="Write per-stage timings as JSON lines to this file")
+    args = parser.parse_args()
+    if args.quantize and args.backend != "onnx":
+        parser.error("--quantize needs --backend onnx")
+
+    metrics.configure_from_env(args.metrics_jsonl)
+
+    pipeline = VideoPipeline(args.frame_skip, args.combined, args.summarize, not args.no_ocr, not args.no_ocr_detect,
+                             args.min_iou, args.max_misses, args.change_iou, backend=args.backend,
+                             quantize=args.quantize, seg_config=args.seg_config, id_config=args.id_config,
+                             llm_base_url=args.llm_base_url, llm_api_key=args.llm_api_key)
+
+    output = args.output or os.path.join("data/output", f"{source_name(args.source)}.jsonl")
+    start = time.perf_counter()
+    try:
+        n_frames = pipeline.run(args.source, output, args.max_frames)
+    finally:
+        pipeline.close()
+    elapsed = time.perf_counter() - start
+    print(f"[INFO] Results saved to {output}, {n_frames / elapsed:.2f} frames/sec")
+    metrics.close()
+
+
+if __name__ == "__main__":
+    main()
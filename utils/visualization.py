@@ -15,7 +15,7 @@ def shorten_path(path, max_length=30):
 	"""
 	Shorten the path for display purposes.
 	"""
-	if len(path) <= max_length:
+	if path is None or len(path) <= max_length:
 		return path
 	head, tail = os.path.split(path)
 	head = os.path.dirname(head)
@@ -0,0 +1,322 @@
+"""
+    Multi-process runner for big batch jobs. One process can't keep a many-core
+    machine busy: PyTorch and EasyOCR only scale so far with more intra-op
+    threads, and the crop and mask work after the model holds the GIL.
+
+    So the pipeline runs in `workers` processes instead. Every worker:
+
+        - loads the models once, when it starts (pipeline_factory())
+        - pins its intra-op thread count (torch, OpenCV, OpenMP / MKL) to
+          `threads`, and with pin_cores=True also its CPU affinity to its own
+          cores, so the workers don't fight over the same ones
+        - pulls images from one shared task queue, up to batch_size at a time,
+          and hands them to pipeline.process_batch()
+
+    The images are decoded in the main process and passed to the workers through
+    shared memory (one segment per image), only the segment's name goes through
+    the queue, so no pixels are pickled. The results are sent back and come out
+    of imap() in the order of the input. At most max_pending images are in
+    flight (decoded, being processed or waiting for an earlier one), which also
+    bounds the shared memory in use.
+
+        pool = WorkerPool(functools.partial(BatchPipeline, batch_size=4), workers=4, threads=2)
+        with pool:
+            for path, final_dict in pool.imap(ImageInput.from_path(path) for path in img_paths):
+                ...
+
+    Usage (from the root folder):
+        python3 utils/batch_pipeline.py data/input_images --workers 4 --threads-per-worker 2
+"""
+import os
+import time
+import queue
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from utils.image_input import ImageInput
+from utils import metrics
+
+
+# Read by OpenMP, MKL and OpenBLAS when they're loaded, so they have to be set
+# before the worker imports torch
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def split_cores(workers, threads):
+    """
+    Disjoint sets of `threads` cores for every worker, None if there aren't
+    enough cores to go around (the workers aren't pinned then).
+    """
+    cores = available_cores()
+    if workers * threads > len(cores):
+        return None
+    return [cores[idx * threads:(idx + 1) * threads] for idx in range(workers)]
+
+
+def pin_threads(threads, cores=None):
+    import cv2
+    cv2.setNumThreads(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+
+class SharedFrame:
+    """
+    A decoded image copied into a shared memory segment, on the side of the
+    main process which owns (and in the end unlinks) the segment.
+    """
+    def __init__(self, image) -> None:
+        bgr = np.ascontiguousarray(image.bgr)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(bgr.nbytes, 1))
+        np.ndarray(bgr.shape, dtype=bgr.dtype, buffer=self.shm.buf)[:] = bgr
+        self.shape = bgr.shape
+        self.dtype = bgr.dtype.str
+        self.path = image.path
+        self.name = image.name
+
+    def task(self, seq):
+        return (seq, self.shm.name, self.shape, self.dtype, self.path, self.name)
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def attach_frame(task):
+    """
+    The worker's side: an ImageInput over the shared memory, nothing is copied.
+    """
+    seq, shm_name, shape, dtype, path, name = task
+    shm = shared_memory.SharedMemory(name=shm_name)
+    bgr = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    return shm, ImageInput(bgr, path=path, name=name)
+
+
+def next_batch(tasks, batch_size):
+    """
+    Blocks for one task, then takes whatever else is already waiting, up to
+    batch_size. The second value is True when the stop sentinel came up.
+    """
+    batch = [tasks.get()]
+    if batch[0] is None:
+        return [], True
+    while len(batch) < batch_size:
+        try:
+            task = tasks.get_nowait()
+        except queue.Empty:
+            break
+        if task is None:
+            return batch, True
+        batch.append(task)
+    return batch, False
+
+
+def worker_main(worker_idx, pipeline_factory, threads, cores, batch_size, tasks, results):
+    pin_threads(threads, cores)
+    try:
+        pipeline = pipeline_factory()
+    except Exception as e:
+        results.put(("failed", worker_idx, repr(e)))
+        return
+    results.put(("ready", worker_idx, os.getpid()))
+
+    stop = False
+    while not stop:
+        batch, stop = next_batch(tasks, batch_size)
+        if not batch:
+            continue
+
+        frames = []
+        try:
+            frames = [attach_frame(task) for task in batch]
+            outputs = pipeline.process_batch([image for _, image in frames])
+            if len(outputs) != len(batch):
+                raise RuntimeError(f"process_batch returned {len(outputs)} outputs for {len(batch)} images")
+        except Exception as e:
+            for task in batch:
+                results.put(("error", task[0], repr(e)))
+        else:
+            for task, output in zip(batch, outputs):
+                results.put(("done", task[0], output))
+        finally:
+            # Drop the ImageInputs first, they're views on the segments
+            shms = [shm for shm, _ in frames]
+            del frames
+            for shm in shms:
+                try:
+                    shm.close()
+                except BufferError:
+                    # Something still holds a view on it, the mapping goes away
+                    # with that view then. The segment itself is unlinked by the main process
+                    pass
+
+    if hasattr(pipeline, "close"):
+        pipeline.close()
+
+
+class WorkerPool:
+    def __init__(self, pipeline_factory, workers=2, threads=None, batch_size=4, max_pending=None,
+                 pin_cores=False) -> None:
+        """
+        pipeline_factory is called once in every worker to load its models and has
+        to be picklable (a top level class or function, or a functools.partial of
+        one). What it returns needs a process_batch(images) method returning one
+        output per image, and optionally close().
+
+        threads defaults to the cores divided between the workers.
+        """
+        self.pipeline_factory = pipeline_factory
+        self.workers = workers
+        self.threads = threads or max(1, len(available_cores()) // workers)
+        self.batch_size = batch_size
+        self.max_pending = max_pending or workers * batch_size * 2
+        self.pin_cores = pin_cores
+
+        # spawn, since forking a process that has already started torch's
+        # thread pools can deadlock the child
+        self.context = multiprocessing.get_context("spawn")
+        self.tasks = None
+        self.results = None
+        self.processes = []
+
+        # seq -> SharedFrame of the images the workers haven't answered yet
+        self.frames = dict()
+
+    def start(self):
+        self.tasks = self.context.Queue()
+        self.results = self.context.Queue()
+        cores = split_cores(self.workers, self.threads) if self.pin_cores else None
+        if self.pin_cores and cores is None:
+            print(f"[INFO] Not enough cores to pin {self.workers} workers x {self.threads} threads, not pinning")
+
+        # The children inherit the environment when they start, before they import anything
+        saved = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+        os.environ.update({var: str(self.threads) for var in THREAD_ENV_VARS})
+        try:
+            for worker_idx in range(self.workers):
+                process = self.context.Process(
+                    target=worker_main, name=f"pipeline-worker-{worker_idx}", daemon=True,
+                    args=(worker_idx, self.pipeline_factory, self.threads, cores[worker_idx] if cores else None,
+                          self.batch_size, self.tasks, self.results))
+                process.start()
+                self.processes.append(process)
+        finally:
+            for var, value in saved.items():
+                if value is None:
+                    os.environ.pop(var, None)
+                else:
+                    os.environ[var] = value
+
+        # Wait until every worker has its models loaded
+        with metrics.stage("worker_startup", workers=self.workers):
+            for _ in range(self.workers):
+                message = self.receive()
+                if message[0] == "failed":
+                    self.close()
+                    raise RuntimeError(f"Worker {message[1]} failed to load the pipeline: {message[2]}")
+        print(f"[INFO] Started {self.workers} workers with {self.threads} threads each")
+        return self
+
+    def receive(self):
+        while True:
+            try:
+                return self.results.get(timeout=1.0)
+            except queue.Empty:
+                # A worker that died (e.g. killed for running out of memory)
+                # never answers, don't wait for it forever
+                for process in self.processes:
+                    if not process.is_alive():
+                        raise RuntimeError(f"Worker {process.name} exited with code {process.exitcode}")
+
+    def drain_results(self):
+        while True:
+            try:
+                self.results.get_nowait()
+            except queue.Empty:
+                return
+
+    def imap(self, images):
+        """
+        Runs every image (ImageInputs, e.g. a generator that decodes them) through
+        the workers and yields (path or name, output) in the order of images.
+        """
+        images = iter(images)
+        keys = dict()
+        done = dict()
+        next_seq, seq = 0, 0
+        exhausted = False
+
+        while True:
+            # Keep the workers fed, but never hold more than max_pending images
+            while not exhausted and len(self.frames) + len(done) < self.max_pending:
+                image = next(images, None)
+                if image is None:
+                    exhausted = True
+                    break
+                with metrics.stage("shared_memory_copy"):
+                    frame = SharedFrame(image)
+                self.frames[seq] = frame
+                keys[seq] = image.path or image.name
+                self.tasks.put(frame.task(seq))
+                seq += 1
+
+            while next_seq in done:
+                yield keys.pop(next_seq), done.pop(next_seq)
+                next_seq += 1
+
+            if not self.frames:
+                if exhausted:
+                    return
+                continue
+
+            status, done_seq, output = self.receive()
+            self.frames.pop(done_seq).release()
+            if status == "error":
+                raise RuntimeError(f"Worker failed on {keys[done_seq]}: {output}")
+            done[done_seq] = output
+
+    def close(self, timeout=30):
+        if self.tasks is not None:
+            # Images nobody is going to wait for anymore (imap stopped early)
+            # are dropped, then every worker gets a stop sentinel
+            while True:
+                try:
+                    self.tasks.get_nowait()
+                except queue.Empty:
+                    break
+            for process in self.processes:
+                if process.is_alive():
+                    self.tasks.put(None)
+
+            # A worker only exits once what it sent was read, so keep reading
+            deadline = time.perf_counter() + timeout
+            for process in self.processes:
+                while process.is_alive() and time.perf_counter() < deadline:
+                    self.drain_results()
+                    process.join(0.1)
+                if process.is_alive():
+                    process.terminate()
+        self.processes = []
+
+        for frame in self.frames.values():
+            frame.release()
+        self.frames = dict()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()